@@ -0,0 +1,37 @@
+# Data retrieval example using Python 3 that keeps a whole dataset in memory for analysis, in a fraction of the
+#   memory json.load() or response.json() needs. The records are streamed (see openfema/records.py) into a
+#   RecordStore (see openfema/recordstore.py) that keeps each field as one typed column: numbers in flat arrays,
+#   dates parsed once into timestamps and repeated text such as state and incidentType stored once per distinct
+#   value. Requires numpy, and pyarrow and pandas for the DataFrame at the end.
+
+# define URL for the Disaster Declarations Summaries endpoint
+baseUrl = "https://www.fema.gov/api/open/v2/DisasterDeclarationsSummaries"
+
+import numpy as np
+
+from openfema.recordstore import loadRecords
+
+# create a dictionary to define our parameters
+queryParameters = {
+    '$select': 'disasterNumber,declarationDate,declarationType,incidentType,state,designatedArea',
+    '$format': 'jsonl',                                                     # jsonl is the cheapest format to parse
+    '$allrecords': 'true',                                                  # set $allrecords to true to avoid dealing with pagination
+    '$metadata': 'off'
+}
+
+declarations = loadRecords(baseUrl, queryParameters)
+print(declarations)
+print(f'{sum(declarations.memoryUsage().values()) / 1e6:.1f} MB held in columns')
+
+# rows read like the dictionaries json.load() returns, the date already a datetime
+first = declarations[0]
+print(first['disasterNumber'], first.state, first.declarationDate.year)
+
+# columns come out as NumPy arrays without being copied, e.g. the declarations per year
+years = declarations.toNumpy('declarationDate').astype('datetime64[Y]').astype(int) + 1970
+for year, count in zip(*np.unique(years, return_counts=True)):
+    print(year, count)
+
+# or as a pandas DataFrame, with state, declarationType and incidentType as categoricals
+df = declarations.toPandas()
+print(df.groupby('incidentType', observed=True).size().sort_values(ascending=False).head(10))
@@ -5,13 +5,13 @@
 # define URL for the Disaster Declarations Summaries endpoint
 baseUrl = "https://www.fema.gov/api/open/v2/DisasterDeclarationsSummaries"
 
-import requests
-import csv
+import openfema.download
+import openfema.validate
 
 # create a dictionary to define our parameters
 queryParameters = {
     '$select': 'disasterNumber,declarationDate,declarationTitle,state',     # leave this parameter out if you want all fields
-    '$filter': 'state%20ne%20%27FL%27',                                     # for purposes of example, exclude Florida
+    '$filter': str(openfema.field('state') != 'FL'),                        # for purposes of example, exclude Florida, written as state ne 'FL'
     '$orderby': 'id',                                                       # order is unimportant to me, so I am ordering by id
     '$format': 'csv',                                                       
     '$allrecords': 'true',                                                  # set $allrecords to true to avoid dealing with pagination
@@ -21,41 +21,24 @@ queryParameters = {
 # location for where the query results are saved
 saveLocation = './out.csv'
 
-def saveLargeQuery(baseUrl, queryParameters, saveLocation):
-    try:
-        # issue the api call as a stream
-        with requests.get(baseUrl, params=queryParameters, stream=True) as response:
-            # raises an exception when there is a server or network error
-            response.raise_for_status() 
-
-            # creates a file with if none exists, otherwise overwrites it
-            #   we use the 'wb' mode to specify that we are writing as a binary so windows 
-            #   does not add unneeded carriage returns
-            with open(saveLocation, 'wb') as f:
-                for chunk in response.iter_content(): 
-                    # we iterate through the chunks and write them to the, you can apply 
-                    #   additional processing as well
-                    f.write(chunk)
-                print('File finished')
-    except:
-        # any additional logic to do when a request fails, such as trying again goes here
-        print(f'file could not be downloaded, server returned ${response.status_code}')
+# The download itself is handled by the shared openfema helper package in this folder (see openfema/download.py).
+#   It streams the data into a temporary file, checkpoints its progress and retries with exponential backoff
+#   when the connection drops, picking up after the last complete record rather than starting over. The file
+#   at saveLocation is only replaced once the download has finished.
+saveLargeQuery = openfema.download.saveLargeQuery
 
+# The saved file is counted and checked with openfema/validate.py, which memory maps the file and scans the
+#   raw bytes for record boundaries instead of loading or parsing the whole file, so large downloads are
+#   verified in seconds. Pass parse=True to also parse every record, spread over all CPU cores.
 def verifyCsvDownload(saveLocation):
-    try:
-        # opens the csv file using 'with/as' syntax which handles the closing of the file when needed
-        with open(saveLocation, "r") as csvfile:            
-            csv_reader = csv.reader(csvfile)
-            next(csv_reader, None)                          # skips the header row
-            record_count = sum(1 for row in csv_reader)     # count records
-            if(record_count <1):                            # if no records throw an exception
-                raise Exception("No data found in the specified file")
-        print(f'Record Count: {record_count}')
-    except Exception as error:                              # logic for displaying thrown exceptions
-        print(error)
-    except:                                                 # catch all error when something else goes wrong
-        print('The file was unable to be read, there may be something wrong with the file')
-        
+    result = openfema.validate.validateFile(saveLocation, 'csv')
+    if not result['valid']:
+        print(f"The file is not valid csv: {result['error']} at byte {result['firstBadOffset']}")
+    elif result['recordCount'] < 1:
+        print('No data found in the specified file')
+    else:
+        print(f"Record Count: {result['recordCount']}")
+
 # Run the dave method
 saveLargeQuery(baseUrl, queryParameters, saveLocation)
 
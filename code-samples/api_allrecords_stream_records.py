@@ -0,0 +1,38 @@
+# Data retrieval example using Python 3 that processes records one at a time as they arrive instead of saving 
+#   the response to a file or loading it all into memory with response.json(). The parsing is handled by the
+#   openfema helper package in this folder (see openfema/records.py), memory use stays flat no matter how many
+#   records the query returns. Any of the jsonl, csv, jsona or json formats can be used.
+
+# define URL for the Disaster Declarations Summaries endpoint
+baseUrl = "https://www.fema.gov/api/open/v2/DisasterDeclarationsSummaries"
+
+from collections import Counter
+
+import openfema
+
+# create a dictionary to define our parameters
+queryParameters = {
+    '$select': 'disasterNumber,declarationDate,declarationTitle,state',     # leave this parameter out if you want all fields
+    '$filter': str(openfema.field('state') != 'FL'),                        # for purposes of example, exclude Florida, written as state ne 'FL'
+    '$orderby': 'id',                                                       # order is unimportant to me, so I am ordering by id
+    '$format': 'jsonl',                                                     # jsonl is the cheapest format to parse
+    '$allrecords': 'true',                                                  # set $allrecords to true to avoid dealing with pagination
+    '$metadata': 'off'
+}
+
+# iterRecords yields each record as a dictionary, here we simply count the declarations per state. The Metrics
+#   block times where the download spends its time (connecting, waiting for the response, transferring, parsing)
+#   and prints a progress line with the rate and ETA every few seconds (see openfema/metrics.py). The numbers are
+#   saved to metrics.json afterwards, leave the block out and the helpers skip the bookkeeping entirely.
+declarationsByState = Counter()
+with openfema.Metrics() as metrics:
+    metrics.expect('records', openfema.getRecordCount(baseUrl, queryParameters))
+    metrics.startReporting(5)
+    for record in openfema.iterRecords(baseUrl, queryParameters):
+        declarationsByState[record['state']] += 1
+metrics.writeJson('metrics.json')
+print(metrics.progressLine())
+
+print(f'Record Count: {sum(declarationsByState.values())}')
+for state, count in declarationsByState.most_common(10):
+    print(state, count)
@@ -0,0 +1,36 @@
+# Data retrieval example using Python 3 that downloads several datasets at the same time. Pulling datasets one
+#   after another takes as long as all of the downloads added together, run side by side the whole batch takes
+#   about as long as the slowest dataset.
+#
+#   The work is done by the openfema helper package in this folder (see openfema/orchestrator.py). Each dataset or
+#   query in the manifest is a job; the jobs run concurrently under asyncio with a limit on how many run at once
+#   and on how many requests are made per second, please be considerate of the shared API. Every job uses the
+#   same resumable streaming download as the api_allrecords_stream_* samples, and progress is printed as it goes.
+#   The manifest can also be kept in a JSON file and its path passed to fetchAll() instead.
+
+from datetime import datetime
+
+from openfema.orchestrator import fetchAll
+
+# the datasets (or queries) to download. Without a filter or select the published bulk file of the dataset is
+#   downloaded, otherwise the query is streamed. format can be jsonl, csv, json, jsona or parquet (needs pyarrow)
+manifest = [
+    {"dataset": "FemaRegions", "version": 2, "format": "json"},
+    {"dataset": "DisasterDeclarationsSummaries", "version": 2, "format": "csv"},
+    {"name": "HousingAssistanceOwnersTX", "dataset": "HousingAssistanceOwners", "version": 2,
+     "filter": "state eq 'TX'", "format": "jsonl"},
+    {"name": "PublicAssistanceFundedProjectsRecent", "dataset": "PublicAssistanceFundedProjectsDetails", "version": 1,
+     "select": ["disasterNumber", "projectAmount", "federalShareObligated", "lastObligationDate"],
+     "filter": "lastObligationDate ge '2024-01-01'", "format": "jsonl"},
+]
+
+# where the downloads are saved, each file is named after its entry
+saveDirectory = "openfema-downloads"
+
+print("START " + str(datetime.now()))
+jobs = fetchAll(manifest, saveDirectory, concurrency=4, requestsPerSecond=5)
+
+failed = [job for job in jobs if job.status != 'done']
+print("END " + str(datetime.now()) + ", " + str(len(jobs) - len(failed)) + " of " + str(len(jobs)) + " downloads finished")
+for job in failed:
+    print(f"{job.name} failed: {job.error}")
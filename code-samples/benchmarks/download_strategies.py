@@ -0,0 +1,251 @@
+# Compares the ways the samples download a whole dataset, against the local mock server so the numbers do not
+#   depend on fema.gov or on the internet connection of the day. Every strategy downloads the same synthetic
+#   dataset and is reported with:
+#     seconds      - wall clock time of the download
+#     MB/s         - size of the saved file over the wall clock time
+#     records/s    - records downloaded over the wall clock time
+#     peak RSS     - the most memory the download process used, including the baseline of the interpreter and
+#                    imports (printed after the results)
+#     CPU s        - user plus system CPU time of the download process
+#
+#   Each strategy runs in a process of its own, so peak RSS and CPU time are its own and not the mock server's
+#   (which runs in this process, with every record encoded up front so it is never the bottleneck). The saved
+#   file is checked afterwards: a wrong record count is reported.
+#
+#   Strategies:
+#     paging-json       - parallel $top/$skip pages joined into one json file (openfema/paging.py)
+#     paging-sequential - the same, one page at a time as the original paging samples do
+#     allrecords-json   - one $allrecords=true json response read into memory and written out
+#                         (api_allrecords_jsonoutput.py)
+#     stream-jsonl      - $allrecords streamed to disk (openfema/download.py), also stream-csv and stream-jsona
+#     records-jsonl     - $allrecords parsed one record at a time as it arrives (openfema/records.py)
+#     stream-parquet    - $allrecords jsonl converted to parquet row groups as it arrives (openfema/parquetconvert.py)
+#     file-parquet      - the published bulk .parquet file, also file-csv
+#
+#   --latency and --bandwidth simulate a distant or slow connection, --json saves the results so runs can be
+#   compared. The parquet strategies need pyarrow and are skipped without it. Peak RSS is not available on
+#   Windows.
+#
+#   python3 benchmarks/download_strategies.py --records 200000 --latency 50 --bandwidth 20
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+# make the openfema helper package in the parent code-samples folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from openfema.download import streamDownload
+from openfema.mockserver import FIELDS, MockOpenFemaServer
+from openfema.paging import downloadPages
+from openfema.records import iterRecords
+from openfema.validate import countFileRecords
+
+ALLRECORDS = {'$allrecords': 'true', '$metadata': 'off'}
+
+
+def pagingJson(url, output, workers):
+    return downloadPages(url, {}, output, rootName=url.rsplit('/', 1)[1], maxWorkers=workers, format='json')
+
+
+def pagingSequential(url, output, workers):
+    return pagingJson(url, output, 1)
+
+
+def allRecordsJson(url, output, workers):
+    result = requests.get(url, params={**ALLRECORDS, '$format': 'json'}).content
+    with open(output, 'wb') as f:
+        f.write(result)
+
+
+def streamFormat(format):
+    def stream(url, output, workers):
+        streamDownload(url, output, {**ALLRECORDS, '$format': format})
+    return stream
+
+
+def recordsJsonl(url, output, workers):
+    recordCount = 0
+    for _ in iterRecords(url, {**ALLRECORDS, '$format': 'jsonl'}):
+        recordCount += 1
+    return recordCount
+
+
+def streamParquet(url, output, workers):
+    from openfema.parquetconvert import downloadToParquet
+    downloadToParquet(url, {}, output)
+
+
+def bulkFile(format):
+    def download(url, output, workers):
+        streamDownload(f'{url}.{format}', output, format='file')
+    return download
+
+
+# name -> (download function, format of the saved file)
+STRATEGIES = {
+    'paging-json': (pagingJson, 'json'),
+    'paging-sequential': (pagingSequential, 'json'),
+    'allrecords-json': (allRecordsJson, 'json'),
+    'stream-jsonl': (streamFormat('jsonl'), 'jsonl'),
+    'stream-csv': (streamFormat('csv'), 'csv'),
+    'stream-jsona': (streamFormat('jsona'), 'jsona'),
+    'records-jsonl': (recordsJsonl, None),
+    'stream-parquet': (streamParquet, 'parquet'),
+    'file-parquet': (bulkFile('parquet'), 'parquet'),
+    'file-csv': (bulkFile('csv'), 'csv'),
+}
+
+PARQUET_STRATEGIES = ('stream-parquet', 'file-parquet')
+
+
+# The number of records in a saved file, read from the footer for parquet
+def savedRecordCount(path, format):
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    return countFileRecords(path, format)
+
+
+# Run one strategy in a child process, which measures itself. Returns a dict of results.
+def measure(name, url, output, workers, recordCount):
+    command = [sys.executable, os.path.abspath(__file__), '--child', name, '--url', url, '--output', output,
+               '--workers', str(workers)]
+    process = subprocess.run(command, stdout=subprocess.PIPE)
+    if process.returncode != 0:
+        return {'strategy': name, 'error': f'exited with {process.returncode}'}
+    result = {'strategy': name, **json.loads(process.stdout)}
+
+    format = STRATEGIES[name][1]
+    if format is not None:
+        result['records'] = savedRecordCount(output, format)
+        result['bytes'] = os.path.getsize(output)
+    result['complete'] = result['records'] == recordCount
+    return result
+
+
+def printResult(result):
+    if 'error' in result:
+        print(f'{result["strategy"]:<18} {result["error"]}')
+        return
+    if result['bytes'] is None:
+        size = throughput = f'{"-":>9}'
+    else:
+        megabytes = result['bytes'] / (1024 * 1024)
+        size, throughput = f'{megabytes:>9.1f}', f'{megabytes / result["seconds"]:>9.1f}'
+    rss = f'{result["peakRss"] / (1024 * 1024):>9.1f}' if result['peakRss'] is not None else f'{"-":>9}'
+    check = '' if result['complete'] else f'  only {result["records"]} records!'
+    print(f'{result["strategy"]:<18} {result["seconds"]:>8.2f} {size} {throughput} '
+          f'{result["records"] / result["seconds"]:>11.0f} {rss} {result["cpuSeconds"]:>8.2f}{check}')
+
+
+def cpuTime():
+    times = os.times()
+    return times.user + times.system
+
+
+# The most memory this process has used (its own, the parent's memory is not counted): VmHWM on Linux, the
+#   resource module elsewhere, None where neither is available
+def peakRss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+# The download done in the child process. Interpreter start up and imports are left out of the time and CPU
+#   time, the memory they take is reported as baselineRss. Prints the measurements as JSON.
+def runChild(arguments):
+    function = STRATEGIES[arguments.child][0]
+    baselineRss = peakRss()
+    cpuBefore = cpuTime()
+    start = time.perf_counter()
+    recordCount = function(arguments.url, arguments.output, arguments.workers)
+    print(json.dumps({'seconds': time.perf_counter() - start, 'cpuSeconds': cpuTime() - cpuBefore,
+                      'peakRss': peakRss(), 'baselineRss': baselineRss, 'records': recordCount, 'bytes': None}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the dataset download strategies against a local mock server')
+    parser.add_argument('--records', type=int, default=200000, help='number of records in the synthetic dataset')
+    parser.add_argument('--strategies', default=','.join(STRATEGIES), help='comma separated strategies to run')
+    parser.add_argument('--workers', type=int, default=4, help='parallel requests used by paging-json')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds before every response')
+    parser.add_argument('--bandwidth', type=float, default=0, help='MB/s the server sends at, 0 for no limit')
+    parser.add_argument('--compress', action='store_true', help='gzip the API responses')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each strategy, the fastest is reported')
+    parser.add_argument('--json', help='also save the results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+    if arguments.child:
+        runChild(arguments)
+        return
+
+    names = [name.strip() for name in arguments.strategies.split(',') if name.strip()]
+    unknown = [name for name in names if name not in STRATEGIES]
+    if unknown:
+        parser.error(f'unknown strategies: {", ".join(unknown)}')
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        skipped = [name for name in names if name in PARQUET_STRATEGIES]
+        if skipped:
+            print(f'pyarrow is not installed, skipping {", ".join(skipped)}')
+        names = [name for name in names if name not in PARQUET_STRATEGIES]
+
+    bandwidth = arguments.bandwidth * 1024 * 1024 if arguments.bandwidth else None
+    results = []
+    with tempfile.TemporaryDirectory() as folder, \
+            MockOpenFemaServer(recordCount=arguments.records, compress=arguments.compress,
+                               latency=arguments.latency / 1000, bandwidth=bandwidth, keepEncoded=True) as server:
+        # the bulk files and the encoded records are prepared before anything is timed
+        for name in names:
+            if name.startswith('file-'):
+                server.addDatasetFile(name.split('-', 1)[1], folder)
+        server.encodedRecords('jsonl', FIELDS)
+        server.encodedRecords('csv', FIELDS)
+        print(f'{arguments.records} records, latency {arguments.latency:g} ms, '
+              f'bandwidth {arguments.bandwidth or "unlimited"} MB/s{", gzip" if arguments.compress else ""}')
+        print(f'{"strategy":<18} {"seconds":>8} {"MB":>9} {"MB/s":>9} {"records/s":>11} {"peak RSS":>9} {"CPU s":>8}')
+        for name in names:
+            output = os.path.join(folder, f'{name}.out')
+            runs = []
+            for _ in range(arguments.repeat):
+                runs.append(measure(name, server.datasetUrl, output, arguments.workers, arguments.records))
+                if os.path.exists(output):
+                    os.remove(output)
+                if 'error' in runs[-1]:
+                    break
+            result = min(runs, key=lambda run: run.get('seconds', float('inf')))
+            printResult(result)
+            results.append(result)
+
+    baselines = [result['baselineRss'] for result in results if result.get('baselineRss')]
+    if baselines:
+        print(f'peak RSS includes about {min(baselines) / (1024 * 1024):.1f} MB for the interpreter and imports')
+
+    if arguments.json:
+        with open(arguments.json, 'w') as f:
+            json.dump({'records': arguments.records, 'latency': arguments.latency, 'bandwidth': arguments.bandwidth,
+                       'compress': arguments.compress, 'workers': arguments.workers, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,36 +2,39 @@
 #   and displays the output in the browser. 
 
 import json
-import requests
 import folium
 import webbrowser
 import os
+import sys
 
-# define the api query and variables
-baseURL = "https://www.fema.gov/api/open/v2/FemaRegions?"
-fileName = "geojson.html"
+# make the openfema helper package in the parent code-samples folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from openfema.cache import ResponseCache
+from openfema.geometry import regionLayer
 
-# call api 
-response = requests.get(baseURL + '$metadata=off')
-jsonData = response.json()
+# define the map variables
+fileName = "geojson.html"
+zoom = 4
 
-# initialize a feature collection to hold all regions 
-featureCollection = {
-    'type': 'FeatureCollection',
-    'features': []
-}
+# call api. The regions rarely change, so the response is kept in a local cache (see openfema/cache.py) and
+#   only downloaded again when FemaRegions has been refreshed since, repeat runs do not need to download it
+cache = ResponseCache(".openfema-cache")
+regions = regionLayer(cache)
 
-# iterate through regions and add geometry to feature follection
-for region in jsonData['FemaRegions']:
-    if(region["regionGeometry"]):
-        featureCollection['features'].append(region["regionGeometry"])
+# the region geometries simplified for the zoom level the map opens at (see openfema/geometry.py). Detail
+#   finer than a pixel is left out, which keeps the html file small and quick to draw. The simplified
+#   geometries are kept in the cache folder as well.
+featureCollection = regions.featureCollection(zoom)
 
 # initialize the map
-m = folium.Map(location=(43,-100), zoom_start=4)
+m = folium.Map(location=(43,-100), zoom_start=zoom)
 # add the geoJSON features
 folium.GeoJson(featureCollection, name="regions").add_to(m)
 # save to file
 m.save(fileName)
 
+# Records with coordinates can be placed in regions in bulk, here Washington DC, Houston and Honolulu
+print(regions.assign([-77.04, -95.37, -157.86], [38.91, 29.76, 21.31]))
+
 # Open the map file in default browser
-webbrowser.open('file://' + os.path.realpath(fileName) )
\ No newline at end of file
+webbrowser.open('file://' + os.path.realpath(fileName) )
@@ -0,0 +1,19 @@
+# Shared helpers used by the OpenFEMA Python code samples. The individual sample scripts in code-samples
+#   stay short and readable by importing the heavier lifting (parallel paging, etc.) from here.
+#
+# From a script in the code-samples folder simply "import openfema". From a script in one of the sub folders
+#   (parquet-samples, api-data-update-samples, ...) add the code-samples folder to sys.path first.
+#
+# Modules that need pyarrow (parquetconvert, ...) are not imported here so the rest of the package works without
+#   it, import them directly, e.g. "from openfema.parquetconvert import downloadToParquet".
+
+from .client import OpenFemaClient, getClient, setClient, useClient
+from .metrics import Metrics, getMetrics, setMetrics
+from .paging import getRecordCount, planPages, fetchPage, fetchPagesInOrder, downloadPages, PageWriter
+from .download import streamDownload, saveLargeQuery, DownloadError
+from .records import iterRecords, iterFileRecords, parseRecords, RecordParseError
+from .sync import SyncStore, syncDataset
+from .freshness import FreshnessChecker, staleSyncedDatasets
+from .cache import ResponseCache
+from .query import Query, field, allOf, anyOf
+from .orchestrator import fetchAll, runJobs, loadManifest
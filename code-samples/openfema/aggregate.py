@@ -0,0 +1,253 @@
+# Grouped counts, sums, means, minimums and maximums over files far larger than memory, such as the 2M+ row
+#   FimaNfipClaims and the NFIP policies datasets. Rather than loading the whole dataset into a DataFrame and
+#   calling groupby, the file is read a chunk at a time and only the columns the aggregation needs:
+#     parquet - in batches of row groups
+#     csv     - with the pyarrow csv reader, the group columns read as text (keeping e.g. leading zeros of
+#               countyCode) and the value columns as numbers
+#     jsonl   - with the pyarrow json reader, the column types taken from the first records of the file
+#   Each chunk is reduced to a small partial result with the pyarrow compute kernels (group_by/aggregate), and
+#   the partial results are merged into the final one, so memory use depends on the number of groups and the
+#   chunk size, not on the size of the file.
+#
+#   aggregateFiles('FimaNfipClaims.parquet', ['state'], sums=['totalPayments'], means=['totalPayments'],
+#                  computed={'totalPayments': TotalOf('amountPaidOnBuildingClaim', 'amountPaidOnContentsClaim')})
+#
+#   computed adds columns worked out from each chunk before it is grouped (TotalOf, SfhaOf or any picklable
+#   callable taking a pyarrow Table and returning an array, with a .columns attribute naming what it reads and
+#   optionally a .columnTypes dict of the pyarrow types to read them as from csv or jsonl).
+#
+#   With processes=N the work is spread over N worker processes: a list of files one file each, a parquet file
+#   by row groups and a single csv or jsonl file by byte ranges that start and end on record boundaries (found
+#   with validate.py). Returns a pyarrow Table, call .to_pandas() on it for a DataFrame.
+#
+#   Requires pyarrow (pip install pyarrow) and numpy.
+
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.json as pajson
+import pyarrow.parquet as pq
+
+from .validate import scanFile
+
+# rows per parquet batch
+CHUNK_ROWS = 250000
+
+# bytes per csv or jsonl block
+CHUNK_BYTES = 16 * 1024 * 1024
+
+FORMATS = {'.parquet': 'parquet', '.csv': 'csv', '.jsonl': 'jsonl'}
+
+
+# The sum of several columns, missing values counted as 0, e.g. the total paid on a claim
+class TotalOf:
+    def __init__(self, *columns):
+        self.columns = columns
+        self.columnTypes = {column: pa.float64() for column in columns}
+
+    def __call__(self, table):
+        total = None
+        for column in self.columns:
+            values = pc.fill_null(pc.cast(table.column(column), pa.float64()), 0.0)
+            total = values if total is None else pc.add(total, values)
+        return total
+
+
+# 'SFHA' when the flood zone starts with A or V (a Special Flood Hazard Area), 'Non-SFHA' otherwise and
+#   'Unknown' when there is no flood zone
+class SfhaOf:
+    def __init__(self, column='ratedFloodZone'):
+        self.columns = (column,)
+        self.columnTypes = {column: pa.string()}
+
+    def __call__(self, table):
+        zone = pc.cast(table.column(self.columns[0]), pa.string())
+        firstLetter = pc.utf8_upper(pc.utf8_slice_codeunits(zone, 0, 1))
+        label = pc.if_else(pc.is_in(firstLetter, value_set=pa.array(['A', 'V'])), 'SFHA', 'Non-SFHA')
+        missing = pc.fill_null(pc.equal(zone, ''), True)
+        return pc.if_else(missing, 'Unknown', label)
+
+
+# The aggregations computed for every chunk. Means are kept as a sum and a count until the end.
+def partialAggregations(sums, means, mins, maxs):
+    return [(column, 'sum') for column in dict.fromkeys([*sums, *means])] + \
+           [(column, 'count') for column in means] + \
+           [(column, 'min') for column in mins] + \
+           [(column, 'max') for column in maxs]
+
+
+# Reduce a chunk to one row per group: count_all plus <column>_<function> for each partial aggregation
+def partialAggregate(table, groupBy, aggregations):
+    return table.group_by(groupBy).aggregate([([], 'count_all'), *aggregations])
+
+
+# Merge partial results into one partial result: counts and sums add up, mins and maxes are taken again
+def combinePartials(partials, groupBy):
+    partials = [partial for partial in partials if partial is not None]
+    if len(partials) == 1:
+        return partials[0]
+    merged = pa.concat_tables(partials, promote_options='permissive')
+    valueNames = [name for name in merged.column_names if name not in groupBy]
+    functions = ['min' if name.endswith('_min') else 'max' if name.endswith('_max') else 'sum' for name in valueNames]
+    merged = merged.group_by(groupBy).aggregate(list(zip(valueNames, functions)))
+    # aggregate() appends the function to each name (count_all_sum), take it off again
+    return merged.rename_columns([name if name in groupBy else name.rsplit('_', 1)[0] for name in merged.column_names])
+
+
+# Turn the merged partial result into count, <column>_sum, <column>_mean, <column>_min and <column>_max
+def finishPartial(partial, groupBy, sums, means, mins, maxs):
+    if partial is None:
+        return pa.table({name: [] for name in [*groupBy, 'count']})
+    result = {name: partial.column(name) for name in groupBy}
+    result['count'] = partial.column('count_all')
+    for column in sums:
+        result[f'{column}_sum'] = partial.column(f'{column}_sum')
+    for column in means:
+        result[f'{column}_mean'] = pc.divide(pc.cast(partial.column(f'{column}_sum'), pa.float64()),
+                                             partial.column(f'{column}_count'))
+    for column in mins:
+        result[f'{column}_min'] = partial.column(f'{column}_min')
+    for column in maxs:
+        result[f'{column}_max'] = partial.column(f'{column}_max')
+    return pa.table(result).sort_by([(name, 'ascending') for name in groupBy])
+
+
+# The column types for reading csv or jsonl. The types already known (value columns are numbers) are kept,
+#   any other column is text in a csv file and in a jsonl file has the type of its values in the first records.
+def textColumnTypes(path, format, columns, knownTypes):
+    types = dict(knownTypes)
+    otherColumns = [column for column in columns if column not in types]
+    if format == 'csv':
+        types.update({column: pa.string() for column in otherColumns})
+        return types
+
+    samples = {}
+    with open(path, 'rb') as f:
+        for lineNumber, line in enumerate(f):
+            if lineNumber >= 1000:
+                break
+            if line.strip():
+                record = json.loads(line)
+                for column in otherColumns:
+                    samples.setdefault(column, set()).add(type(record.get(column)))
+    for column in otherColumns:
+        seen = samples.get(column, set()) - {type(None)}
+        if seen and seen <= {int}:
+            types[column] = pa.int64()
+        elif seen and seen <= {int, float}:
+            types[column] = pa.float64()
+        elif seen == {bool}:
+            types[column] = pa.bool_()
+        else:
+            types[column] = pa.string()
+    return types
+
+
+# The byte range [start, end) of a file, memory mapped rather than copied
+def fileRange(path, start, end):
+    return pa.BufferReader(pa.memory_map(path, 'r').read_at(end - start, start))
+
+
+# Yield the chunks of one unit of work as pyarrow Tables holding only the columns that are needed.
+#   A unit is (path, format, part): the row groups to read for parquet, a (start, end) byte range otherwise,
+#   part None meaning the whole file.
+def iterChunks(unit, columns, knownTypes, chunkRows, chunkBytes):
+    path, format, part = unit
+    if format == 'parquet':
+        parquetFile = pq.ParquetFile(path)
+        for batch in parquetFile.iter_batches(batch_size=chunkRows, row_groups=part, columns=columns):
+            yield pa.Table.from_batches([batch])
+        return
+
+    types = textColumnTypes(path, format, columns, knownTypes)
+    source = path if part is None else fileRange(path, *part)
+    if format == 'csv':
+        header = None
+        if part is not None:
+            # a range after the header row, the column names come from the start of the file
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                header = next(csv.reader(f))
+        reader = pacsv.open_csv(source, read_options=pacsv.ReadOptions(column_names=header, block_size=chunkBytes),
+                                convert_options=pacsv.ConvertOptions(include_columns=columns, column_types=types))
+    else:
+        schema = pa.schema([(column, types[column]) for column in columns])
+        reader = pajson.open_json(source,
+                                  read_options=pajson.ReadOptions(block_size=chunkBytes),
+                                  parse_options=pajson.ParseOptions(explicit_schema=schema,
+                                                                    unexpected_field_behavior='ignore'))
+    for batch in reader:
+        yield pa.Table.from_batches([batch])
+
+
+# Aggregate one unit of work down to a partial result. Runs in a worker process in multiprocessing mode.
+def aggregateUnit(unit, groupBy, sums, means, mins, maxs, computed, chunkRows, chunkBytes):
+    computed = computed or {}
+    valueColumns = list(dict.fromkeys([*sums, *means, *mins, *maxs]))
+    sourceColumns = [column for name, function in computed.items() for column in function.columns]
+    columns = list(dict.fromkeys(column for column in [*groupBy, *valueColumns, *sourceColumns]
+                                 if column not in computed))
+    aggregations = partialAggregations(sums, means, mins, maxs)
+    knownTypes = {column: pa.float64() for column in valueColumns if column not in computed}
+    for function in computed.values():
+        knownTypes.update(getattr(function, 'columnTypes', {}))
+
+    partial = None
+    for table in iterChunks(unit, columns, knownTypes, chunkRows, chunkBytes):
+        for name, function in computed.items():
+            table = table.append_column(name, function(table))
+        chunkPartial = partialAggregate(table.select([*groupBy, *valueColumns]), groupBy, aggregations)
+        partial = chunkPartial if partial is None else combinePartials([partial, chunkPartial], groupBy)
+    return partial
+
+
+def detectFileFormat(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f'cannot tell the format of {path}, pass format= (parquet, csv or jsonl)')
+    return FORMATS[extension]
+
+
+# Split the files into units of work: one per file, or for a single file per row group batch or byte range
+def planUnits(paths, format, processes):
+    units = []
+    for path in paths:
+        fileFormat = format or detectFileFormat(path)
+        if processes <= 1 or len(paths) >= processes:
+            units.append((path, fileFormat, None))
+        elif fileFormat == 'parquet':
+            rowGroups = list(range(pq.ParquetFile(path).num_row_groups))
+            perUnit = max(1, -(-len(rowGroups) // (processes * 2)))
+            units.extend((path, fileFormat, rowGroups[i:i + perUnit]) for i in range(0, len(rowGroups), perUnit))
+        else:
+            size = os.path.getsize(path)
+            _, dataStart, dataEnd, splits = scanFile(path, fileFormat,
+                                                     splitEvery=max(CHUNK_BYTES, size // (processes * 2)))
+            edges = [dataStart, *[split for split in splits if split > dataStart], dataEnd]
+            units.extend((path, fileFormat, (start, end)) for start, end in zip(edges, edges[1:]) if end > start)
+    return units
+
+
+# Group the records of one or more files by the groupBy columns and compute a count of records plus the sum,
+#   mean, min and max of the requested columns. processes > 1 spreads the work over that many processes.
+def aggregateFiles(paths, groupBy, sums=(), means=(), mins=(), maxs=(), computed=None, format=None, processes=None,
+                   chunkRows=CHUNK_ROWS, chunkBytes=CHUNK_BYTES):
+    paths = [paths] if isinstance(paths, (str, os.PathLike)) else list(paths)
+    groupBy, sums, means, mins, maxs = list(groupBy), list(sums), list(means), list(mins), list(maxs)
+    processes = processes or 1
+    units = planUnits(paths, format, processes)
+    arguments = (groupBy, sums, means, mins, maxs, computed, chunkRows, chunkBytes)
+
+    if processes <= 1 or len(units) <= 1:
+        partials = [aggregateUnit(unit, *arguments) for unit in units]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(units))) as executor:
+            partials = list(executor.map(aggregateUnit, units, *([argument] * len(units) for argument in arguments)))
+
+    partials = [partial for partial in partials if partial is not None]
+    partial = combinePartials(partials, groupBy) if partials else None
+    return finishPartial(partial, groupBy, sums, means, mins, maxs)
@@ -0,0 +1,240 @@
+# A local disk cache for API responses, so reference data that rarely changes (FemaRegions, the DataSets
+#   metadata, a slice of DisasterDeclarationsSummaries used again and again in a notebook) is only downloaded
+#   when it has actually changed.
+#
+#   cache = ResponseCache('.openfema-cache')
+#   regions = cache.getJson('https://www.fema.gov/api/open/v2/FemaRegions', {'$metadata': 'off'})
+#
+#   Responses are keyed on the endpoint and the query parameters, normalized so the same query written two
+#   different ways (parameters in another order, in the url or in params) finds the same entry. Before a cached
+#   response is used it is checked, cheapest first:
+#     1. entries younger than maxAge seconds are used as they are
+#     2. the dataset's lastDataSetRefresh (one DataSets call, cached for a few minutes and shared by every
+#        dataset, see freshness.py) - unchanged since the entry was stored means the entry is current
+#     3. a conditional request with If-None-Match / If-Modified-Since when the server sent an ETag or
+#        Last-Modified, a 304 Not Modified answer costs no body
+#   and otherwise the response is downloaded again.
+#
+#   Bodies are stored by the SHA-256 of their content under <directory>/bodies, so identical responses share
+#   one file, with an SQLite index alongside. When the bodies take up more than maxBytes the least recently used
+#   entries are removed.
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from .client import getClient
+from .freshness import FreshnessChecker
+
+# 1 GB
+MAX_BYTES = 1024 * 1024 * 1024
+
+READ_SIZE = 128 * 1024
+
+# metadata endpoints are checked with conditional requests only, their freshness is not in DataSets
+METADATA_ENDPOINTS = ('DataSets', 'DataSetFields')
+
+
+# Split a url plus parameters into the endpoint and a sorted list of (name, value) pairs. Parameters already
+#   in the url are merged with params, names and values have surrounding blanks removed and empty ones are
+#   dropped. Returns (cacheKey, endpoint, parameters).
+def normalizeRequest(url, params=None):
+    parts = urlsplit(url)
+    endpoint = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), '', ''))
+    merged = dict(parse_qsl(parts.query, keep_blank_values=True))
+    merged.update(params or {})
+    parameters = sorted((str(name).strip(), str(value).strip()) for name, value in merged.items()
+                        if str(name).strip() and value is not None and str(value).strip() != '')
+    cacheKey = hashlib.sha256(f'{endpoint}?{urlencode(parameters)}'.encode()).hexdigest()
+    return cacheKey, endpoint, parameters
+
+
+# The (baseUrl, name, version) of a dataset endpoint such as https://www.fema.gov/api/open/v2/FemaRegions,
+#   or None for anything else
+def datasetOfEndpoint(endpoint):
+    match = re.fullmatch(r'(.*/)v(\d+)/(\w+)', endpoint)
+    if not match:
+        return None
+    return match.group(1), match.group(3), int(match.group(2))
+
+
+class ResponseCache:
+    def __init__(self, directory, maxBytes=MAX_BYTES, maxAge=0, checkDatasetRefresh=True, timeout=(30, 300)):
+        self.directory = directory
+        self.bodyDirectory = os.path.join(directory, 'bodies')
+        os.makedirs(self.bodyDirectory, exist_ok=True)
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.checkDatasetRefresh = checkDatasetRefresh
+        self.timeout = timeout
+        self.checkers = {}              # baseUrl -> FreshnessChecker
+        self.stats = {'hits': 0, 'revalidated': 0, 'downloads': 0, 'evicted': 0}
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS entries (
+                                       cache_key TEXT PRIMARY KEY,
+                                       url TEXT NOT NULL,
+                                       body_hash TEXT NOT NULL,
+                                       size INTEGER NOT NULL,
+                                       etag TEXT,
+                                       last_modified TEXT,
+                                       dataset_refresh TEXT,
+                                       stored_at REAL NOT NULL,
+                                       last_used REAL NOT NULL)''')
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def bodyPath(self, bodyHash):
+        return os.path.join(self.bodyDirectory, bodyHash[:2], bodyHash)
+
+    # lastDataSetRefresh of the dataset behind an endpoint as a string, or None when it cannot be told
+    def datasetRefresh(self, endpoint):
+        dataset = datasetOfEndpoint(endpoint)
+        if not self.checkDatasetRefresh or dataset is None or dataset[1] in METADATA_ENDPOINTS:
+            return None
+        baseUrl, name, version = dataset
+        checker = self.checkers.get(baseUrl)
+        if checker is None:
+            checker = self.checkers[baseUrl] = FreshnessChecker(baseUrl)
+        refreshed = checker.refreshTimes([(name, version)])[(name, version)]
+        return refreshed.isoformat() if refreshed else None
+
+    def lookup(self, cacheKey):
+        row = self.connection.execute('''SELECT body_hash, etag, last_modified, dataset_refresh, stored_at
+                                         FROM entries WHERE cache_key = ?''', (cacheKey,)).fetchone()
+        if row is None or not os.path.exists(self.bodyPath(row[0])):
+            return None
+        return dict(zip(('bodyHash', 'etag', 'lastModified', 'datasetRefresh', 'storedAt'), row))
+
+    def touch(self, cacheKey, **changes):
+        assignments = ''.join(f', {column} = ?' for column in changes)
+        self.connection.execute(f'UPDATE entries SET last_used = ?{assignments} WHERE cache_key = ?',
+                                (time.time(), *changes.values(), cacheKey))
+        self.connection.commit()
+
+    # Stream a response body into the body store under the hash of its content, returns (hash, size)
+    def storeBody(self, response):
+        digest = hashlib.sha256()
+        size = 0
+        handle, temporaryPath = tempfile.mkstemp(dir=self.bodyDirectory, suffix='.part')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                for data in response.iter_content(READ_SIZE):
+                    digest.update(data)
+                    f.write(data)
+                    size += len(data)
+            bodyHash = digest.hexdigest()
+            os.makedirs(os.path.dirname(self.bodyPath(bodyHash)), exist_ok=True)
+            os.replace(temporaryPath, self.bodyPath(bodyHash))
+        finally:
+            if os.path.exists(temporaryPath):
+                os.remove(temporaryPath)
+        return bodyHash, size
+
+    # Returns the path of a file holding the current response to the request, downloading it only if the
+    #   cached copy is missing or out of date. Read it, or pass it to records.iterFileRecords(), but do not
+    #   change it.
+    def getPath(self, url, params=None):
+        with self.lock:
+            cacheKey, endpoint, parameters = normalizeRequest(url, params)
+            entry = self.lookup(cacheKey)
+            refreshed = None
+            if entry is not None:
+                if time.time() - entry['storedAt'] <= self.maxAge:
+                    return self.hit(cacheKey, entry, 'hits')
+                refreshed = self.datasetRefresh(endpoint)
+                if refreshed is not None and refreshed == entry['datasetRefresh']:
+                    return self.hit(cacheKey, entry, 'hits')
+            else:
+                refreshed = self.datasetRefresh(endpoint)
+
+            headers = {}
+            if entry is not None and entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry is not None and entry['lastModified']:
+                headers['If-Modified-Since'] = entry['lastModified']
+            with getClient().get(endpoint, params=parameters, headers=headers, stream=True,
+                                 timeout=self.timeout) as response:
+                if response.status_code == 304 and entry is not None:
+                    return self.hit(cacheKey, entry, 'revalidated', stored_at=time.time(), dataset_refresh=refreshed)
+                response.raise_for_status()
+                bodyHash, size = self.storeBody(response)
+                etag, lastModified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+            now = time.time()
+            self.connection.execute('''INSERT OR REPLACE INTO entries
+                                           (cache_key, url, body_hash, size, etag, last_modified, dataset_refresh,
+                                            stored_at, last_used)
+                                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                    (cacheKey, f'{endpoint}?{urlencode(parameters)}', bodyHash, size, etag,
+                                     lastModified, refreshed, now, now))
+            self.connection.commit()
+            self.stats['downloads'] += 1
+            self.evict(keep=bodyHash)
+            return self.bodyPath(bodyHash)
+
+    def hit(self, cacheKey, entry, kind, **changes):
+        self.touch(cacheKey, **changes)
+        self.stats[kind] += 1
+        return self.bodyPath(entry['bodyHash'])
+
+    def get(self, url, params=None):
+        with open(self.getPath(url, params), 'rb') as f:
+            return f.read()
+
+    def getJson(self, url, params=None):
+        with open(self.getPath(url, params), 'rb') as f:
+            return json.load(f)
+
+    # The total size of the stored bodies, each body counted once however many entries share it
+    def totalBytes(self):
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM '
+                                       '(SELECT DISTINCT body_hash, size FROM entries)').fetchone()[0]
+
+    # Remove least recently used entries until the bodies fit in maxBytes. The body just stored is kept even
+    #   when it is larger than maxBytes on its own.
+    def evict(self, keep=None):
+        with self.lock:
+            total = self.totalBytes()
+            if total <= self.maxBytes:
+                return
+            entries = self.connection.execute('SELECT cache_key, body_hash, size FROM entries '
+                                              'ORDER BY last_used').fetchall()
+            for cacheKey, bodyHash, size in entries:
+                if total <= self.maxBytes:
+                    break
+                if bodyHash == keep:
+                    continue
+                self.connection.execute('DELETE FROM entries WHERE cache_key = ?', (cacheKey,))
+                self.stats['evicted'] += 1
+                shared = self.connection.execute('SELECT 1 FROM entries WHERE body_hash = ? LIMIT 1',
+                                                 (bodyHash,)).fetchone()
+                if not shared:
+                    total -= size
+                    if os.path.exists(self.bodyPath(bodyHash)):
+                        os.remove(self.bodyPath(bodyHash))
+            self.connection.commit()
+
+    # Remove every entry and body
+    def clear(self):
+        with self.lock:
+            for (bodyHash,) in self.connection.execute('SELECT DISTINCT body_hash FROM entries').fetchall():
+                if os.path.exists(self.bodyPath(bodyHash)):
+                    os.remove(self.bodyPath(bodyHash))
+            self.connection.execute('DELETE FROM entries')
+            self.connection.commit()
@@ -0,0 +1,250 @@
+# A shared HTTP client for the helpers. requests.get() opens a new connection for every call, so a paged pull
+#   or a polling loop pays the TCP (and TLS) handshake again for every page or check. Here one requests Session
+#   with a connection pool is shared by all of the helpers, so connections are kept alive and reused, and
+#   responses are requested compressed and decompressed as they stream in.
+#
+#   client = getClient()
+#   client.get(url, params={'$top': '1'}).json()
+#   client.stats()          # {'requests': 12, 'connectionsOpened': 1, 'connectionsReused': 11, 'bytesReceived': ...}
+#
+#   To change the pool size or timeouts for every helper, install a client of your own first:
+#
+#   setClient(OpenFemaClient(poolMaxsize=16, timeout=(10, 600)))
+#
+#   or, to use a client only for the helpers called in one thread or asyncio task, leaving every other caller
+#   on the shared one:
+#
+#   with useClient(OpenFemaClient(requestsPerSecond=5)):
+#       streamDownload(url, 'out.jsonl', parameters)
+#
+#   requestsPerSecond spaces the requests of every thread using the client evenly, to stay within a request rate.
+#
+#   gzip and deflate are always offered. br (and zstd) are offered too when the brotli (zstandard) package is
+#   installed, urllib3 picks those up by itself.
+
+import contextlib
+import contextvars
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from .metrics import getMetrics
+
+# (connect, read) timeouts in seconds, used when a call does not pass its own
+DEFAULT_TIMEOUT = (30, 300)
+
+# the number of hosts kept in the pool, and the number of connections kept open to each host. The pool should
+#   be at least as large as the number of threads making requests at once (see paging.fetchPagesInOrder)
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 10
+
+
+# Running totals for a client. bytesReceived counts response bodies as they came over the wire, that is before
+#   decompression, so it shows what compression saves.
+class ClientCounters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connectionsOpened = 0
+        self.bytesReceived = 0
+
+    def add(self, name, amount=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+
+# Spaces out calls to wait() so they happen at most requestsPerSecond times a second, across all threads
+class RateLimiter:
+    def __init__(self, requestsPerSecond):
+        self.interval = 1.0 / requestsPerSecond
+        self.lock = threading.Lock()
+        self.nextTime = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            startAt = max(now, self.nextTime)
+            self.nextTime = startAt + self.interval
+        if startAt > now:
+            time.sleep(startAt - now)
+
+
+# Counts and times what is read from the socket of one response, after its headers. Everything urllib3 and
+#   http.client read of the body goes through these methods, so the count is what came over the wire: still
+#   compressed, and for chunked responses including the chunk size lines. With metrics on, the reads are also
+#   timed as the transfer phase.
+class CountingReader:
+    def __init__(self, fileObject, counters):
+        self.fileObject = fileObject
+        self.counters = counters
+
+    def counted(self, method, *args):
+        metrics = getMetrics()
+        start = time.perf_counter() if metrics.enabled else None
+        result = method(*args)
+        length = result if isinstance(result, int) else len(result)
+        if length:
+            self.counters.add('bytesReceived', length)
+        if start is not None:
+            metrics.addTime('transfer', time.perf_counter() - start)
+            metrics.count('bytesReceived', length)
+        return result
+
+    def read(self, *args):
+        return self.counted(self.fileObject.read, *args)
+
+    def read1(self, *args):
+        return self.counted(self.fileObject.read1, *args)
+
+    def readinto(self, buffer):
+        return self.counted(self.fileObject.readinto, buffer)
+
+    def readline(self, *args):
+        return self.counted(self.fileObject.readline, *args)
+
+    # peek() only looks ahead, the bytes are counted when they are read
+    def __getattr__(self, name):
+        return getattr(self.fileObject, name)
+
+
+# Connection classes that count the connections they open and the response bytes they receive, using the
+#   ConnectionCls of urllib3 pools and the response_class of http.client connections. Every request that did
+#   not need a new connection reused one that was kept alive. Should a urllib3 release drop either hook, the
+#   pool is used as it is and only the counts are missing.
+def countingPoolClass(poolClass, counters):
+    connectionClass = getattr(poolClass, 'ConnectionCls', None)
+    if connectionClass is None or not hasattr(connectionClass, 'connect'):
+        return poolClass
+
+    class CountingConnection(connectionClass):
+        # connect() runs for each new socket, including a reconnect after a kept alive connection was dropped
+        def connect(self):
+            counters.add('connectionsOpened')
+            metrics = getMetrics()
+            if not metrics.enabled:
+                return super().connect()
+            metrics.count('connectionsOpened')
+            with metrics.phase('connect'):
+                return super().connect()
+
+    responseClass = getattr(connectionClass, 'response_class', None)
+    if responseClass is not None and hasattr(responseClass, 'begin'):
+        class CountingResponse(responseClass):
+            def begin(self):
+                super().begin()
+                if getattr(self, 'fp', None) is not None:
+                    self.fp = CountingReader(self.fp, counters)
+
+        CountingConnection.response_class = CountingResponse
+
+    class CountingPool(poolClass):
+        ConnectionCls = CountingConnection
+
+    return CountingPool
+
+
+class CountingAdapter(HTTPAdapter):
+    def __init__(self, counters, rateLimiter=None, **options):
+        self.counters = counters
+        self.rateLimiter = rateLimiter
+        super().__init__(**options)
+
+    def init_poolmanager(self, *args, **options):
+        super().init_poolmanager(*args, **options)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: countingPoolClass(poolClass, self.counters)
+            for scheme, poolClass in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def send(self, request, **options):
+        if self.rateLimiter is not None:
+            self.rateLimiter.wait()
+        self.counters.add('requests')
+        metrics = getMetrics()
+        if not metrics.enabled:
+            return super().send(request, **options)
+        metrics.count('requests')
+        # the adapter returns as soon as the response headers have been read, the body is read afterwards
+        with metrics.phase('ttfb'):
+            return super().send(request, **options)
+
+
+class OpenFemaClient:
+    def __init__(self, poolConnections=POOL_CONNECTIONS, poolMaxsize=POOL_MAXSIZE, timeout=DEFAULT_TIMEOUT,
+                 headers=None, requestsPerSecond=None):
+        self.timeout = timeout
+        self.counters = ClientCounters()
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        self.session.headers.update(headers or {})
+        rateLimiter = RateLimiter(requestsPerSecond) if requestsPerSecond else None
+        adapter = CountingAdapter(self.counters, rateLimiter, pool_connections=poolConnections,
+                                  pool_maxsize=poolMaxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Same arguments as requests.get(). Use it in a with statement, or read the whole body, so the connection
+    #   goes back to the pool. Streamed bodies are decompressed as they are read.
+    def get(self, url, params=None, timeout=None, **options):
+        return self.session.get(url, params=params, timeout=timeout or self.timeout, **options)
+
+    def stats(self):
+        counters = self.counters
+        with counters.lock:
+            return {
+                'requests': counters.requests,
+                'connectionsOpened': counters.connectionsOpened,
+                'connectionsReused': max(0, counters.requests - counters.connectionsOpened),
+                'bytesReceived': counters.bytesReceived,
+            }
+
+    def close(self):
+        self.session.close()
+
+
+defaultClient = None
+defaultClientLock = threading.Lock()
+
+# the client installed by useClient() for the current context, if any
+contextClient = contextvars.ContextVar('contextClient', default=None)
+
+
+# The client the helpers use: the one installed with useClient() in this context, otherwise the shared client,
+#   created on first use
+def getClient():
+    global defaultClient
+    client = contextClient.get()
+    if client is not None:
+        return client
+    with defaultClientLock:
+        if defaultClient is None:
+            defaultClient = OpenFemaClient()
+        return defaultClient
+
+
+# Replace the shared client, e.g. with one with a larger pool. Returns the previous one.
+def setClient(client):
+    global defaultClient
+    with defaultClientLock:
+        previous, defaultClient = defaultClient, client
+        return previous
+
+
+# Use client instead of the shared one for the helpers called within the with block, in this thread or asyncio
+#   task only. Closing the client is left to the caller.
+@contextlib.contextmanager
+def useClient(client):
+    token = contextClient.set(client)
+    try:
+        yield client
+    finally:
+        contextClient.reset(token)
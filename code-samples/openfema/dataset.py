@@ -0,0 +1,672 @@
+# A downloaded dataset that is filtered on disk before anything is loaded. Analysis usually starts with
+#   pd.read_parquet('all_of_it.parquet') followed by a filter for one county or one disaster, which reads and
+#   keeps every row and column just to throw most of them away. Instead, the download is split once into
+#   partitions by key columns and queried lazily:
+#
+#   ihp = partitionFile('IndividualsAndHouseholdsProgramValidRegistrations.parquet', 'ihp',
+#                       partitionBy=['damagedStateAbbreviation', 'disasterNumber'])
+#   ihp = LocalDataset('ihp')                                         # later, or in another notebook
+#   harris = (ihp.where(field('damagedStateAbbreviation') == 'TX', field('county') == 'Harris (County)')
+#                .select('disasterNumber', 'damagedZipCode', 'ihpAmount')
+#                .toPandas())
+#
+#   The partitions are folders named the way Hive, Spark and pyarrow name them (disasterNumber=4332/) holding
+#   Parquet files without the partition columns, plus a _dataset.json describing the partitioning. A query is
+#   answered in three steps, each skipping what the filter rules out:
+#     partitions - folders whose values cannot match are never opened
+#     row groups - in the remaining files, row groups whose footer statistics (minimum, maximum and null count
+#                  of every column) cannot match are never read
+#     rows       - only the remaining row groups, and only the columns needed, are read and filtered
+#   explain() reports how much each step skipped. where() and select() return a new LocalDataset and read
+#   nothing, the data is only read by toTable(), toPandas(), batches() and count().
+#
+#   Filters are the predicates of query.py: field('state') == 'TX', field('year') >= 2017, isIn(), startswith(),
+#   &, | and ~. Partitioning by year works with computed={'year': YearOf('declarationDate')}, and then a filter
+#   on declarationDate itself also skips the years it rules out. A single Parquet file, or a folder of
+#   partitions written by another tool (without _dataset.json), can be opened with LocalDataset too; jsonl files
+#   among the partitions are read whole, as they have no statistics.
+#
+#   Requires pyarrow (pip install pyarrow) and numpy.
+
+import copy
+import json
+import os
+import shutil
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.json as pajson
+import pyarrow.parquet as pq
+
+from .aggregate import CHUNK_BYTES, CHUNK_ROWS, detectFileFormat, iterChunks
+from .parquetconvert import ROW_GROUP_SIZE
+from .query import Combined, Comparison, FunctionCall, Not, RawPredicate, allOf, asPredicate
+
+MANIFEST = '_dataset.json'
+
+# folder name of the partition holding the rows where the key is null, as Hive and Spark name it
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# partition files kept open while splitting, the least recently written is closed beyond this
+MAX_OPEN_FILES = 64
+
+# rows waiting to be written across all partitions, the largest waiting batches are written out beyond this
+MAX_BUFFERED_ROWS = 1000000
+
+# partition key types, as written to _dataset.json
+PARTITION_TYPES = {'string': pa.string(), 'int64': pa.int64(), 'double': pa.float64(), 'bool': pa.bool_()}
+
+NEGATED = {'eq': 'ne', 'ne': 'eq', 'gt': 'le', 'ge': 'lt', 'lt': 'ge', 'le': 'gt'}
+
+OPERATORS = {'eq': pc.equal, 'ne': pc.not_equal, 'gt': pc.greater, 'ge': pc.greater_equal, 'lt': pc.less,
+             'le': pc.less_equal}
+
+
+# The year of a date column, for partitioning by year. The column may hold timestamps or ISO text.
+class YearOf:
+    def __init__(self, column):
+        self.column = column
+        self.columns = (column,)
+
+    def __call__(self, table):
+        values = table.column(self.column)
+        if pa.types.is_timestamp(values.type) or pa.types.is_date(values.type):
+            return pc.cast(pc.year(values), pa.int64())
+        return pc.cast(pc.utf8_slice_codeunits(pc.cast(values, pa.string()), 0, 4), pa.int64())
+
+
+def asDatetime(value):
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc) if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    if isinstance(value, str):
+        return asDatetime(datetime.fromisoformat(value.replace('Z', '+00:00')))
+    raise TypeError(f'{value!r} is not a date')
+
+
+# Convert a filter value to compare with values like `like` (a statistic or a partition value), e.g. a datetime
+#   compared with ISO text is written as ISO text the way the API writes it. Raises TypeError when they cannot
+#   be compared.
+def coerceValue(value, like):
+    if isinstance(like, bool) or isinstance(value, bool):
+        if isinstance(like, bool) and isinstance(value, bool):
+            return value
+    elif isinstance(like, datetime):
+        converted = asDatetime(value)
+        return converted if like.tzinfo is not None else converted.replace(tzinfo=None)
+    elif isinstance(like, date):
+        return asDatetime(value).date() if not isinstance(value, date) or isinstance(value, datetime) else value
+    elif isinstance(like, str):
+        if isinstance(value, str):
+            return value
+        if isinstance(value, date):
+            return asDatetime(value).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+    elif isinstance(like, (int, float)):
+        if isinstance(value, (int, float)):
+            return value
+    raise TypeError(f'{value!r} cannot be compared with {like!r}')
+
+
+# Rewrite not (...) so the negation reaches the comparisons: not (a eq 1) is a ne 1, which can rule things out
+#   like any comparison. Text functions stay negated.
+def negate(predicate):
+    if isinstance(predicate, Comparison):
+        return Comparison(predicate.name, NEGATED[predicate.operator], predicate.value)
+    if isinstance(predicate, Combined):
+        return Combined('or' if predicate.operator == 'and' else 'and', [negate(part) for part in predicate.predicates])
+    if isinstance(predicate, Not):
+        return predicate.predicate
+    return Not(predicate)
+
+
+def checkPredicate(predicate):
+    if isinstance(predicate, RawPredicate):
+        raise ValueError(f'the hand written filter {predicate.text!r} cannot be applied to local files, '
+                         f'write it with field() instead')
+    for part in getattr(predicate, 'predicates', ()):
+        checkPredicate(part)
+    if isinstance(predicate, Not):
+        checkPredicate(predicate.predicate)
+
+
+def predicateColumns(predicate, columns=None):
+    columns = columns if columns is not None else []
+    if isinstance(predicate, (Comparison, FunctionCall)) and predicate.name not in columns:
+        columns.append(predicate.name)
+    for part in getattr(predicate, 'predicates', ()):
+        predicateColumns(part, columns)
+    if isinstance(predicate, Not):
+        predicateColumns(predicate.predicate, columns)
+    return columns
+
+
+# False when no row with the value ranges returned by rangeOf(column) can match the predicate, True when some
+#   might. This is how a partition or a row group is ruled out. A range is (minimum, maximum, nullCount,
+#   rowCount), minimum and maximum None when unknown or when every value is null, and rangeOf returns None for
+#   a column it knows nothing about.
+def canMatch(predicate, rangeOf):
+    if isinstance(predicate, Combined):
+        results = (canMatch(part, rangeOf) for part in predicate.predicates)
+        return all(results) if predicate.operator == 'and' else any(results)
+    if isinstance(predicate, Not):
+        negated = negate(predicate.predicate)
+        return True if isinstance(negated, Not) else canMatch(negated, rangeOf)
+
+    valueRange = rangeOf(predicate.name)
+    if valueRange is None:
+        return True
+    minimum, maximum, nullCount, rowCount = valueRange
+    allNull = nullCount is not None and nullCount == rowCount
+    if isinstance(predicate, Comparison) and predicate.value is None:
+        # eq null matches the null values, ne null the others
+        if nullCount is None:
+            return True
+        return nullCount > 0 if predicate.operator == 'eq' else rowCount is None or nullCount < rowCount
+    if allNull:
+        # nothing compares true with null
+        return False
+    if minimum is None or maximum is None:
+        return True
+    try:
+        value = coerceValue(predicate.value, minimum)
+        if isinstance(predicate, FunctionCall):
+            if predicate.function != 'startswith':
+                return True
+            # some text between the minimum and the maximum starts with the prefix
+            return maximum >= value and minimum[:len(value)] <= value
+        operator = predicate.operator
+        if operator == 'eq':
+            return minimum <= value <= maximum
+        if operator == 'ne':
+            return not (minimum == maximum == value)
+        if operator == 'gt':
+            return maximum > value
+        if operator == 'ge':
+            return maximum >= value
+        if operator == 'lt':
+            return minimum < value
+        return minimum <= value
+    except TypeError:
+        return True
+
+
+# A filter value as an Arrow scalar of the column's type
+def arrowValue(value, arrowType):
+    if pa.types.is_timestamp(arrowType):
+        value = asDatetime(value)
+        if arrowType.tz is None:
+            value = value.replace(tzinfo=None)
+        return pa.scalar(value, arrowType)
+    if pa.types.is_date(arrowType):
+        return pa.scalar(asDatetime(value).date(), arrowType)
+    if pa.types.is_string(arrowType) or pa.types.is_large_string(arrowType):
+        return pa.scalar(coerceValue(value, ''), arrowType)
+    return pa.scalar(value)
+
+
+# The predicate as a pyarrow compute expression over a table with this schema. eq null finds the nulls, any
+#   other comparison with a null is null, which (negated or not) does not keep the row, as with the API.
+def toExpression(predicate, schema):
+    if isinstance(predicate, Combined):
+        expressions = [toExpression(part, schema) for part in predicate.predicates]
+        combined = expressions[0]
+        for expression in expressions[1:]:
+            combined = (combined & expression) if predicate.operator == 'and' else (combined | expression)
+        return combined
+    if isinstance(predicate, Not):
+        return ~toExpression(predicate.predicate, schema)
+
+    if predicate.name not in schema.names:
+        raise KeyError(f'{predicate.name!r} is not a column of the dataset')
+    column = pc.field(predicate.name)
+    arrowType = schema.field(predicate.name).type
+    if isinstance(predicate, FunctionCall):
+        text = pc.cast(column, pa.string()) if not pa.types.is_string(arrowType) else column
+        if predicate.function == 'startswith':
+            return pc.starts_with(text, pattern=predicate.value)
+        if predicate.function == 'endswith':
+            return pc.ends_with(text, pattern=predicate.value)
+        return pc.match_substring(text, pattern=predicate.value)
+    if predicate.value is None:
+        return column.is_null() if predicate.operator == 'eq' else column.is_valid()
+    return OPERATORS[predicate.operator](column, arrowValue(predicate.value, arrowType))
+
+
+def partitionFolder(name, value):
+    return f'{name}={NULL_PARTITION if value is None else quote(str(value), safe="")}'
+
+
+def parsePartitionValue(text, arrowType):
+    if text == NULL_PARTITION:
+        return None
+    text = unquote(text)
+    if pa.types.is_integer(arrowType):
+        return int(text)
+    if pa.types.is_floating(arrowType):
+        return float(text)
+    if pa.types.is_boolean(arrowType):
+        return text.lower() == 'true'
+    return text
+
+
+def partitionTypeName(arrowType):
+    for name, partitionType in PARTITION_TYPES.items():
+        if arrowType == partitionType:
+            return name
+    if pa.types.is_integer(arrowType):
+        return 'int64'
+    if pa.types.is_floating(arrowType):
+        return 'double'
+    if pa.types.is_string(arrowType) or pa.types.is_large_string(arrowType) or pa.types.is_dictionary(arrowType):
+        return 'string'
+    raise ValueError(f'{arrowType} columns cannot be partitioned on, use a computed column such as YearOf')
+
+
+# Split a table into the rows of each partition. Returns [(key values, table)]. Every key column is dictionary
+#   encoded, the codes combined into one number per row and the rows sorted by it (keeping their order within
+#   a partition), so the split costs one sort however many partitions there are.
+def splitByPartition(table, partitionBy):
+    codes = np.zeros(table.num_rows, dtype=np.int64)
+    dictionaries = []
+    for name in partitionBy:
+        encoded = pc.dictionary_encode(table.column(name), null_encoding='encode').combine_chunks()
+        dictionaries.append(encoded.dictionary.to_pylist())
+        codes = codes * len(encoded.dictionary) + encoded.indices.to_numpy(zero_copy_only=False)
+
+    order = np.argsort(codes, kind='stable')
+    sortedCodes = codes[order]
+    starts = np.flatnonzero(np.concatenate(([True], sortedCodes[1:] != sortedCodes[:-1])))
+    ends = np.append(starts[1:], len(order))
+    values = table.drop_columns(partitionBy)
+    parts = []
+    for start, end in zip(starts, ends):
+        code = int(sortedCodes[start])
+        key = []
+        for dictionary in reversed(dictionaries):
+            code, index = divmod(code, len(dictionary))
+            key.append(dictionary[index])
+        parts.append((tuple(reversed(key)), values.take(order[start:end])))
+    return parts
+
+
+# Column types of a csv or jsonl file from its first block, as the pyarrow reader infers them (columns that
+#   are all null there become text). Passed to the chunk reader so every chunk gets the same schema.
+def sampleColumnTypes(path, format, columnTypes, chunkBytes):
+    if format == 'parquet':
+        return pq.ParquetFile(path).schema_arrow
+    if format == 'csv':
+        reader = pacsv.open_csv(path, read_options=pacsv.ReadOptions(block_size=chunkBytes),
+                                convert_options=pacsv.ConvertOptions(column_types=columnTypes))
+    else:
+        reader = pajson.open_json(path, read_options=pajson.ReadOptions(block_size=chunkBytes))
+    schema = reader.schema
+    return pa.schema([(field.name, columnTypes.get(field.name, pa.string() if pa.types.is_null(field.type)
+                                                   else field.type)) for field in schema])
+
+
+# Writes the split rows to partition files, rowGroupSize rows at a time
+class PartitionWriter:
+    def __init__(self, directory, partitionBy, rowGroupSize, sortBy, compression):
+        self.directory = directory
+        self.partitionBy = partitionBy
+        self.rowGroupSize = rowGroupSize
+        self.sortBy = sortBy
+        self.compression = compression
+        self.buffers = {}                   # key -> [tables waiting, rows waiting]
+        self.bufferedRows = 0
+        self.writers = OrderedDict()        # key -> open ParquetWriter, least recently used first
+        self.fileCounts = {}                # key -> files written to the partition folder
+        self.rowCount = 0
+
+    def add(self, key, table):
+        buffer = self.buffers.setdefault(key, [[], 0])
+        buffer[0].append(table)
+        buffer[1] += table.num_rows
+        self.bufferedRows += table.num_rows
+        if buffer[1] >= self.rowGroupSize:
+            self.flush(key)
+        while self.bufferedRows > MAX_BUFFERED_ROWS:
+            self.flush(max(self.buffers, key=lambda bufferKey: self.buffers[bufferKey][1]))
+
+    def flush(self, key):
+        tables, rowCount = self.buffers.pop(key)
+        self.bufferedRows -= rowCount
+        table = pa.concat_tables(tables)
+        if self.sortBy:
+            # sorted rows give each row group a narrow range of these columns, so their statistics rule out more
+            table = table.sort_by([(column, 'ascending') for column in self.sortBy])
+        self.writerFor(key, table.schema).write_table(table, row_group_size=self.rowGroupSize)
+        self.rowCount += table.num_rows
+
+    def writerFor(self, key, schema):
+        if key in self.writers:
+            self.writers.move_to_end(key)
+            return self.writers[key]
+        if len(self.writers) >= MAX_OPEN_FILES:
+            self.writers.popitem(last=False)[1].close()
+        folder = os.path.join(self.directory, *(partitionFolder(name, value)
+                                                for name, value in zip(self.partitionBy, key)))
+        os.makedirs(folder, exist_ok=True)
+        fileNumber = self.fileCounts.get(key, 0)
+        self.fileCounts[key] = fileNumber + 1
+        writer = pq.ParquetWriter(os.path.join(folder, f'part-{fileNumber:05d}.parquet'), schema,
+                                  compression=self.compression)
+        self.writers[key] = writer
+        return writer
+
+    def close(self):
+        for key in list(self.buffers):
+            self.flush(key)
+        self.closeFiles()
+
+    def closeFiles(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+
+# Split jsonl, csv or parquet files (a path or a list of paths of the same dataset) into a partitioned dataset
+#   in directory, one folder level per partitionBy column, and return it as a LocalDataset. computed adds key
+#   columns worked out from each chunk, such as {'year': YearOf('declarationDate')}. columnTypes sets the
+#   pyarrow type of csv and jsonl columns (e.g. a timestamp for dates, which are read as text otherwise), a
+#   schema from parquetconvert.schemaFromMetadata() works too. sortBy sorts each row group's rows, which
+#   narrows its statistics. The dataset is written next to directory and moved into place when complete,
+#   replacing an earlier one.
+def partitionFile(paths, directory, partitionBy, computed=None, format=None, columnTypes=None, sortBy=None,
+                  rowGroupSize=ROW_GROUP_SIZE, compression='snappy', chunkRows=CHUNK_ROWS, chunkBytes=CHUNK_BYTES):
+    paths = [paths] if isinstance(paths, (str, os.PathLike)) else list(paths)
+    partitionBy = list(partitionBy)
+    computed = computed or {}
+    if isinstance(columnTypes, pa.Schema):
+        columnTypes = {field.name: field.type for field in columnTypes}
+    columnTypes = columnTypes or {}
+
+    partLocation = directory.rstrip('/\\') + '.part'
+    if os.path.exists(partLocation):
+        shutil.rmtree(partLocation)
+    os.makedirs(partLocation)
+    writer = PartitionWriter(partLocation, partitionBy, rowGroupSize, sortBy, compression)
+    schema = None
+    try:
+        for path in paths:
+            fileFormat = format or detectFileFormat(path)
+            fileSchema = sampleColumnTypes(path, fileFormat, columnTypes, chunkBytes)
+            fileTypes = {field.name: field.type for field in fileSchema}
+            for table in iterChunks((path, fileFormat, None), fileSchema.names, fileTypes, chunkRows, chunkBytes):
+                for name, function in computed.items():
+                    table = table.append_column(name, function(table))
+                missing = [name for name in partitionBy if name not in table.column_names]
+                if missing:
+                    raise KeyError(f'partition columns {missing} are not columns of {path} or computed')
+                if schema is None:
+                    schema = table.schema
+                elif table.schema != schema:
+                    # files of the same dataset may come with slightly different inferred types
+                    table = table.cast(schema)
+                for key, part in splitByPartition(table, partitionBy):
+                    writer.add(key, part)
+        writer.close()
+    except BaseException:
+        writer.closeFiles()
+        shutil.rmtree(partLocation, ignore_errors=True)
+        raise
+
+    if schema is None:
+        raise ValueError(f'{paths} hold no records')
+    manifest = {
+        'partitionBy': partitionBy,
+        'partitionTypes': {name: partitionTypeName(schema.field(name).type) for name in partitionBy},
+        'derivedFrom': {name: function.column for name, function in computed.items() if isinstance(function, YearOf)},
+        'rowCount': writer.rowCount,
+    }
+    with open(os.path.join(partLocation, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(partLocation, directory)
+    return LocalDataset(directory)
+
+
+# Download a query (see query.py) and partition it. The whole dataset comes from the published parquet file,
+#   anything else is streamed into parquet first. The intermediate file is removed afterwards unless keepDownload.
+def downloadPartitioned(query, directory, partitionBy, computed=None, sortBy=None, keepDownload=False, **options):
+    downloadLocation = directory.rstrip('/\\') + '.download.parquet'
+    query.download(downloadLocation, format='parquet')
+    dataset = partitionFile(downloadLocation, directory, partitionBy, computed=computed, sortBy=sortBy, **options)
+    if not keepDownload:
+        os.remove(downloadLocation)
+    return dataset
+
+
+# The data files of a dataset folder with the partition values their folders give, [(path, {name: text})]
+def listPartitionFiles(directory):
+    files = []
+    for folder, subfolders, fileNames in os.walk(directory):
+        subfolders.sort()
+        relative = os.path.relpath(folder, directory)
+        values = {}
+        if relative != '.':
+            for part in relative.split(os.sep):
+                if '=' in part:
+                    name, text = part.split('=', 1)
+                    values[name] = text
+        for fileName in sorted(fileNames):
+            if fileName.endswith(('.parquet', '.jsonl')) and not fileName.startswith(('_', '.')):
+                files.append((os.path.join(folder, fileName), values))
+    return files
+
+
+# The type of a partition column found in folder names: whole numbers when every value is one, else text
+def guessPartitionType(texts):
+    try:
+        for text in texts:
+            if text != NULL_PARTITION:
+                int(unquote(text))
+        return pa.int64()
+    except ValueError:
+        return pa.string()
+
+
+# Value ranges of every column of one row group of a Parquet file, from its footer
+def rowGroupRanges(metadata, rowGroupNumber):
+    rowGroup = metadata.row_group(rowGroupNumber)
+    ranges = {}
+    for columnNumber in range(rowGroup.num_columns):
+        chunk = rowGroup.column(columnNumber)
+        statistics = chunk.statistics
+        if statistics is None:
+            continue
+        nullCount = statistics.null_count if statistics.has_null_count else None
+        if statistics.has_min_max:
+            ranges[chunk.path_in_schema] = (statistics.min, statistics.max, nullCount, rowGroup.num_rows)
+        else:
+            ranges[chunk.path_in_schema] = (None, None, nullCount, rowGroup.num_rows)
+    return ranges
+
+
+class LocalDataset:
+    # A dataset folder made by partitionFile(), a folder of Hive style partitions or a single Parquet file
+    def __init__(self, location):
+        self.location = location
+        self.predicates = []
+        self.columns = None
+        self.derivedFrom = {}
+        self.rowCount = None
+        if os.path.isfile(location):
+            self.partitionTypes = {}
+            self.files = [(location, {})]
+            if location.endswith('.parquet'):
+                self.rowCount = pq.ParquetFile(location).metadata.num_rows
+            return
+
+        found = listPartitionFiles(location)
+        manifestPath = os.path.join(location, MANIFEST)
+        if os.path.exists(manifestPath):
+            with open(manifestPath) as f:
+                manifest = json.load(f)
+            self.partitionTypes = {name: PARTITION_TYPES[manifest['partitionTypes'][name]]
+                                   for name in manifest['partitionBy']}
+            self.derivedFrom = manifest.get('derivedFrom', {})
+            self.rowCount = manifest.get('rowCount')
+        else:
+            names = list(dict.fromkeys(name for _, values in found for name in values))
+            self.partitionTypes = {name: guessPartitionType({values[name] for _, values in found if name in values})
+                                   for name in names}
+        self.files = [(path, {name: parsePartitionValue(text, self.partitionTypes[name])
+                              for name, text in values.items() if name in self.partitionTypes})
+                      for path, values in found]
+        if not self.files:
+            raise FileNotFoundError(f'no .parquet or .jsonl files in {location}')
+
+    # Keep the rows matching all of the predicates, as a new LocalDataset
+    def where(self, *predicates):
+        predicates = [asPredicate(predicate) for predicate in predicates]
+        for predicate in predicates:
+            checkPredicate(predicate)
+        dataset = copy.copy(self)
+        dataset.predicates = self.predicates + predicates
+        return dataset
+
+    # Only these columns, as a new LocalDataset. Called again, the columns are added to the earlier ones.
+    def select(self, *columns):
+        dataset = copy.copy(self)
+        dataset.columns = list(dict.fromkeys((self.columns or []) + list(columns)))
+        return dataset
+
+    @property
+    def predicate(self):
+        return allOf(*self.predicates) if self.predicates else None
+
+    @property
+    def schema(self):
+        path = self.files[0][0]
+        fileSchema = pq.read_schema(path) if path.endswith('.parquet') else \
+            pajson.open_json(path).schema
+        for name, partitionType in self.partitionTypes.items():
+            if name not in fileSchema.names:
+                fileSchema = fileSchema.append(pa.field(name, partitionType))
+        return fileSchema
+
+    # The value ranges a partition's folder names give: its key values, and for a year partition the dates the
+    #   year spans
+    def partitionRanges(self, values):
+        ranges = {}
+        for name, value in values.items():
+            # a partition holds either only nulls of the key or none
+            ranges[name] = (None, None, 1, 1) if value is None else (value, value, 0, None)
+        for name, column in self.derivedFrom.items():
+            year = values.get(name)
+            if year is not None:
+                start = datetime(year, 1, 1, tzinfo=timezone.utc)
+                ranges[column] = (start, start.replace(year=year + 1) - timedelta(milliseconds=1), None, None)
+        return ranges
+
+    # The files and row groups that have to be read, [(path, partition values, row groups or None for jsonl)],
+    #   and how much was skipped. The footers of files in partitions that are ruled out are never read.
+    def plan(self):
+        predicate = self.predicate
+        selected = []
+        counts = {'files': len(self.files), 'filesRead': 0, 'rowGroupsSkipped': 0, 'rowGroupsRead': 0,
+                  'rows': self.rowCount, 'rowsRead': 0}
+        for path, values in self.files:
+            partitionRanges = self.partitionRanges(values)
+            if predicate is not None and not canMatch(predicate, partitionRanges.get):
+                continue
+            if not path.endswith('.parquet'):
+                selected.append((path, values, None))
+                counts['filesRead'] += 1
+                continue
+
+            metadata = pq.ParquetFile(path).metadata
+            rowGroups = []
+            for rowGroupNumber in range(metadata.num_row_groups):
+                ranges = {**rowGroupRanges(metadata, rowGroupNumber), **partitionRanges}
+                if predicate is None or canMatch(predicate, ranges.get):
+                    rowGroups.append(rowGroupNumber)
+                    counts['rowsRead'] += metadata.row_group(rowGroupNumber).num_rows
+            counts['rowGroupsSkipped'] += metadata.num_row_groups - len(rowGroups)
+            if rowGroups:
+                selected.append((path, values, rowGroups))
+                counts['filesRead'] += 1
+                counts['rowGroupsRead'] += len(rowGroups)
+        return selected, counts
+
+    # How much of the dataset a query reads: the files, and the row groups and rows of the Parquet files left
+    #   after skipping, next to the rows of the whole dataset (None when unknown)
+    def explain(self):
+        return self.plan()[1]
+
+    # The columns to read from the files: the selected ones plus those the filter needs
+    def readColumns(self):
+        if self.columns is None:
+            return None
+        needed = list(self.columns)
+        if self.predicate is not None:
+            needed += [column for column in predicateColumns(self.predicate) if column not in needed]
+        return needed
+
+    # Read one file's row groups with the partition columns added back, filtered and with the selected columns
+    def readFile(self, path, values, rowGroups, columns):
+        if rowGroups is None:
+            table = pajson.read_json(path)
+            if columns is not None:
+                table = table.select([column for column in columns if column in table.column_names])
+        else:
+            parquetFile = pq.ParquetFile(path)
+            fileColumns = None if columns is None else \
+                [column for column in columns if column in parquetFile.schema_arrow.names]
+            table = parquetFile.read_row_groups(rowGroups, columns=fileColumns)
+        for name, partitionType in self.partitionTypes.items():
+            if (columns is None or name in columns) and name not in table.column_names:
+                table = table.append_column(name, pa.repeat(pa.scalar(values.get(name), partitionType),
+                                                            table.num_rows))
+        if self.predicate is not None:
+            table = table.filter(toExpression(self.predicate, table.schema))
+        if self.columns is not None:
+            missing = [column for column in self.columns if column not in table.column_names]
+            if missing:
+                raise KeyError(f'{missing} are not columns of the dataset')
+            table = table.select(self.columns)
+        return table
+
+    # Yield the matching rows a file at a time as pyarrow Tables, for results larger than memory
+    def batches(self):
+        columns = self.readColumns()
+        for path, values, rowGroups in self.plan()[0]:
+            table = self.readFile(path, values, rowGroups, columns)
+            if table.num_rows:
+                yield table
+
+    def toTable(self):
+        tables = list(self.batches())
+        if not tables:
+            schema = self.schema
+            return schema.empty_table() if self.columns is None else \
+                pa.schema([schema.field(column) for column in self.columns]).empty_table()
+        return pa.concat_tables(tables, promote_options='permissive')
+
+    def toPandas(self):
+        return self.toTable().to_pandas()
+
+    # The number of matching rows. Without a filter it comes from the file footers, with one only the columns
+    #   the filter uses are read.
+    def count(self):
+        selected, counts = self.plan()
+        if self.predicate is None and all(rowGroups is not None for _, _, rowGroups in selected):
+            return counts['rowsRead']
+        columns = predicateColumns(self.predicate) if self.predicate is not None else None
+        dataset = copy.copy(self)
+        dataset.columns = None
+        return sum(dataset.readFile(path, values, rowGroups, columns).num_rows for path, values, rowGroups in selected)
+
+    def __repr__(self):
+        predicate = self.predicate
+        return f'LocalDataset({self.location!r}, where={predicate.compile() if predicate else None!r}, ' \
+               f'columns={self.columns!r})'
@@ -0,0 +1,293 @@
+# Resumable streaming downloads. The data is streamed into a temporary "<saveLocation>.part" file and a small
+#   "<saveLocation>.checkpoint" file records how many bytes and records have been completely received. If the
+#   connection drops, the download is retried with exponential backoff and picks up after the last complete
+#   record instead of starting over. Only once the download has finished is the .part file moved into place,
+#   so saveLocation never holds a half written file.
+#
+#   How a download is resumed depends on the format:
+#     jsonl, csv - the partial trailing record is cut off and the query is re-issued with $skip set to the
+#                  number of records already saved and $top lowered by as many. Without an $orderby the
+#                  query is ordered by id, so the records after the skip are the ones still missing
+#     file       - a plain file download such as a .parquet file, resumed with an HTTP Range request from the
+#                  size of the .part file, which only ever holds bytes as received. Its checkpoint only records
+#                  which request the .part file belongs to, so it is written once rather than as the data arrives
+#     json/jsona - a single JSON document cannot be resumed part way, these restart from the beginning
+
+import json
+import os
+import random
+import time
+
+import requests
+
+from .client import getClient
+from .metrics import getMetrics
+
+# size of the chunks read from the network. Larger chunks mean fewer trips through the Python loop, beyond
+#   this the gain is lost in the noise (see benchmarks/download_throughput.py)
+CHUNK_SIZE = 128 * 1024
+
+# write the checkpoint file after roughly this many new bytes have been saved
+CHECKPOINT_EVERY = 8 * 1024 * 1024
+
+RESUMABLE_BY_SKIP = ('jsonl', 'csv')
+
+
+class DownloadError(Exception):
+    pass
+
+
+# Errors worth another attempt: dropped connections, timeouts, throttling and server errors.
+#   Other 4xx responses mean the query itself is wrong and retrying will not help.
+def isRetryable(error):
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status is None or status == 429 or status >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+
+# Delay before retry number `attempt` (0 based), doubling each time with a little random jitter
+def backoffDelay(attempt, backoff=1.0, maxDelay=60.0):
+    return min(maxDelay, backoff * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+# Keeps track of where the last complete record ends within the bytes received so far. For csv a newline
+#   inside a quoted value does not end a record, so the number of quote characters seen is tracked as well.
+class RecordBoundaryTracker:
+    def __init__(self, format, bytesSaved=0, recordsSaved=0):
+        self.format = format
+        self.bytesReceived = bytesSaved
+        self.bytesSaved = bytesSaved        # offset just past the last complete record
+        self.recordsSaved = recordsSaved    # complete records (lines for jsonl/csv, header excluded) up to bytesSaved
+        self.quoted = False
+        self.headerSeen = format != 'csv' or bytesSaved > 0
+
+    # Start again from an empty file
+    def reset(self):
+        self.bytesReceived = self.bytesSaved = self.recordsSaved = 0
+        self.quoted = False
+        self.headerSeen = self.format != 'csv'
+
+    # Forget anything received after the last complete record, the next attempt continues from there
+    def rewind(self):
+        self.bytesReceived = self.bytesSaved
+        self.quoted = False
+
+    # Account for the bytes data[start:end]. The search methods take start/end positions, so no copy of a
+    #   chunk is made to skip the part of it already handled.
+    def update(self, data, start=0, end=None):
+        end = len(data) if end is None else end
+        if self.format not in RESUMABLE_BY_SKIP:
+            self.bytesReceived += end - start
+            if self.format == 'file':
+                self.bytesSaved = self.bytesReceived
+            return
+
+        if self.format == 'jsonl' or (not self.quoted and data.find(b'"', start, end) < 0):
+            lineEnds = data.count(b'\n', start, end)
+            lastEnd = data.rfind(b'\n', start, end)
+        else:
+            lineEnds, lastEnd = 0, -1
+            position = start
+            while True:
+                nextQuote = data.find(b'"', position, end)
+                nextNewline = data.find(b'\n', position, end)
+                if nextNewline < 0 and nextQuote < 0:
+                    break
+                if nextQuote >= 0 and (nextNewline < 0 or nextQuote < nextNewline):
+                    self.quoted = not self.quoted
+                    position = nextQuote + 1
+                else:
+                    if not self.quoted:
+                        lineEnds += 1
+                        lastEnd = nextNewline
+                    position = nextNewline + 1
+
+        if lineEnds:
+            if not self.headerSeen:
+                self.headerSeen = True
+                lineEnds -= 1
+            self.recordsSaved += lineEnds
+            self.bytesSaved = self.bytesReceived + lastEnd - start + 1
+        self.bytesReceived += end - start
+
+
+class Checkpoint:
+    def __init__(self, path, requestKey):
+        self.path = path
+        self.requestKey = requestKey
+
+    # Returns (bytesSaved, recordsSaved) from a previous attempt at the same request, or None
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('request') != self.requestKey:
+            return None
+        return state['bytes'], state['records']
+
+    # Written to a temporary file first and renamed, so a crash never leaves a corrupt checkpoint behind
+    def save(self, bytesSaved, recordsSaved):
+        temporaryPath = self.path + '.tmp'
+        with open(temporaryPath, 'w') as f:
+            json.dump({'request': self.requestKey, 'bytes': bytesSaved, 'records': recordsSaved}, f)
+        os.replace(temporaryPath, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+# Work out the format of a request from its $format parameter. Queries without one return json, and
+#   anything that is not an API query (a .parquet file and so on) is treated as a plain file.
+def detectFormat(baseUrl, queryParameters):
+    if queryParameters and '$format' in queryParameters:
+        return queryParameters['$format']
+    if '/api/open/' in baseUrl and not os.path.splitext(baseUrl.rstrip('/'))[1]:
+        return 'json'
+    return 'file'
+
+
+# Unbuffered files may accept fewer bytes than offered, keep writing until the whole view is saved
+def writeAll(fileObject, view):
+    while view:
+        written = fileObject.write(view)
+        view = view[written:]
+
+
+# Issue one attempt at the request, continuing from tracker.bytesSaved, and append what arrives to partFile.
+#   iter_content() undoes any gzip/deflate content encoding and raises the requests exceptions the retry logic
+#   understands. Reading into a reused buffer with raw.readinto() instead is no faster, urllib3 copies each read
+#   into the buffer from a bytes object of its own anyway.
+def streamAttempt(baseUrl, queryParameters, partFile, tracker, checkpoint, chunkSize, timeout, onChunk):
+    parameters = dict(queryParameters or {})
+    headers = {}
+    skipHeaderLine = False
+    if tracker.format == 'file':
+        # byte offsets must refer to the file itself, not to a compressed copy of it
+        headers['Accept-Encoding'] = 'identity'
+    if tracker.bytesSaved > 0:
+        if tracker.format in RESUMABLE_BY_SKIP:
+            parameters['$skip'] = str(int(parameters.get('$skip', 0)) + tracker.recordsSaved)
+            if '$top' in parameters:
+                top = int(parameters['$top']) - tracker.recordsSaved
+                if top <= 0:
+                    # every record asked for was saved before the connection dropped
+                    tracker.rewind()
+                    partFile.seek(tracker.bytesSaved)
+                    partFile.truncate()
+                    return
+                parameters['$top'] = str(top)
+            skipHeaderLine = tracker.format == 'csv'
+        elif tracker.format == 'file':
+            headers['Range'] = f'bytes={tracker.bytesSaved}-'
+
+    with getClient().get(baseUrl, params=parameters or None, headers=headers, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        if 'Range' in headers and response.status_code != 206:
+            # the server ignored the Range request and is sending the whole file again
+            tracker.reset()
+        tracker.rewind()
+        partFile.seek(tracker.bytesSaved)
+        partFile.truncate()
+
+        metrics = getMetrics()
+        if tracker.format == 'file' and 'Content-Length' in response.headers:
+            metrics.expect('bytesWritten', tracker.bytesSaved + int(response.headers['Content-Length']))
+
+        lastCheckpoint = tracker.bytesSaved
+        for chunk in response.iter_content(chunkSize):
+            start, length = 0, len(chunk)
+            if skipHeaderLine:
+                # a resumed csv query repeats the header row, drop it (header names never contain newlines)
+                newline = chunk.find(b'\n')
+                if newline < 0:
+                    continue
+                start = newline + 1
+                skipHeaderLine = False
+            recordsBefore = tracker.recordsSaved
+            with metrics.phase('write'):
+                writeAll(partFile, memoryview(chunk)[start:])
+            with metrics.phase('parse'):
+                tracker.update(chunk, start, length)
+            if metrics.enabled:
+                metrics.count('bytesWritten', length - start)
+                if tracker.recordsSaved > recordsBefore:
+                    metrics.count('records', tracker.recordsSaved - recordsBefore)
+            if onChunk:
+                onChunk(length - start)
+            if tracker.format != 'file' and tracker.bytesSaved - lastCheckpoint >= CHECKPOINT_EVERY:
+                checkpoint.save(tracker.bytesSaved, tracker.recordsSaved)
+                lastCheckpoint = tracker.bytesSaved
+
+
+# Download baseUrl + queryParameters to saveLocation, resuming an earlier interrupted download of the same
+#   request when a checkpoint for it exists. Returns the number of bytes written.
+#
+#   onChunk(byteCount) is called for every chunk received and can be used for progress reporting.
+def streamDownload(baseUrl, saveLocation, queryParameters=None, format=None, maxRetries=5, backoff=1.0,
+                   maxDelay=60.0, chunkSize=CHUNK_SIZE, timeout=(30, 300), onChunk=None):
+    format = format or detectFormat(baseUrl, queryParameters)
+    if format in RESUMABLE_BY_SKIP and not (queryParameters or {}).get('$orderby'):
+        # resuming by $skip needs the records to come back in the same order every time
+        queryParameters = dict(queryParameters or {}, **{'$orderby': 'id'})
+    partLocation = saveLocation + '.part'
+    requestKey = {'url': baseUrl, 'parameters': queryParameters or {}, 'format': format}
+    checkpoint = Checkpoint(saveLocation + '.checkpoint', requestKey)
+
+    saved = checkpoint.load()
+    bytesSaved, recordsSaved = saved or (0, 0)
+    if not os.path.exists(partLocation) or os.path.getsize(partLocation) < bytesSaved:
+        bytesSaved, recordsSaved = 0, 0
+    elif format == 'file' and saved is not None:
+        bytesSaved = os.path.getsize(partLocation)
+    if format not in RESUMABLE_BY_SKIP and format != 'file':
+        bytesSaved, recordsSaved = 0, 0
+    tracker = RecordBoundaryTracker(format, bytesSaved, recordsSaved)
+    if format == 'file' and saved is None:
+        checkpoint.save(0, 0)
+
+    # the part file is unbuffered since every write is already a large block
+    attempt = 0
+    with open(partLocation, 'r+b' if os.path.exists(partLocation) else 'w+b', buffering=0) as partFile:
+        while True:
+            progressBefore = tracker.bytesSaved
+            try:
+                streamAttempt(baseUrl, queryParameters, partFile, tracker, checkpoint, chunkSize, timeout, onChunk)
+                break
+            except requests.RequestException as error:
+                if not isRetryable(error):
+                    raise DownloadError(f'{baseUrl} could not be downloaded: {error}') from error
+                if format not in RESUMABLE_BY_SKIP and format != 'file':
+                    tracker.reset()
+                checkpoint.save(tracker.bytesSaved, tracker.recordsSaved)
+
+                # an attempt that made progress resets the retry count, only consecutive failures count
+                if tracker.bytesSaved > progressBefore:
+                    attempt = 0
+                if attempt >= maxRetries:
+                    raise DownloadError(f'{baseUrl} could not be downloaded after {maxRetries} retries: {error}') from error
+                time.sleep(backoffDelay(attempt, backoff, maxDelay))
+                attempt += 1
+
+        os.fsync(partFile.fileno())
+        bytesWritten = partFile.tell()
+
+    os.replace(partLocation, saveLocation)
+    checkpoint.remove()
+    return bytesWritten
+
+
+# The drop-in replacement for the saveLargeQuery functions in the streaming samples
+def saveLargeQuery(baseUrl, queryParameters, saveLocation, **options):
+    try:
+        streamDownload(baseUrl, saveLocation, queryParameters, **options)
+        print('File finished')
+        return True
+    except DownloadError as error:
+        print(f'file could not be downloaded: {error}')
+        return False
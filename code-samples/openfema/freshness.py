@@ -0,0 +1,108 @@
+# Find out which of many datasets have been refreshed, using a single call to the DataSets metadata endpoint.
+#   Checking each dataset with its own DataSets query costs one round trip per dataset; here the
+#   lastDataSetRefresh of every tracked dataset is requested at once with a combined $filter (or, for long
+#   lists, by pulling the whole DataSets list) and the answer is cached for a few minutes so a scheduler can
+#   ask again and again without hitting the API.
+#
+#   checker = FreshnessChecker()
+#   stale = checker.staleDatasets({('DisasterDeclarationsSummaries', 2): lastRun, ('FemaRegions', 2): lastRun})
+
+import time
+from datetime import datetime, timezone
+
+from .client import getClient
+from .query import anyOf, field
+
+BASE_URL = 'https://www.fema.gov/api/open/'
+
+# cached refresh times are reused for this many seconds
+DEFAULT_TTL = 300
+
+# beyond this many datasets the combined $filter gets long, so the full DataSets list is pulled instead
+MAX_FILTER_DATASETS = 40
+
+
+# Parse an OpenFEMA timestamp such as "2024-07-16T17:34:52.519Z" into a timezone aware datetime. Timestamps
+#   without a timezone are taken to be UTC.
+def parseTimestamp(value):
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+# Build "(name eq 'A' and version eq 1) or (name eq 'B' and version eq 2)"
+def buildDatasetFilter(datasets):
+    return anyOf(*((field('name') == name) & (field('version') == int(version)) for name, version in datasets)).compile()
+
+
+# Pass a cache.ResponseCache as `cache` to keep the DataSets answer on disk between runs, it is then
+#   revalidated with a conditional request instead of downloaded again.
+class FreshnessChecker:
+    def __init__(self, baseUrl=BASE_URL, ttl=DEFAULT_TTL, timeout=60, cache=None):
+        self.endpointUrl = baseUrl.rstrip('/') + '/v1/DataSets'
+        self.ttl = ttl
+        self.timeout = timeout
+        self.responseCache = cache
+        self.cache = {}             # (name, version) -> lastDataSetRefresh as a datetime
+        self.cachedAt = {}          # (name, version) -> time.monotonic() when it was fetched
+
+    def queryDataSets(self, queryParameters):
+        parameters = {'$select': 'name,version,lastDataSetRefresh', '$metadata': 'off', '$allrecords': 'true'}
+        parameters.update(queryParameters)
+        if self.responseCache is not None:
+            return self.responseCache.getJson(self.endpointUrl, parameters)['DataSets']
+        with getClient().get(self.endpointUrl, params=parameters, timeout=self.timeout) as response:
+            response.raise_for_status()
+            return response.json()['DataSets']
+
+    # Fetch lastDataSetRefresh for every dataset not already in the cache (or whose entry has expired) with
+    #   a single request. Returns {(name, version): datetime or None}, None meaning the dataset was not found.
+    def refreshTimes(self, datasets):
+        datasets = [(name, int(version)) for name, version in datasets]
+        now = time.monotonic()
+        missing = [key for key in dict.fromkeys(datasets) if now - self.cachedAt.get(key, -self.ttl - 1) > self.ttl]
+
+        if missing:
+            if len(missing) > MAX_FILTER_DATASETS:
+                entries = self.queryDataSets({})
+            else:
+                entries = self.queryDataSets({'$filter': buildDatasetFilter(missing)})
+            found = {}
+            for entry in entries:
+                refreshed = entry.get('lastDataSetRefresh')
+                found[(entry['name'], int(entry['version']))] = parseTimestamp(refreshed) if refreshed else None
+            # a full DataSets pull refreshes the whole cache, not just the datasets asked about
+            for key in set(missing) | set(found):
+                self.cache[key] = found.get(key)
+                self.cachedAt[key] = now
+
+        return {key: self.cache.get(key) for key in datasets}
+
+    # lastChecked maps (name, version) to when that dataset was last pulled (a datetime, a timestamp string or
+    #   None for never). Returns the (name, version) pairs that have been refreshed since, in the order given.
+    def staleDatasets(self, lastChecked):
+        refreshed = self.refreshTimes(lastChecked.keys())
+        stale = []
+        for key, checked in lastChecked.items():
+            refreshTime = refreshed[(key[0], int(key[1]))]
+            if checked is None or (refreshTime is not None and refreshTime > parseTimestamp(checked)):
+                stale.append(key)
+        return stale
+
+    def clear(self):
+        self.cache.clear()
+        self.cachedAt.clear()
+
+
+# Convenience for the sync engine: which of the given (name, version) datasets have been refreshed since
+#   they were last synced into the store. The lastDataSetRefresh recorded at sync time is compared with the
+#   current one, both server timestamps, so neither clock skew nor a refresh published during the sync can hide
+#   a change. Only stores synced before that was recorded fall back to the local time of the last sync.
+def staleSyncedDatasets(store, datasets, checker=None):
+    checker = checker or FreshnessChecker()
+    lastChecked = {}
+    for name, version in datasets:
+        lastChecked[(name, version)] = store.getDatasetRefresh(name, version) or store.getLastSync(name, version)
+    return checker.staleDatasets(lastChecked)
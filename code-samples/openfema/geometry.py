@@ -0,0 +1,350 @@
+# Region and county geometries prepared for maps and for placing records on them. A FemaRegions response holds
+#   every region at full resolution; embedded as-is in a folium map that is megabytes of coordinates the browser
+#   has to draw, most of them closer together than a pixel. A GeometryLayer
+#     - simplifies the geometries once per zoom level (Douglas-Peucker, with a tolerance of half a pixel at that
+#       zoom), drops islands smaller than that, rounds coordinates to the precision the zoom can show and keeps
+#       each tier on disk, so a map embeds only the simplified geometries of the features it shows
+#     - builds a grid index over the polygons for point in region lookups, and assigns whole arrays of
+#       longitudes and latitudes to regions with vectorized NumPy point in polygon tests
+#
+#   regions = regionLayer()                                  # FemaRegions, through the response cache
+#   folium.GeoJson(regions.featureCollection(zoom=4)).add_to(m)
+#   regions.assign(df['longitude'], df['latitude'])         # the region of every record, None outside them all
+#
+#   counties = geojsonLayer('la_county.geojson', 'COUNTY')   # any GeoJSON file or url, keyed on a property
+#
+#   Coordinates are GeoJSON [longitude, latitude] degrees. Requires numpy.
+
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+from .cache import ResponseCache
+from .query import BASE_URL
+
+CACHE_DIRECTORY = '.openfema-cache'
+
+# simplification tolerance in screen pixels
+TOLERANCE_PIXELS = 0.5
+
+# the most zoom levels are simplified for, beyond it the geometries are used as they are
+MAX_ZOOM = 14
+
+# points x edges compared at once in the point in polygon test
+BLOCK_ELEMENTS = 2 * 1024 * 1024
+
+
+# The size of half a pixel in degrees at a web map zoom level (a 256 pixel tile covers 360 degrees at zoom 0)
+def toleranceForZoom(zoom):
+    return TOLERANCE_PIXELS * 360.0 / (256 * 2 ** zoom)
+
+
+# Decimal places worth keeping at a tolerance, finer digits cannot be seen
+def decimalsForTolerance(tolerance):
+    return min(7, max(1, math.ceil(-math.log10(tolerance)) + 1))
+
+
+# Distance from each point to the segment from a to b (one segment per point)
+def segmentDistances(points, a, b):
+    direction = b - a
+    lengths = np.einsum('ij,ij->i', direction, direction)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(lengths > 0, np.einsum('ij,ij->i', points - a, direction) / lengths, 0.0)
+    nearest = a + np.clip(t, 0.0, 1.0)[:, None] * direction
+    return np.hypot(*(points - nearest).T)
+
+
+# Douglas-Peucker simplification of a line: keep the point farthest from the line between the ends while it
+#   is farther than the tolerance, then do the same on each side of it. Every open segment of a level is
+#   worked on at once. Returns the indexes of the kept points.
+def simplifyLine(points, tolerance):
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    starts, ends = np.array([0]), np.array([len(points) - 1])
+    while len(starts):
+        interior = ends - starts - 1
+        starts, ends, interior = starts[interior > 0], ends[interior > 0], interior[interior > 0]
+        if not len(starts):
+            break
+        # the interior points of all segments one after another, with the segment each belongs to
+        segment = np.repeat(np.arange(len(starts)), interior)
+        offsets = np.concatenate([[0], np.cumsum(interior)[:-1]])
+        indexes = np.arange(len(segment)) - offsets[segment] + starts[segment] + 1
+        distances = segmentDistances(points[indexes], points[starts[segment]], points[ends[segment]])
+        largest = np.maximum.reduceat(distances, offsets)
+        # the first point of each segment at its largest distance
+        candidates = np.flatnonzero(distances == largest[segment])
+        _, first = np.unique(segment[candidates], return_index=True)
+        farthest = indexes[candidates[first]]
+        split = largest > tolerance
+        keep[farthest[split]] = True
+        starts = np.concatenate([starts[split], farthest[split]])
+        ends = np.concatenate([farthest[split], ends[split]])
+    return np.flatnonzero(keep)
+
+
+# Simplify a closed ring. Both ends of a ring are the same point, so it is split at the point farthest from
+#   them and each half simplified. Returns None when fewer than 4 points (a triangle) would be left.
+def simplifyRing(ring, tolerance):
+    if len(ring) <= 4:
+        return ring
+    farthest = int(np.argmax(np.hypot(*(ring - ring[0]).T)))
+    first = simplifyLine(ring[:farthest + 1], tolerance)
+    second = simplifyLine(ring[farthest:], tolerance) + farthest
+    kept = np.concatenate([first, second[1:]])
+    return ring[kept] if len(kept) >= 4 else None
+
+
+# The polygons of a GeoJSON geometry (Polygon, MultiPolygon or a Feature holding one), each a list of closed
+#   rings as (n, 2) arrays, the outer ring first
+def geometryPolygons(geometry):
+    if isinstance(geometry, str):
+        geometry = json.loads(geometry)
+    if geometry.get('type') == 'Feature':
+        geometry = geometry['geometry']
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    elif geometry['type'] == 'GeometryCollection':
+        return [polygon for part in geometry['geometries'] for polygon in geometryPolygons(part)]
+    else:
+        raise ValueError(f'{geometry["type"]} geometries have no area')
+
+    result = []
+    for polygon in polygons:
+        rings = []
+        for ring in polygon:
+            ring = np.asarray(ring, dtype=np.float64)[:, :2]
+            if len(ring) and not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])
+            if len(ring) >= 4:
+                rings.append(ring)
+        if rings:
+            result.append(rings)
+    return result
+
+
+# Whether each point is inside a polygon (even-odd rule over all of its rings, so holes are outside). The
+#   edges of a ring are sorted into horizontal bands and each point is only tested against the edges of its band.
+def pointsInPolygon(x, y, rings):
+    inside = np.zeros(len(x), dtype=bool)
+    for ring in rings:
+        x1, y1, x2, y2 = ring[:-1, 0], ring[:-1, 1], ring[1:, 0], ring[1:, 1]
+        bottom, top = ring[:, 1].min(), ring[:, 1].max()
+        bandCount = max(1, int(math.sqrt(len(x1))))
+        bandHeight = max((top - bottom) / bandCount, 1e-12)
+        firstBand = np.clip(((np.minimum(y1, y2) - bottom) // bandHeight).astype(np.int64), 0, bandCount - 1)
+        lastBand = np.clip(((np.maximum(y1, y2) - bottom) // bandHeight).astype(np.int64), 0, bandCount - 1)
+        pointBands = np.where((y >= bottom) & (y <= top),
+                              np.clip((y - bottom) // bandHeight, 0, bandCount - 1), -1).astype(np.int64)
+        order = np.argsort(pointBands, kind='stable')
+        bandStarts = np.searchsorted(pointBands[order], np.arange(bandCount + 1))
+        for band in range(bandCount):
+            points = order[bandStarts[band]:bandStarts[band + 1]]
+            if not len(points):
+                continue
+            edges = np.flatnonzero((firstBand <= band) & (lastBand >= band))
+            ex1, ey1, ex2, ey2 = x1[edges], y1[edges], x2[edges], y2[edges]
+            blockSize = max(1, BLOCK_ELEMENTS // max(1, len(edges)))
+            for start in range(0, len(points), blockSize):
+                block = points[start:start + blockSize]
+                px, py = x[block, None], y[block, None]
+                # a ray to the right of the point crosses the edge
+                spans = (ey1 > py) != (ey2 > py)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    crossingX = (ex2 - ex1) * (py - ey1) / (ey2 - ey1) + ex1
+                crossings = np.count_nonzero(spans & (px < crossingX), axis=1)
+                inside[block] ^= (crossings % 2).astype(bool)
+    return inside
+
+
+class GeometryLayer:
+    # features is a list of (key, geometry, properties). Simplified tiers are kept in directory when one is
+    #   given, under a name made from the layer name and a hash of the source geometries so a changed source
+    #   is simplified again.
+    def __init__(self, features, name='layer', directory=None):
+        self.name = name
+        self.directory = directory
+        self.keys = []
+        self.properties = []
+        self.polygons = []              # every polygon of every feature
+        partFeatures = []
+        digest = hashlib.sha256()
+        for key, geometry, properties in features:
+            digest.update(json.dumps([key, geometry], sort_keys=True, default=str).encode())
+            for polygon in geometryPolygons(geometry):
+                self.polygons.append(polygon)
+                partFeatures.append(len(self.keys))
+            self.keys.append(key)
+            self.properties.append(properties or {})
+        self.sourceHash = digest.hexdigest()[:16]
+        self.partFeatures = np.asarray(partFeatures, dtype=np.int64)
+        # min x, min y, max x, max y of the outer ring of every polygon and of every feature
+        self.partBounds = np.array([[*polygon[0].min(axis=0), *polygon[0].max(axis=0)] for polygon in self.polygons])
+        self.partBounds = self.partBounds.reshape(-1, 4)
+        self.featureBounds = np.full((len(self.keys), 4), np.nan)
+        for part, feature in enumerate(self.partFeatures):
+            bounds = self.partBounds[part]
+            current = self.featureBounds[feature]
+            self.featureBounds[feature] = bounds if np.isnan(current[0]) else \
+                [*np.minimum(current[:2], bounds[:2]), *np.maximum(current[2:], bounds[2:])]
+        self.tiers = {}                 # zoom -> simplified geometry of every feature
+        self.grid = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    # The geometry of every feature simplified for a zoom level, computed once and then read from memory or disk
+    def simplified(self, zoom):
+        zoom = min(int(zoom), MAX_ZOOM)
+        if zoom in self.tiers:
+            return self.tiers[zoom]
+        path = None
+        if self.directory:
+            path = os.path.join(self.directory, f'{self.name}-{self.sourceHash}-z{zoom}.json')
+            if os.path.exists(path):
+                with open(path) as f:
+                    self.tiers[zoom] = json.load(f)
+                return self.tiers[zoom]
+
+        tolerance = toleranceForZoom(zoom)
+        decimals = decimalsForTolerance(tolerance)
+        featurePolygons = [[] for _ in self.keys]
+        largest = {}
+        for part, polygon in enumerate(self.polygons):
+            feature = int(self.partFeatures[part])
+            width, height = self.partBounds[part, 2:] - self.partBounds[part, :2]
+            if feature not in largest or width * height > largest[feature][0]:
+                largest[feature] = (width * height, part)
+            # islands smaller than the tolerance would not show
+            if max(width, height) < tolerance:
+                continue
+            rings = [simplifyRing(ring, tolerance) for ring in polygon]
+            if rings[0] is None:
+                continue
+            featurePolygons[feature].append([np.round(ring, decimals).tolist() for ring in rings if ring is not None])
+        for feature, (_, part) in largest.items():
+            if not featurePolygons[feature]:
+                # every feature keeps at least its largest polygon, however small
+                featurePolygons[feature].append([np.round(ring, decimals).tolist() for ring in self.polygons[part]])
+
+        tier = [{'type': 'MultiPolygon', 'coordinates': polygons} if len(polygons) != 1 else
+                {'type': 'Polygon', 'coordinates': polygons[0]} for polygons in featurePolygons]
+        if path:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + '.part', 'w') as f:
+                json.dump(tier, f, separators=(',', ':'))
+            os.replace(path + '.part', path)
+        self.tiers[zoom] = tier
+        return tier
+
+    # The keys of the features whose bounding box overlaps (west, south, east, north)
+    def keysInBounds(self, bounds):
+        west, south, east, north = bounds
+        overlaps = (self.featureBounds[:, 0] <= east) & (self.featureBounds[:, 2] >= west) & \
+                   (self.featureBounds[:, 1] <= north) & (self.featureBounds[:, 3] >= south)
+        return [self.keys[index] for index in np.flatnonzero(overlaps)]
+
+    # A FeatureCollection for a map at a zoom level holding only the features asked for: the keys given, those
+    #   in bounds (west, south, east, north) or all of them. properties maps a key to extra feature properties,
+    #   such as the value a choropleth colors by.
+    def featureCollection(self, zoom, keys=None, bounds=None, properties=None):
+        wanted = set(self.keys if keys is None else keys)
+        if bounds is not None:
+            wanted &= set(self.keysInBounds(bounds))
+        tier = self.simplified(zoom)
+        features = []
+        for index, key in enumerate(self.keys):
+            if key in wanted:
+                featureProperties = {**self.properties[index], 'key': key, **((properties or {}).get(key, {}))}
+                features.append({'type': 'Feature', 'id': key, 'properties': featureProperties,
+                                 'geometry': tier[index]})
+        return {'type': 'FeatureCollection', 'features': features}
+
+    # The grid index: the extent of the layer cut into square cells about the size of a typical polygon, with
+    #   the range of cells each polygon's bounding box covers
+    def buildGrid(self):
+        west, south = self.partBounds[:, :2].min(axis=0)
+        east, north = self.partBounds[:, 2:].max(axis=0)
+        sizes = np.maximum(self.partBounds[:, 2] - self.partBounds[:, 0], self.partBounds[:, 3] - self.partBounds[:, 1])
+        cellSize = max(float(np.median(sizes)), 1e-9)
+        columns = int((east - west) // cellSize) + 1
+        rows = int((north - south) // cellSize) + 1
+        cellRanges = np.column_stack([((self.partBounds[:, 0] - west) // cellSize),
+                                      ((self.partBounds[:, 1] - south) // cellSize),
+                                      ((self.partBounds[:, 2] - west) // cellSize),
+                                      ((self.partBounds[:, 3] - south) // cellSize)]).astype(np.int64)
+        self.grid = {'west': west, 'south': south, 'cellSize': cellSize, 'columns': columns, 'rows': rows,
+                     'cellRanges': cellRanges}
+        return self.grid
+
+    # The index of the feature holding each point, -1 for points outside every feature. The points are sorted
+    #   into grid cells, then each polygon tests only the points in the cells its bounding box covers.
+    def assignIndexes(self, longitudes, latitudes):
+        x = np.asarray(longitudes, dtype=np.float64)
+        y = np.asarray(latitudes, dtype=np.float64)
+        result = np.full(len(x), -1, dtype=np.int64)
+        if not len(self.polygons) or not len(x):
+            return result
+        grid = self.grid or self.buildGrid()
+        column = np.floor((x - grid['west']) / grid['cellSize'])
+        row = np.floor((y - grid['south']) / grid['cellSize'])
+        valid = (column >= 0) & (column < grid['columns']) & (row >= 0) & (row < grid['rows'])
+        cells = np.where(valid, row * grid['columns'] + column, -1).astype(np.int64)
+        order = np.argsort(cells, kind='stable')
+        sortedCells = cells[order]
+
+        for part, (column0, row0, column1, row1) in enumerate(grid['cellRanges']):
+            # the points in each row of cells covered, a contiguous run of the sorted cell numbers
+            starts = np.searchsorted(sortedCells, np.arange(row0, row1 + 1) * grid['columns'] + column0, 'left')
+            ends = np.searchsorted(sortedCells, np.arange(row0, row1 + 1) * grid['columns'] + column1, 'right')
+            if not (ends > starts).any():
+                continue
+            candidates = order[np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])]
+            candidates = candidates[result[candidates] < 0]
+            bounds = self.partBounds[part]
+            candidates = candidates[(x[candidates] >= bounds[0]) & (x[candidates] <= bounds[2]) &
+                                    (y[candidates] >= bounds[1]) & (y[candidates] <= bounds[3])]
+            if len(candidates):
+                inside = pointsInPolygon(x[candidates], y[candidates], self.polygons[part])
+                result[candidates[inside]] = self.partFeatures[part]
+        return result
+
+    # The key of the feature holding each point, None outside them all
+    def assign(self, longitudes, latitudes):
+        return [self.keys[index] if index >= 0 else None for index in self.assignIndexes(longitudes, latitudes)]
+
+    def lookup(self, longitude, latitude):
+        return self.assign([longitude], [latitude])[0]
+
+
+# The FEMA regions, downloaded through the response cache so repeat runs do not download them again.
+#   Keyed on the region name, the other fields of each region become the feature properties.
+def regionLayer(cache=None, baseUrl=BASE_URL):
+    cache = cache or ResponseCache(CACHE_DIRECTORY)
+    data = cache.getJson(f'{baseUrl.rstrip("/")}/v2/FemaRegions', {'$metadata': 'off'})
+    features = [(region.get('name') or region.get('region'), region['regionGeometry'],
+                 {name: value for name, value in region.items() if name != 'regionGeometry'})
+                for region in data['FemaRegions'] if region.get('regionGeometry')]
+    return GeometryLayer(features, 'FemaRegions', os.path.join(cache.directory, 'geometry'))
+
+
+# A layer from a GeoJSON FeatureCollection file or url (counties, for example), keyed on a feature property.
+#   Urls are downloaded through the response cache.
+def geojsonLayer(source, keyProperty, name=None, cache=None):
+    if source.startswith(('http://', 'https://')):
+        cache = cache or ResponseCache(CACHE_DIRECTORY)
+        collection = cache.getJson(source)
+        directory = cache.directory
+    else:
+        with open(source) as f:
+            collection = json.load(f)
+        directory = cache.directory if cache else CACHE_DIRECTORY
+    name = name or os.path.splitext(os.path.basename(source.split('?')[0]))[0]
+    features = [(feature['properties'][keyProperty], feature['geometry'], feature['properties'])
+                for feature in collection['features'] if feature.get('geometry')]
+    return GeometryLayer(features, name, os.path.join(directory, 'geometry'))
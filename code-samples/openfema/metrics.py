@@ -0,0 +1,342 @@
+# Where the time of a download goes. A slow pull can be bound by the network, by parsing or by the disk, and
+#   prints like "Iteration 3 done" cannot tell which. With metrics switched on, the helpers time each phase of
+#   the fetch, stream and write path and count what went through it:
+#     connect  - opening new connections (TCP and TLS handshakes)
+#     ttfb     - waiting for the response headers after sending a request (includes connecting when a new
+#                connection was needed)
+#     transfer - reading response bodies off the wire, including decompression
+#     parse    - turning the received bytes into records (records.py), or finding record boundaries in them
+#                for a resumable stream (download.py)
+#     write    - writing to the output file
+#   plus counters such as requests, bytesReceived, bytesWritten and records, and an ETA from the rate of
+#   records (or bytes) so far and the total the inline count (or Content-Length) says to expect.
+#
+#   with Metrics() as metrics:                           # switched on for every helper until the block ends
+#       metrics.startReporting(10)                       # a progress line every 10 seconds
+#       query.download('out.jsonl')
+#   metrics.writeJson('metrics.json')                    # or metrics.writePrometheus('openfema.prom')
+#
+#   Metrics(profile=True) also runs cProfile (on the thread that entered the block) and Metrics(traceMemory=True)
+#   tracemalloc while the block runs, their top entries are included in the export. The JSON file holds the same
+#   snapshot() dict, the Prometheus file is in the text format read by node_exporter's textfile collector.
+#
+#   When no Metrics block is active the shared instance is a disabled one: the helpers check one attribute and
+#   skip all timing and counting, so the overhead is negligible.
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+
+# entries of the profile and of the memory trace included in a snapshot
+TOP_ENTRIES = 25
+
+# records are counted locally and added to the shared counter this many at a time
+RECORD_BATCH = 1000
+
+
+# Times a phase when used in a with statement
+class PhaseTimer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.addTime(self.name, time.perf_counter() - self.start)
+
+
+# Stands in for a PhaseTimer when metrics are disabled
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+
+NULL_TIMER = NullTimer()
+
+
+# A binary stream that keeps the time spent in its reads, so the time a parser spends reading (already timed
+#   as the transfer phase by the client) can be told apart from the time it spends parsing
+class TimedStream:
+    def __init__(self, stream):
+        self.stream = stream
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        try:
+            return self.stream.read(size)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+class Metrics:
+    def __init__(self, enabled=True, profile=False, traceMemory=False):
+        self.enabled = enabled
+        self.profile = profile
+        self.traceMemory = traceMemory
+        self.lock = threading.Lock()
+        self.phases = {}                # name -> [calls, seconds, longest call]
+        self.counters = {}              # name -> running total
+        self.expected = {}              # counter name -> expected total, for the ETA
+        self.firstCount = {}            # counter name -> time of its first increase
+        self.startedAt = time.monotonic()
+        self.finishedAt = None
+        self.profiler = None
+        self.profileStats = None
+        self.memoryStats = None
+        self.previous = None
+        self.reporter = None
+        self.stopReporting = threading.Event()
+
+    # Switch these metrics on for every helper, starting the profiler and memory trace when asked for
+    def __enter__(self):
+        self.previous = setMetrics(self)
+        self.startedAt = time.monotonic()
+        if self.traceMemory:
+            tracemalloc.start()
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profileStats = topFunctions(self.profiler)
+            self.profiler = None
+        if self.traceMemory and tracemalloc.is_tracing():
+            self.memoryStats = topAllocations()
+            tracemalloc.stop()
+        self.stopReporting.set()
+        if self.reporter is not None:
+            self.reporter.join()
+        self.finishedAt = time.monotonic()
+        setMetrics(self.previous)
+
+    # A context manager timing a phase: with metrics.phase('write'): ...
+    def phase(self, name):
+        return PhaseTimer(self, name) if self.enabled else NULL_TIMER
+
+    def addTime(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            phase = self.phases.get(name)
+            if phase is None:
+                self.phases[name] = [1, seconds, seconds]
+            else:
+                phase[0] += 1
+                phase[1] += seconds
+                if seconds > phase[2]:
+                    phase[2] = seconds
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            if name not in self.firstCount:
+                self.firstCount[name] = time.monotonic()
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # The total a counter is expected to reach, such as the inline count of a query for records
+    def expect(self, name, total):
+        if not self.enabled or total is None:
+            return
+        with self.lock:
+            self.expected[name] = total
+
+    # Keep the time spent reading a stream, for timedRecords()
+    def timedStream(self, stream):
+        return TimedStream(stream) if self.enabled else stream
+
+    # Yield the records of a parser reading from a TimedStream, timing the parse phase (time spent in the
+    #   parser less the time spent reading) and counting the records. Both are added up locally and passed on
+    #   RECORD_BATCH records at a time.
+    def timedRecords(self, records, stream):
+        if not self.enabled:
+            yield from records
+            return
+        iterator = iter(records)
+        pending = 0
+        parseSeconds = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                readBefore = stream.seconds
+                try:
+                    record = next(iterator)
+                finally:
+                    parseSeconds += time.perf_counter() - start - (stream.seconds - readBefore)
+                pending += 1
+                if pending == RECORD_BATCH:
+                    self.addTime('parse', parseSeconds)
+                    self.count('records', pending)
+                    pending, parseSeconds = 0, 0.0
+                yield record
+        except StopIteration:
+            return
+        finally:
+            if parseSeconds:
+                self.addTime('parse', parseSeconds)
+            if pending:
+                self.count('records', pending)
+
+    # Seconds until a counter reaches its expected total at the rate it has been increasing, None when unknown
+    def eta(self, name='records'):
+        with self.lock:
+            total, done, since = self.expected.get(name), self.counters.get(name, 0), self.firstCount.get(name)
+        if total is None or since is None or done <= 0:
+            return None
+        elapsed = (self.finishedAt or time.monotonic()) - since
+        return max(0.0, (total - done) * elapsed / done)
+
+    def snapshot(self):
+        with self.lock:
+            phases = {name: {'calls': calls, 'seconds': seconds, 'longest': longest}
+                      for name, (calls, seconds, longest) in self.phases.items()}
+            counters = dict(self.counters)
+            expected = dict(self.expected)
+        elapsed = (self.finishedAt or time.monotonic()) - self.startedAt
+        snapshot = {'elapsedSeconds': elapsed, 'phases': phases, 'counters': counters, 'expected': expected,
+                    'eta': {name: self.eta(name) for name in expected}}
+        if self.profileStats is not None:
+            snapshot['profile'] = self.profileStats
+        if self.memoryStats is not None:
+            snapshot['memory'] = self.memoryStats
+        return snapshot
+
+    # One line of progress: what has been done, the rates, the ETA and the share of each phase
+    def progressLine(self):
+        snapshot = self.snapshot()
+        counters, elapsed = snapshot['counters'], max(snapshot['elapsedSeconds'], 1e-9)
+        parts = [f'{elapsed:.0f}s']
+        if 'records' in counters:
+            records = f'{counters["records"]:,}'
+            if 'records' in snapshot['expected']:
+                total = snapshot['expected']['records']
+                records += f'/{total:,} ({100 * counters["records"] / max(total, 1):.0f}%)'
+            parts.append(f'{records} records, {counters["records"] / elapsed:,.0f}/s')
+        if 'bytesReceived' in counters:
+            parts.append(f'{counters["bytesReceived"] / 1e6:,.1f} MB received, '
+                         f'{counters["bytesReceived"] / 1e6 / elapsed:,.1f} MB/s')
+        eta = next((value for value in snapshot['eta'].values() if value is not None), None)
+        if eta is not None:
+            parts.append(f'ETA {eta:,.0f}s')
+        phaseTotal = sum(phase['seconds'] for phase in snapshot['phases'].values())
+        if phaseTotal:
+            parts.append(' '.join(f'{name} {100 * phase["seconds"] / phaseTotal:.0f}%'
+                                  for name, phase in sorted(snapshot['phases'].items())))
+        return ', '.join(parts)
+
+    # Call output(progressLine()) every interval seconds from a background thread until the block ends
+    def startReporting(self, interval=10, output=print):
+        def report():
+            while not self.stopReporting.wait(interval):
+                output(self.progressLine())
+
+        self.stopReporting.clear()
+        self.reporter = threading.Thread(target=report, daemon=True)
+        self.reporter.start()
+
+    def writeJson(self, path):
+        writeAtomically(path, json.dumps(self.snapshot(), indent=2))
+
+    # Write the metrics in the Prometheus text format, labels (e.g. {'dataset': 'FimaNfipClaims'}) are added to
+    #   every sample
+    def writePrometheus(self, path, prefix='openfema', labels=None):
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f'# HELP {prefix}_{name} {help}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            for sampleLabels, value in samples:
+                lines.append(f'{prefix}_{name}{formatLabels({**(labels or {}), **sampleLabels})} {value!r}')
+
+        phases = sorted(snapshot['phases'].items())
+        metric('phase_seconds_total', 'counter', 'Time spent in each phase',
+               [({'phase': name}, phase['seconds']) for name, phase in phases])
+        metric('phase_calls_total', 'counter', 'Number of timed calls of each phase',
+               [({'phase': name}, phase['calls']) for name, phase in phases])
+        for name, value in sorted(snapshot['counters'].items()):
+            metric(f'{snakeCase(name)}_total', 'counter', f'Total {name}', [({}, value)])
+        for name, value in sorted(snapshot['expected'].items()):
+            metric(f'{snakeCase(name)}_expected', 'gauge', f'Expected total {name}', [({}, value)])
+        etas = [({'counter': name}, value) for name, value in sorted(snapshot['eta'].items()) if value is not None]
+        if etas:
+            metric('eta_seconds', 'gauge', 'Estimated seconds until the expected total is reached', etas)
+        metric('elapsed_seconds', 'gauge', 'Seconds since the metrics were started', [({}, snapshot['elapsedSeconds'])])
+        writeAtomically(path, '\n'.join(lines) + '\n')
+
+
+def snakeCase(name):
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+
+
+def escapeLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatLabels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escapeLabel(value)}"' for name, value in sorted(labels.items())) + '}'
+
+
+# Written to a temporary file and renamed, so a collector never reads a half written file
+def writeAtomically(path, text):
+    temporaryPath = path + '.tmp'
+    with open(temporaryPath, 'w') as f:
+        f.write(text)
+    os.replace(temporaryPath, path)
+
+
+# The functions with the most cumulative time in a profile
+def topFunctions(profiler):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    entries = []
+    for (filename, line, function), (_, calls, totalTime, cumulativeTime, _) in stats.stats.items():
+        entries.append({'function': f'{os.path.basename(filename)}:{line}({function})', 'calls': calls,
+                        'seconds': totalTime, 'cumulativeSeconds': cumulativeTime})
+    return sorted(entries, key=lambda entry: entry['cumulativeSeconds'], reverse=True)[:TOP_ENTRIES]
+
+
+# Peak traced memory and the source lines holding the most memory when the trace stopped
+def topAllocations():
+    current, peak = tracemalloc.get_traced_memory()
+    statistics = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ENTRIES]
+    return {'currentBytes': current, 'peakBytes': peak,
+            'top': [{'line': str(statistic.traceback[0]), 'bytes': statistic.size, 'blocks': statistic.count}
+                    for statistic in statistics]}
+
+
+DISABLED = Metrics(enabled=False)
+currentMetrics = DISABLED
+
+
+# The metrics the helpers report to, a disabled instance unless a Metrics block is active
+def getMetrics():
+    return currentMetrics
+
+
+# Replace the metrics the helpers report to, None for the disabled instance. Returns the previous one.
+def setMetrics(metrics):
+    global currentMetrics
+    previous, currentMetrics = currentMetrics, metrics or DISABLED
+    return previous
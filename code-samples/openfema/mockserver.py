@@ -0,0 +1,507 @@
+# A small local stand-in for the OpenFEMA API so the helpers in this package can be exercised without
+#   calling fema.gov. It serves a synthetic dataset and understands the paging contract: $top, $skip,
+#   $inlinecount, $select, $filter (simple comparisons joined by "and"), $format (json, jsona, jsonl, csv),
+#   $metadata and $allrecords. $allrecords responses are streamed with chunked transfer encoding just like
+#   the real API.
+#
+#   Files added with addFile() are served as-is from /files/<name> and honor HTTP Range requests, the same
+#   way the full dataset downloads (.parquet, .csv, ...) are served. A file added under a name such as
+#   "MockDeclarations.parquet" is also served at /api/open/v1/MockDeclarations.parquet like a bulk dataset file.
+#
+#   dropConnectionAfter simulates a flaky network: the first `dropCount` streamed responses, and pages and
+#   files longer than dropConnectionAfter, are cut off after that many bytes.
+#
+#   With compress=True responses are gzip compressed for clients that send Accept-Encoding: gzip, as the real
+#   API does. Files are always served as-is.
+#
+#   Dataset responses carry an ETag that changes whenever the data does (refreshRecords, addDataSet), and a
+#   request with a matching If-None-Match gets 304 Not Modified. Set lastModified to an HTTP date to send a
+#   Last-Modified header instead, a request with the same date in If-Modified-Since then gets the 304.
+#
+#   latency (seconds) delays every response before its first byte, and bandwidth (bytes per second) limits how
+#   fast the server sends, shared between all connections like a real network link, so strategies can be
+#   compared under the conditions of a slow or distant connection (see benchmarks/download_strategies.py).
+#   keepEncoded=True keeps every record of the synthetic dataset encoded in memory, so the server can send
+#   faster than a client can receive.
+#
+#   with MockOpenFemaServer(recordCount=25000) as server:
+#       baseUrl = server.datasetUrl            # e.g. http://127.0.0.1:53211/api/open/v1/MockDeclarations
+
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+DEFAULT_TOP = 1000
+MAX_TOP = 10000
+
+# number of records rendered per chunk of a streamed response
+STREAM_BATCH = 500
+
+# bytes sent at a time when the bandwidth is limited
+THROTTLE_SLICE = 16 * 1024
+
+STATES = ['AL', 'AK', 'CA', 'FL', 'GA', 'LA', 'NY', 'TX', 'VA', 'WA']
+INCIDENT_TYPES = ['Flood', 'Hurricane', 'Fire', 'Severe Storm', 'Tornado']
+FIELDS = ['id', 'disasterNumber', 'state', 'declarationType', 'incidentType', 'declarationDate', 'amount', 'lastRefresh']
+FIELD_TYPES = ['uuid', 'smallint', 'string', 'string', 'string', 'date', 'decimal', 'date']
+
+
+# Build record number i of the synthetic dataset. Records are generated on demand so even a very large
+#   mock dataset costs no memory.
+def makeRecord(i):
+    return {
+        'id': f'{i:08d}-0000-4000-8000-000000000000',
+        'disasterNumber': 1000 + i // 50,
+        'state': STATES[i % len(STATES)],
+        'declarationType': 'DR' if i % 3 else 'EM',
+        'incidentType': INCIDENT_TYPES[i % len(INCIDENT_TYPES)],
+        'declarationDate': f'{1990 + i % 35}-{1 + i % 12:02d}-{1 + i % 28:02d}T00:00:00.000Z',
+        'amount': round((i % 1000) * 12.5, 2),
+        'lastRefresh': '2024-01-01T00:00:00.000Z',
+    }
+
+
+FILTER_OPERATORS = {
+    'eq': lambda a, b: a == b, 'ne': lambda a, b: a != b,
+    'gt': lambda a, b: a is not None and a > b, 'ge': lambda a, b: a is not None and a >= b,
+    'lt': lambda a, b: a is not None and a < b, 'le': lambda a, b: a is not None and a <= b,
+}
+
+
+# Turn a simple $filter such as "state eq 'TX' and amount gt 100" into a test function. Only comparisons
+#   joined with "and", and groups of those joined with "or", are understood, which is all the helpers in
+#   this package need.
+def parseFilter(filterText):
+    alternatives = []
+    for group in re.split(r'\)?\s+or\s+\(?', filterText.strip()):
+        tests = []
+        for condition in re.split(r'\s+and\s+', group.strip().strip('()')):
+            match = re.fullmatch(r"(\w+)\s+(eq|ne|gt|ge|lt|le)\s+('(?:[^']|'')*'|[-\d.]+|null|true|false)",
+                                 condition.strip())
+            if not match:
+                raise ValueError(f'unsupported filter condition {condition!r}')
+            field, operator, value = match.groups()
+            if value.startswith("'"):
+                value = value[1:-1].replace("''", "'")
+            else:
+                value = json.loads(value)
+            tests.append((field, FILTER_OPERATORS[operator], value))
+        alternatives.append(tests)
+    return lambda record: any(all(test(record.get(field), value) for field, test, value in tests)
+                              for tests in alternatives)
+
+
+def csvLines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+# Encode each record for a $format: a csv line, or a JSON object for the json formats
+def encodeRecords(records, format, fields):
+    if format == 'csv':
+        for record in records:
+            yield csvLines([[record.get(field) for field in fields]])
+    else:
+        for record in records:
+            yield json.dumps({field: record.get(field) for field in fields}).encode()
+
+
+# Render encoded records in one of the OpenFEMA $format types, yielding the body in pieces so large responses
+#   never exist in memory all at once
+def renderRecords(datasetName, encoded, format, fields, metadata):
+    def batches():
+        iterator = iter(encoded)
+        while True:
+            batch = list(itertools.islice(iterator, STREAM_BATCH))
+            if not batch:
+                return
+            yield batch
+
+    if format == 'jsonl':
+        for records in batches():
+            yield b'\n'.join(records) + b'\n'
+        return
+    if format == 'csv':
+        yield csvLines([fields])
+        for records in batches():
+            yield b''.join(records)
+        return
+
+    if format == 'jsona':
+        yield b'['
+    else:
+        yield b'{'
+        if metadata is not None:
+            yield b'"metadata":' + json.dumps(metadata).encode() + b','
+        yield json.dumps(datasetName).encode() + b':['
+    first = True
+    for records in batches():
+        body = b','.join(records)
+        yield body if first else b',' + body
+        first = False
+    yield b']' if format == 'jsona' else b']}'
+
+
+# A limit on bytes per second shared by every connection. Each slice of data reserves the time it takes to
+#   send at the limit, after the slices reserved before it.
+class Throttle:
+    def __init__(self, bytesPerSecond):
+        self.bytesPerSecond = bytesPerSecond
+        self.nextFree = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self, byteCount):
+        with self.lock:
+            now = time.monotonic()
+            self.nextFree = max(now, self.nextFree) + byteCount / self.bytesPerSecond
+            delay = self.nextFree - now
+        time.sleep(delay)
+
+
+# gzip a response made of pieces, piece by piece
+def gzipPieces(pieces):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # silence the default per-request logging to stderr
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        mock = self.server.mock
+        if mock.latency:
+            time.sleep(mock.latency)
+        url = urlsplit(self.path)
+        if url.path.startswith('/files/'):
+            self.sendFile(url.path[len('/files/'):])
+            return
+        match = re.fullmatch(r'/api/open/v\d+/(\w+\.\w+)', url.path)
+        if match:
+            self.sendFile(match.group(1))
+            return
+        match = re.fullmatch(r'/api/open/v\d+/(\w+)', url.path)
+        source = mock.source(match.group(1)) if match else None
+        if source is None:
+            self.send_error(404)
+            return
+        datasetName, recordCount, getRecord, defaultFields = source
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        mock.countRequest(datasetName, query)
+        if mock.lastModified:
+            validator = ('Last-Modified', mock.lastModified)
+            notModified = self.headers.get('If-Modified-Since') == mock.lastModified
+        else:
+            compressed = mock.compress and 'gzip' in self.headers.get('Accept-Encoding', '')
+            validator = ('ETag', mock.etag(self.path, compressed))
+            notModified = self.headers.get('If-None-Match') == validator[1]
+        if notModified:
+            self.send_response(304)
+            self.send_header(*validator)
+            self.end_headers()
+            return
+
+        try:
+            top = int(query.get('$top', DEFAULT_TOP))
+            skip = int(query.get('$skip', 0))
+            matches = parseFilter(query['$filter']) if '$filter' in query else None
+        except ValueError:
+            self.send_error(400)
+            return
+        allRecords = query.get('$allrecords') == 'true'
+        top = recordCount if allRecords else min(max(top, 0), MAX_TOP)
+        fields = query['$select'].split(',') if '$select' in query else defaultFields
+        format = query.get('$format', 'json')
+
+        metadata = None
+        if query.get('$metadata') != 'off':
+            metadata = {'skip': skip, 'top': top, 'count': 0, 'url': self.path}
+            if query.get('$inlinecount') == 'allpages':
+                metadata['count'] = recordCount if matches is None else \
+                    sum(1 for i in range(recordCount) if matches(getRecord(i)))
+
+        if matches is None and mock.keepEncoded and datasetName == mock.datasetName and fields == FIELDS:
+            encoded = mock.encodedRecords(format, fields)[skip:skip + top]
+        elif matches is None:
+            encoded = encodeRecords((getRecord(i) for i in range(skip, min(recordCount, skip + top))), format, fields)
+        else:
+            records = filter(matches, (getRecord(i) for i in range(recordCount)))
+            encoded = encodeRecords(itertools.islice(records, skip, skip + top), format, fields)
+        pieces = renderRecords(datasetName, encoded, format, fields, metadata)
+        contentType = 'text/csv' if format == 'csv' else 'application/json'
+        if mock.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            pieces = gzipPieces(pieces)
+            contentType = (contentType, 'gzip')
+        if allRecords:
+            self.sendChunked(pieces, contentType, [validator])
+        else:
+            self.sendBody(b''.join(pieces), contentType, extraHeaders=[validator], mayDrop=True)
+
+    # contentType is either a content type or a (content type, content encoding) pair
+    def sendHeaders(self, status, contentType, extraHeaders=()):
+        self.send_response(status)
+        contentType, encoding = contentType if isinstance(contentType, tuple) else (contentType, None)
+        self.send_header('Content-Type', contentType)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        for name, value in extraHeaders:
+            self.send_header(name, value)
+
+    # mayDrop=True lets a simulated dropped connection cut the body short
+    def sendBody(self, body, contentType, status=200, extraHeaders=(), mayDrop=False):
+        dropAfter = self.server.mock.takeDrop(len(body)) if mayDrop else None
+        self.sendHeaders(status, contentType, extraHeaders)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if dropAfter is not None:
+            self.send(body[:dropAfter])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        self.send(body)
+
+    # Write to the connection, at no more than the bandwidth when one is set
+    def send(self, data):
+        throttle = self.server.mock.throttle
+        if throttle is None:
+            self.wfile.write(data)
+            return
+        view = memoryview(data)
+        for start in range(0, len(view), THROTTLE_SLICE):
+            piece = view[start:start + THROTTLE_SLICE]
+            throttle.wait(len(piece))
+            self.wfile.write(piece)
+
+    # Stream a response with chunked transfer encoding, cutting it short when a dropped connection is simulated
+    def sendChunked(self, pieces, contentType, extraHeaders=()):
+        self.sendHeaders(200, contentType, extraHeaders)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        dropAfter = self.server.mock.takeDrop()
+        sent = 0
+        for piece in pieces:
+            if dropAfter is not None and sent + len(piece) > dropAfter:
+                piece = piece[:dropAfter - sent]
+                self.send(b'%x\r\n%s\r\n' % (len(piece), piece))
+                self.wfile.flush()
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            self.send(b'%x\r\n%s\r\n' % (len(piece), piece))
+            sent += len(piece)
+        self.send(b'0\r\n\r\n')
+
+    def sendFile(self, name):
+        path = self.server.mock.files.get(name)
+        if path is None:
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, status = 0, 200
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match:
+            start, status = int(match.group(1)), 206
+            if start >= size:
+                self.send_error(416)
+                return
+        dropAfter = self.server.mock.takeDrop(size - start)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(size - start))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            if dropAfter is not None:
+                self.send(f.read(dropAfter))
+                self.wfile.flush()
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            self.copyFile(f, size - start)
+
+    # socket.sendfile() lets the kernel copy the file straight to the connection without passing the
+    #   data through Python, falling back to plain reads and writes where that is not available. A limited
+    #   bandwidth needs the plain reads and writes.
+    def copyFile(self, f, length):
+        if self.server.mock.throttle is not None:
+            while length > 0:
+                data = f.read(min(length, THROTTLE_SLICE))
+                if not data:
+                    break
+                self.send(data)
+                length -= len(data)
+            return
+        self.wfile.flush()
+        if length > 0:
+            self.connection.sendfile(f, f.tell(), length)
+
+
+class MockOpenFemaServer:
+    def __init__(self, recordCount=1000, datasetName='MockDeclarations', host='127.0.0.1', port=0,
+                 dropConnectionAfter=None, dropCount=1, compress=False, latency=0.0, bandwidth=None,
+                 keepEncoded=False):
+        self.recordCount = recordCount
+        self.keepEncoded = keepEncoded
+        self.encoded = {}
+        self.compress = compress
+        self.latency = latency
+        self.throttle = Throttle(bandwidth) if bandwidth else None
+        self.datasetName = datasetName
+        self.files = {}
+        self.refreshed = {}
+        self.dataSets = []
+        self.requestCounts = {}
+        self.queries = []
+        self.dataVersion = 0
+        self.lastModified = None
+        self.dropConnectionAfter = dropConnectionAfter
+        self.dropsRemaining = dropCount if dropConnectionAfter is not None else 0
+        self.lock = threading.Lock()
+        self.httpServer = ThreadingHTTPServer((host, port), MockRequestHandler)
+        self.httpServer.daemon_threads = True
+        self.httpServer.mock = self
+        self.thread = None
+
+    @property
+    def baseUrl(self):
+        host, port = self.httpServer.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def datasetUrl(self):
+        return f'{self.baseUrl}/api/open/v1/{self.datasetName}'
+
+    # Returns (datasetName, recordCount, getRecord, defaultFields) for an endpoint name, or None. Besides the
+    #   synthetic dataset a DataSets metadata endpoint is served from the entries added with addDataSet(), and
+    #   DataSetFields describes the fields of the synthetic dataset (as version 1).
+    def source(self, name):
+        if name == self.datasetName:
+            return name, self.recordCount, self.record, FIELDS
+        if name == 'DataSets':
+            fields = ['name', 'version', 'lastDataSetRefresh']
+            return name, len(self.dataSets), self.dataSets.__getitem__, fields
+        if name == 'DataSetFields':
+            fields = ['openFemaDataSet', 'datasetVersion', 'name', 'type']
+            entries = [{'openFemaDataSet': self.datasetName, 'datasetVersion': 1, 'name': field, 'type': fieldType}
+                       for field, fieldType in zip(FIELDS, FIELD_TYPES)]
+            return name, len(entries), entries.__getitem__, fields
+        return None
+
+    # Add an entry to the DataSets metadata endpoint
+    def addDataSet(self, name, version, lastDataSetRefresh):
+        self.dataSets.append({'name': name, 'version': version, 'lastDataSetRefresh': lastDataSetRefresh})
+        self.dataVersion += 1
+
+    # Count a request to an endpoint and keep its query parameters in queries, so tests can check what was asked
+    def countRequest(self, name, query):
+        with self.lock:
+            self.requestCounts[name] = self.requestCounts.get(name, 0) + 1
+            self.queries.append((name, query))
+
+    def record(self, i):
+        record = makeRecord(i)
+        if i in self.refreshed:
+            record.update(self.refreshed[i])
+        return record
+
+    # Simulate a dataset refresh: the given record numbers get a new lastRefresh and any other changed values
+    def refreshRecords(self, indices, lastRefresh, **changes):
+        for i in indices:
+            self.refreshed[i] = {'lastRefresh': lastRefresh, **changes}
+        self.dataVersion += 1
+        self.encoded.clear()
+
+    # Every record of the synthetic dataset encoded for a format, built on first use and kept when keepEncoded
+    #   is set (for requests of all the fields), so a benchmark measures the client rather than the mock
+    #   server encoding records
+    def encodedRecords(self, format, fields):
+        key = ('csv' if format == 'csv' else 'json', tuple(fields))
+        with self.lock:
+            if key not in self.encoded:
+                self.encoded[key] = list(encodeRecords((self.record(i) for i in range(self.recordCount)),
+                                                       format, fields))
+            return self.encoded[key]
+
+    # The ETag of a response, which only changes when the data served does
+    def etag(self, path, compressed):
+        tag = hashlib.sha1(f'{self.dataVersion}:{path}'.encode()).hexdigest()
+        return f'"{tag}-gzip"' if compressed else f'"{tag}"'
+
+    # Serve a local file at /files/<name>, returns its url
+    def addFile(self, name, path):
+        self.files[name] = path
+        return f'{self.baseUrl}/files/{name}'
+
+    # Write the whole synthetic dataset to a file in directory and serve it as the dataset's bulk file
+    #   (MockDeclarations.csv, .jsonl, .json, .parquet ...). Returns its url.
+    def addDatasetFile(self, format, directory):
+        name = f'{self.datasetName}.{format}'
+        path = os.path.join(directory, name)
+        records = (self.record(i) for i in range(self.recordCount))
+        if format == 'parquet':
+            # pyarrow is only needed for parquet files
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            writer = None
+            while True:
+                batch = list(itertools.islice(records, 100000))
+                if not batch:
+                    break
+                table = pa.Table.from_pylist(batch)
+                writer = writer or pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+            if writer is not None:
+                writer.close()
+        else:
+            with open(path, 'wb') as f:
+                for piece in renderRecords(self.datasetName, encodeRecords(records, format, FIELDS), format, FIELDS, None):
+                    f.write(piece)
+        self.files[name] = path
+        return f'{self.datasetUrl}.{format}'
+
+    # Returns the byte count after which the current response should be cut off, or None. A response of a known
+    #   length that ends before the cut is left alone and does not use up a drop.
+    def takeDrop(self, length=None):
+        with self.lock:
+            if self.dropsRemaining <= 0 or (length is not None and length <= self.dropConnectionAfter):
+                return None
+            self.dropsRemaining -= 1
+            return self.dropConnectionAfter
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
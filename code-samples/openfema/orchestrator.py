@@ -0,0 +1,161 @@
+# Download many datasets (or queries) at the same time. A nightly job that pulls thirty datasets one after
+#   another takes as long as all thirty downloads added together; run side by side it takes about as long as the
+#   slowest one. The jobs are described by a manifest, a list of entries (or a JSON file holding that list):
+#
+#   [{"dataset": "DisasterDeclarationsSummaries", "version": 2, "format": "jsonl"},
+#    {"dataset": "FimaNfipClaims", "version": 2, "format": "parquet"},
+#    {"name": "txDeclarations", "dataset": "DisasterDeclarationsSummaries", "version": 2,
+#     "select": ["disasterNumber", "declarationDate"], "filter": "state eq 'TX'", "format": "csv"}]
+#
+#   results = fetchAll('manifest.json', 'downloads', concurrency=6, requestsPerSecond=5)
+#
+#   Each entry becomes a query.Query and is saved with Query.download(), so a whole dataset comes from its bulk
+#   file and anything else from a resumable $allrecords stream (download.py) or straight into Parquet. The jobs
+#   run under asyncio: at most `concurrency` at once, each in a worker thread since the downloads themselves are
+#   blocking, and every request made by any job goes through one client of the run's own, limited to
+#   requestsPerSecond. Other code using the helpers at the same time keeps the shared client (client.getClient).
+#   onProgress(job) is called whenever a job starts or ends and every progressInterval seconds while any run.
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import POOL_MAXSIZE, OpenFemaClient, getClient, useClient
+from .query import BASE_URL, Query, RawPredicate
+
+# file extension for each output format
+EXTENSIONS = {'jsonl': 'jsonl', 'csv': 'csv', 'json': 'json', 'jsona': 'json', 'parquet': 'parquet'}
+
+
+class Job:
+    def __init__(self, name, query, format, saveLocation):
+        self.name = name
+        self.query = query
+        self.format = format
+        self.saveLocation = saveLocation
+        self.status = 'pending'         # pending, running, done or failed
+        self.strategy = None
+        self.recordCount = None
+        self.bytesReceived = 0
+        self.startedAt = None
+        self.finishedAt = None
+        self.error = None
+
+    @property
+    def elapsed(self):
+        if self.startedAt is None:
+            return 0.0
+        return (self.finishedAt or time.monotonic()) - self.startedAt
+
+    def onChunk(self, byteCount):
+        self.bytesReceived += byteCount
+
+    def __repr__(self):
+        return f'Job({self.name!r}, {self.status}, {self.bytesReceived} bytes, {self.elapsed:.1f}s)'
+
+
+# Turn the entries of a manifest (a list, or the path of a JSON file holding one) into jobs saving to directory
+def loadManifest(manifest, directory='.', baseUrl=BASE_URL):
+    if isinstance(manifest, (str, os.PathLike)):
+        with open(manifest) as f:
+            manifest = json.load(f)
+    jobs = []
+    names = set()
+    for entry in manifest:
+        name = entry.get('name', entry['dataset'])
+        if name in names:
+            raise ValueError(f'{name!r} appears twice in the manifest, give the entries different names')
+        names.add(name)
+        format = entry.get('format', 'jsonl')
+        if format not in EXTENSIONS:
+            raise ValueError(f'{name}: unsupported format {format!r}')
+
+        query = Query(entry['dataset'], entry['version'], entry.get('baseUrl', baseUrl))
+        select = entry.get('select')
+        if select:
+            query.select(*(select.split(',') if isinstance(select, str) else select))
+        if entry.get('filter'):
+            query.where(RawPredicate(entry['filter']))
+        if entry.get('orderBy'):
+            query.orderBy(*entry['orderBy'].split(',') if isinstance(entry['orderBy'], str) else entry['orderBy'])
+        saveLocation = entry.get('saveLocation') or os.path.join(directory, f'{name}.{EXTENSIONS[format]}')
+        jobs.append(Job(name, query, format, saveLocation))
+    return jobs
+
+
+# The blocking part of a job, run in a worker thread. This is the same resumable download the sample
+#   saveLargeQuery functions use, only started from the event loop. Its requests go through client, the
+#   shared client when none is given.
+def downloadJob(job, client=None):
+    directory = os.path.dirname(job.saveLocation)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with useClient(client or getClient()):
+        # several datasets already download side by side, so each one is a single stream rather than paged
+        return job.query.download(job.saveLocation, job.format, maxWorkers=1, onChunk=job.onChunk)
+
+
+# Run one job once a slot is free. Failures are recorded on the job rather than raised, so one broken dataset
+#   does not stop the others.
+async def runJob(job, slots, executor, onProgress, client=None):
+    async with slots:
+        job.status = 'running'
+        job.startedAt = time.monotonic()
+        onProgress(job)
+        try:
+            plan = await asyncio.get_running_loop().run_in_executor(executor, downloadJob, job, client)
+            job.strategy = plan['strategy']
+            job.recordCount = plan['recordCount']
+            job.status = 'done'
+        except Exception as error:
+            job.status = 'failed'
+            job.error = f'{type(error).__name__}: {error}'
+        job.finishedAt = time.monotonic()
+        onProgress(job)
+    return job
+
+
+async def reportWhileRunning(jobs, onProgress, progressInterval):
+    while True:
+        await asyncio.sleep(progressInterval)
+        for job in jobs:
+            if job.status == 'running':
+                onProgress(job)
+
+
+def printProgress(job):
+    if job.status == 'failed':
+        print(f'{job.name}: failed after {job.elapsed:.1f}s - {job.error}')
+    elif job.status == 'done':
+        print(f'{job.name}: done in {job.elapsed:.1f}s, {job.bytesReceived / 1e6:.1f} MB ({job.strategy})')
+    else:
+        print(f'{job.name}: {job.status}, {job.bytesReceived / 1e6:.1f} MB after {job.elapsed:.1f}s')
+
+
+# Run the jobs side by side, at most `concurrency` at a time and, when requestsPerSecond is given, with no more
+#   than that many requests a second between all of them. Returns the jobs, check each one's status.
+async def runJobs(jobs, concurrency=4, requestsPerSecond=None, onProgress=printProgress, progressInterval=10):
+    slots = asyncio.Semaphore(concurrency)
+    # the jobs share a client of their own, sized for them and limited to the request rate, and handed to each
+    #   job rather than installed as the shared client
+    client = OpenFemaClient(poolMaxsize=max(POOL_MAXSIZE, concurrency), requestsPerSecond=requestsPerSecond)
+    reporter = None
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            if progressInterval:
+                reporter = asyncio.create_task(reportWhileRunning(jobs, onProgress, progressInterval))
+            await asyncio.gather(*(runJob(job, slots, executor, onProgress, client) for job in jobs))
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+        client.close()
+    return jobs
+
+
+# Load a manifest and run it to completion, for calling from ordinary (not async) code
+def fetchAll(manifest, directory='.', concurrency=4, requestsPerSecond=None, baseUrl=BASE_URL,
+             onProgress=printProgress, progressInterval=10):
+    jobs = loadManifest(manifest, directory, baseUrl)
+    return asyncio.run(runJobs(jobs, concurrency, requestsPerSecond, onProgress, progressInterval))
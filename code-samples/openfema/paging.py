@@ -0,0 +1,220 @@
+# Parallel $skip/$top paging. Rather than requesting one page after another, the number of pages is planned
+#   up front from the inline record count and the pages are requested concurrently by a small pool of threads.
+#   Pages are handed to the output in their original order as soon as they are available, so only a bounded
+#   window of pages is ever held in memory regardless of how large the dataset is.
+#
+#   The $skip/$top windows only fit together without gaps or repeats when every page is sorted the same way,
+#   so pages are ordered by id unless the query has an $orderby of its own.
+
+import contextvars
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import getClient
+from .metrics import getMetrics
+
+# The maximum number of records the API will return for a single call (raised from 1000 to 10000 in 2023)
+MAX_TOP = 10000
+
+# The page format requested from the API for each output format
+PAGE_FORMATS = {'json': 'jsonl', 'jsona': 'jsonl', 'jsonl': 'jsonl', 'csv': 'csv'}
+
+
+# Ask the API for a single record with $inlinecount so we learn how many records match the query.
+#   Only the id column is selected to keep the probe as small as possible.
+def getRecordCount(baseUrl, queryParameters=None, timeout=60):
+    probeParameters = dict(queryParameters or {})
+    for name in ('$allrecords', '$skip', '$format', '$metadata'):
+        probeParameters.pop(name, None)
+    probeParameters.update({'$inlinecount': 'allpages', '$select': 'id', '$top': '1'})
+
+    with getClient().get(baseUrl, params=probeParameters, timeout=timeout) as response:
+        response.raise_for_status()
+        return response.json()['metadata']['count']
+
+
+# Split recordCount records into (pageNumber, skip, top) windows of at most `top` records each
+def planPages(recordCount, top=MAX_TOP):
+    if top < 1 or top > MAX_TOP:
+        raise ValueError(f'top must be between 1 and {MAX_TOP}')
+    pageCount = math.ceil(recordCount / top)
+    return [(pageNumber, pageNumber * top, min(top, recordCount - pageNumber * top)) for pageNumber in range(pageCount)]
+
+
+# Retrieve a single page of data as raw bytes. The caller decides what to do with the bytes, there is no
+#   need to decode or parse them just to write them somewhere.
+def fetchPage(baseUrl, queryParameters, skip, top, format='jsona', timeout=300):
+    pageParameters = dict(queryParameters or {})
+    pageParameters.pop('$allrecords', None)
+    if not pageParameters.get('$orderby'):
+        pageParameters['$orderby'] = 'id'
+    pageParameters.update({'$metadata': 'off', '$format': format, '$skip': str(skip), '$top': str(top)})
+
+    with getClient().get(baseUrl, params=pageParameters, timeout=timeout) as response:
+        response.raise_for_status()
+        return response.content
+
+
+# Joins downloaded pages, as raw bytes, into a single output file without decoding or parsing them:
+#     json  - {"rootName":[ ...records... ]}
+#     jsona - [ ...records... ]
+#     jsonl - one record per line
+#     csv   - one header row followed by the records of every page
+#   The json outputs are built from jsonl pages (PAGE_FORMATS): a jsonl record never contains a raw newline, so
+#   turning the newlines between records into commas gives a valid JSON array. For csv the header row of every
+#   page after the first is checked against the first one and dropped.
+#
+#   The output is written to "<saveLocation>.part" and only moved into place by close(), so a failed or repeated
+#   run never leaves a half written or doubled up file behind. recordCount keeps a running total of the records
+#   written, so the file does not need to be loaded again to count them.
+class PageWriter:
+    def __init__(self, saveLocation, format='json', rootName=None):
+        if format not in PAGE_FORMATS:
+            raise ValueError(f'unsupported output format {format!r}, use one of {", ".join(PAGE_FORMATS)}')
+        if format == 'json' and not rootName:
+            raise ValueError('json output needs a rootName for the root element')
+        self.saveLocation = saveLocation
+        self.partLocation = saveLocation + '.part'
+        self.format = format
+        self.header = None
+        self.recordCount = 0
+        self.fileObject = open(self.partLocation, 'wb')
+        if format == 'json':
+            self.fileObject.write(b'{' + json.dumps(rootName).encode() + b':[')
+        elif format == 'jsona':
+            self.fileObject.write(b'[')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, *exc):
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writePage(self, pageNumber, data):
+        metrics = getMetrics()
+        recordsBefore = self.recordCount
+        with metrics.phase('write'):
+            self.writePageData(data)
+        if metrics.enabled:
+            metrics.count('bytesWritten', len(data))
+            if self.recordCount > recordsBefore:
+                metrics.count('records', self.recordCount - recordsBefore)
+
+    def writePageData(self, data):
+        if self.format == 'csv':
+            self.writeCsvPage(data)
+            return
+
+        # blank lines, such as the trailing newline, are not records
+        lines = data.strip(b'\r\n')
+        if b'\n\n' in lines or b'\r' in lines:
+            lines = b'\n'.join(line for line in lines.splitlines() if line.strip())
+        if not lines:
+            return
+        if self.format == 'jsonl':
+            self.fileObject.write(lines + b'\n')
+        else:
+            if self.recordCount:
+                self.fileObject.write(b',')
+            self.fileObject.write(lines.replace(b'\n', b','))
+        self.recordCount += lines.count(b'\n') + 1
+
+    def writeCsvPage(self, data):
+        header, newline, records = data.partition(b'\n')
+        if not newline:
+            return
+        if self.header is None:
+            self.header = header
+            self.fileObject.write(header + b'\n')
+        elif header != self.header:
+            raise ValueError('a page came back with different columns than the first page')
+        if not records.strip():
+            return
+        if not records.endswith(b'\n'):
+            records += b'\n'
+        self.fileObject.write(records)
+        self.recordCount += countCsvRecords(records)
+
+    # Finish the output and move it into place. Returns the number of records written.
+    def close(self):
+        if self.format == 'json':
+            self.fileObject.write(b']}')
+        elif self.format == 'jsona':
+            self.fileObject.write(b']')
+        self.fileObject.close()
+        os.replace(self.partLocation, self.saveLocation)
+        return self.recordCount
+
+    # Give up on the output, removing the temporary file and leaving any earlier file at saveLocation alone
+    def abort(self):
+        self.fileObject.close()
+        if os.path.exists(self.partLocation):
+            os.remove(self.partLocation)
+
+
+# Count the rows in a block of csv records. A quoted value may contain newlines, so a newline only ends a row
+#   when it is outside quotes, i.e. after an even number of quote characters.
+def countCsvRecords(records):
+    if b'"' not in records:
+        return records.count(b'\n')
+    rowCount = 0
+    inQuotes = False
+    for line in records.split(b'\n')[:-1]:
+        inQuotes ^= line.count(b'"') % 2 == 1
+        if not inQuotes:
+            rowCount += 1
+    return rowCount
+
+
+# Download every page of a query concurrently and pass each one, in order, to writePage(pageNumber, data).
+#   maxWorkers bounds the number of simultaneous requests, and at most maxWorkers * 2 pages are downloaded
+#   ahead of the page currently being written so memory stays flat.
+#
+#   onPage(pageNumber, pageCount) is called after each page is written and can be used for progress messages.
+def fetchPagesInOrder(baseUrl, queryParameters, writePage, recordCount=None, top=MAX_TOP, maxWorkers=4,
+                      format='jsona', onPage=None):
+    if recordCount is None:
+        recordCount = getRecordCount(baseUrl, queryParameters)
+    getMetrics().expect('records', recordCount)
+    pages = planPages(recordCount, top)
+    window = max(1, maxWorkers * 2)
+
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        pending = {}
+        nextToSubmit = 0
+        for pageNumber in range(len(pages)):
+            # keep the pool busy, but never run further ahead than the window allows
+            while nextToSubmit < len(pages) and nextToSubmit < pageNumber + window:
+                _, skip, pageTop = pages[nextToSubmit]
+                # in the caller's context, so the pages use the same client as the caller (client.useClient)
+                pending[nextToSubmit] = executor.submit(contextvars.copy_context().run, fetchPage, baseUrl,
+                                                        queryParameters, skip, pageTop, format)
+                nextToSubmit += 1
+
+            # result() re-raises any error from the worker thread, which stops the download
+            try:
+                data = pending.pop(pageNumber).result()
+            except BaseException:
+                for future in pending.values():
+                    future.cancel()
+                raise
+            writePage(pageNumber, data)
+            if onPage:
+                onPage(pageNumber, len(pages))
+
+    return recordCount
+
+
+# Download an entire query with parallel paging into a single file. The default json output is of the form
+#   {"rootName":[...]}, format can also be jsona, jsonl or csv. Returns the number of records written.
+def downloadPages(baseUrl, queryParameters, saveLocation, rootName=None, recordCount=None, top=MAX_TOP, maxWorkers=4,
+                  onPage=None, format='json'):
+    with PageWriter(saveLocation, format, rootName) as writer:
+        fetchPagesInOrder(baseUrl, queryParameters, writer.writePage, recordCount=recordCount, top=top,
+                          maxWorkers=maxWorkers, format=PAGE_FORMATS[format], onPage=onPage)
+    return writer.recordCount
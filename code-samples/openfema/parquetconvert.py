@@ -0,0 +1,187 @@
+# Convert a streamed jsonl or csv query straight into a Parquet file. Only the full datasets are published
+#   as .parquet files, filtered or $select-ed queries come back as jsonl or csv. Rather than saving those and
+#   converting them in a separate pass, the records are gathered into fixed-size row groups as they arrive and
+#   each row group is written to the Parquet file before the next one is started, so memory use is bounded by
+#   the row group size no matter how many records the query returns.
+#
+#   downloadToParquet(baseUrl, {'$select': 'disasterNumber,state,declarationDate', '$format': 'jsonl'}, 'out.parquet')
+#
+#   The column types come from, in order of preference: a pyarrow schema passed in, the dataset's field
+#   definitions from the DataSetFields metadata endpoint (schemaFromMetadata), or the first row group.
+#   Inferred csv columns with zero-padded values such as fipsCountyCode "001" or zip codes stay strings, and
+#   a zero-padded value turning up later in a column inferred as numeric is an error rather than a silently
+#   changed join key.
+#
+#   Requires pyarrow (pip install pyarrow).
+
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .client import getClient
+from .metrics import getMetrics
+from .records import iterRecords, parseRecords
+
+BASE_URL = 'https://www.fema.gov/api/open/'
+
+ROW_GROUP_SIZE = 100000
+
+# a zero-padded code, e.g. "01" or "-007", that would lose its leading zeros as a number
+LEADING_ZERO = r'^[-+]?0[0-9]'
+
+# OpenFEMA data dictionary types and the Arrow type used for each, anything else is stored as a string
+METADATA_TYPES = {
+    'string': pa.string(),
+    'uuid': pa.string(),
+    'date': pa.timestamp('ms', tz='UTC'),
+    'datetime': pa.timestamp('ms', tz='UTC'),
+    'boolean': pa.bool_(),
+    'smallint': pa.int64(),
+    'integer': pa.int64(),
+    'int': pa.int64(),
+    'bigint': pa.int64(),
+    'decimal': pa.float64(),
+    'number': pa.float64(),
+    'float': pa.float64(),
+    'double': pa.float64(),
+}
+
+
+# Build a schema from the DataSetFields metadata endpoint, which describes the type of every field in a dataset.
+#   When only some columns are selected, pass them as `columns` to keep the schema in the same order.
+def schemaFromMetadata(datasetName, version, columns=None, baseUrl=BASE_URL, timeout=60):
+    parameters = {
+        '$filter': f"openFemaDataSet eq '{datasetName}' and datasetVersion eq {int(version)}",
+        '$select': 'name,type',
+        '$metadata': 'off',
+        '$allrecords': 'true',
+    }
+    with getClient().get(baseUrl.rstrip('/') + '/v1/DataSetFields', params=parameters, timeout=timeout) as response:
+        response.raise_for_status()
+        fieldTypes = {field['name']: METADATA_TYPES.get(str(field['type']).lower(), pa.string())
+                      for field in response.json()['DataSetFields']}
+    names = columns if columns else list(fieldTypes)
+    return pa.schema([(name, fieldTypes.get(name, pa.string())) for name in names])
+
+
+def hasLeadingZero(column):
+    return bool(pc.any(pc.match_substring_regex(column, LEADING_ZERO)).as_py())
+
+
+# Work out the type of a column of csv text: whole numbers, decimals and timestamps are recognised,
+#   anything else stays a string. Codes with leading zeros stay strings even when every value is numeric.
+def inferTextType(column):
+    if hasLeadingZero(column):
+        return pa.string()
+    for candidate in (pa.int64(), pa.float64(), pa.timestamp('ms', tz='UTC')):
+        try:
+            column.cast(candidate)
+            return candidate
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            continue
+    return pa.string()
+
+
+# Infer a schema from the first row group. Columns that are entirely empty in it are stored as strings so
+#   values that turn up later still fit. Blank csv values are nulls, as in batchToTable.
+def inferSchema(batch, textOnly=False):
+    names = list(dict.fromkeys(name for record in batch for name in record))
+    fields = []
+    for name in names:
+        values = [record.get(name) for record in batch]
+        if textOnly:
+            values = [value if value != '' else None for value in values]
+        column = pa.array(values)
+        if pa.types.is_null(column.type):
+            fieldType = pa.string()
+        elif textOnly:
+            fieldType = inferTextType(column)
+        else:
+            fieldType = column.type
+        fields.append((name, fieldType))
+    return pa.schema(fields)
+
+
+# Turn a list of records into a table matching the schema. Values are converted column by column, so csv
+#   text and jsonl values are handled alike, e.g. the string "2024-07-16T17:34:52.519Z" becomes a timestamp.
+#   Set inferred when the schema was guessed from csv text, zero-padded values then refuse to become numbers.
+def batchToTable(batch, schema, textOnly=False, inferred=False):
+    columns = []
+    for field in schema:
+        values = [record.get(field.name) for record in batch]
+        if textOnly:
+            values = [value if value != '' else None for value in values]
+        try:
+            column = pa.array(values)
+            if (inferred and pa.types.is_string(column.type) and
+                    (pa.types.is_integer(field.type) or pa.types.is_floating(field.type)) and hasLeadingZero(column)):
+                raise ValueError(f'column {field.name!r} was inferred as {field.type} from the first row group but '
+                                 f'has zero-padded values, pass a schema or use schemaFromMetadata()')
+            if column.type != field.type:
+                column = column.cast(field.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as error:
+            raise ValueError(f'column {field.name!r} does not fit the {field.type} type of the schema ({error}), '
+                             f'pass a schema or use schemaFromMetadata()') from error
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+# Write an iterable of records to a Parquet file, rowGroupSize records at a time. The file is written under a
+#   temporary name and moved into place when complete. Returns the number of records written.
+def writeParquet(records, saveLocation, schema=None, rowGroupSize=ROW_GROUP_SIZE, compression='snappy',
+                 textOnly=False):
+    partLocation = saveLocation + '.part'
+    inferred = textOnly and schema is None
+    metrics = getMetrics()
+    writer = None
+    recordCount = 0
+    batch = []
+    try:
+        for record in records:
+            batch.append(record)
+            if len(batch) < rowGroupSize:
+                continue
+            schema = schema or inferSchema(batch, textOnly)
+            writer = writer or pq.ParquetWriter(partLocation, schema, compression=compression)
+            with metrics.phase('write'):
+                writer.write_table(batchToTable(batch, schema, textOnly, inferred), row_group_size=rowGroupSize)
+            recordCount += len(batch)
+            batch = []
+
+        if batch or writer is None:
+            schema = schema or inferSchema(batch, textOnly)
+            writer = writer or pq.ParquetWriter(partLocation, schema, compression=compression)
+            if batch:
+                with metrics.phase('write'):
+                    writer.write_table(batchToTable(batch, schema, textOnly, inferred), row_group_size=rowGroupSize)
+                recordCount += len(batch)
+        writer.close()
+        writer = None
+        os.replace(partLocation, saveLocation)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(partLocation):
+            os.remove(partLocation)
+    return recordCount
+
+
+# Stream a jsonl or csv query from the API straight into a Parquet file. jsonl is used unless the
+#   query asks for csv, the json formats work too but are slower to parse.
+def downloadToParquet(baseUrl, queryParameters, saveLocation, schema=None, rowGroupSize=ROW_GROUP_SIZE,
+                      compression='snappy'):
+    parameters = dict(queryParameters or {})
+    parameters.setdefault('$format', 'jsonl')
+    parameters.setdefault('$allrecords', 'true')
+    parameters.setdefault('$metadata', 'off')
+    textOnly = parameters['$format'] == 'csv'
+    return writeParquet(iterRecords(baseUrl, parameters), saveLocation, schema, rowGroupSize, compression, textOnly)
+
+
+# Convert an already downloaded jsonl or csv file to Parquet
+def convertFileToParquet(path, format, saveLocation, schema=None, rowGroupSize=ROW_GROUP_SIZE, compression='snappy'):
+    with open(path, 'rb') as f:
+        return writeParquet(parseRecords(f, format), saveLocation, schema, rowGroupSize, compression,
+                            textOnly=format == 'csv')
@@ -0,0 +1,82 @@
+# Check and summarize Parquet files without loading them into memory. A Parquet file ends with a footer that
+#   already records the number of rows and, for every column of every row group, the null count and the
+#   minimum and maximum value. Verifying a download therefore only needs the footer, not the data.
+#
+#   parquetSummary('FimaNfipClaims.parquet')['numRows']
+#   countRecords('FimaNfipClaims.parquet', 'id')          # non-null ids, the same as df['id'].count()
+#
+#   When the data itself is needed, aggregateByGroup() reads one row group at a time and only the columns the
+#   aggregation uses, so tens of millions of rows can be summarized on a small machine:
+#
+#   aggregateByGroup('FimaNfipClaims.parquet', ['state'], sums=['amountPaidOnBuildingClaim'])
+#
+#   Requires pyarrow (pip install pyarrow).
+
+import pyarrow.parquet as pq
+
+from .aggregate import aggregateFiles
+
+
+# Combine a per row group statistic into the running value for the file, None meaning unknown
+def combine(current, value, pick):
+    if current is None or value is None:
+        return value if current is None else current
+    return pick(current, value)
+
+
+# Row count, row group count and per column null counts and min/max values, all from the file footer.
+#   A column's statistic is None when the writer did not record it for every row group.
+def parquetSummary(path):
+    metadata = pq.ParquetFile(path).metadata
+    columns = {}
+    for rowGroupNumber in range(metadata.num_row_groups):
+        rowGroup = metadata.row_group(rowGroupNumber)
+        for columnNumber in range(rowGroup.num_columns):
+            chunk = rowGroup.column(columnNumber)
+            statistics = chunk.statistics
+            summary = columns.setdefault(chunk.path_in_schema, {'nullCount': 0, 'min': None, 'max': None,
+                                                                 'complete': True})
+            if statistics is None or not statistics.has_null_count:
+                summary['complete'] = False
+                summary['nullCount'] = None
+            elif summary['nullCount'] is not None:
+                summary['nullCount'] += statistics.null_count
+            if statistics is not None and statistics.has_min_max:
+                summary['min'] = combine(summary['min'], statistics.min, min)
+                summary['max'] = combine(summary['max'], statistics.max, max)
+            elif rowGroup.num_rows:
+                summary['complete'] = False
+
+    # min/max are only trustworthy when every row group contributed to them
+    for summary in columns.values():
+        if not summary.pop('complete'):
+            summary['min'] = summary['max'] = None
+    return {'numRows': metadata.num_rows, 'numRowGroups': metadata.num_row_groups, 'columns': columns}
+
+
+# The number of records in the file, or the number of non-null values in one column. The footer statistics
+#   are used when present, otherwise only that single column is read, one row group at a time.
+def countRecords(path, column=None):
+    if column is None:
+        return pq.ParquetFile(path).metadata.num_rows
+    summary = parquetSummary(path)
+    if column not in summary['columns']:
+        raise KeyError(f'{column!r} is not a column of {path}')
+    nullCount = summary['columns'][column]['nullCount']
+    if nullCount is not None:
+        return summary['numRows'] - nullCount
+
+    parquetFile = pq.ParquetFile(path)
+    total = 0
+    for rowGroupNumber in range(parquetFile.num_row_groups):
+        values = parquetFile.read_row_group(rowGroupNumber, columns=[column]).column(0)
+        total += len(values) - values.null_count
+    return total
+
+
+# Group the rows by the groupBy columns and compute a count of rows plus the sum, mean, min and max of the
+#   requested columns. Only the columns needed are read, a batch of rows at a time; each batch is reduced to a
+#   small partial result and the partial results are merged at the end (see aggregate.py, which also reads csv
+#   and jsonl and can use several processes). Returns a pyarrow Table, call .to_pandas() on it for a DataFrame.
+def aggregateByGroup(path, groupBy, sums=(), means=(), mins=(), maxs=()):
+    return aggregateFiles(path, groupBy, sums, means, mins, maxs, format='parquet')
@@ -0,0 +1,313 @@
+# Build queries from Python values instead of hand written, hand encoded $filter strings, and let the query
+#   pick the fastest way to download itself.
+#
+#   query = (Query('DisasterDeclarationsSummaries', 2)
+#            .select('disasterNumber', 'state', 'declarationDate', 'incidentType')
+#            .where(field('state') != 'FL', field('declarationDate') >= datetime(2020, 1, 1)))
+#   query.parameters()     # {'$select': 'disasterNumber,...', '$filter': "state ne 'FL' and declarationDate ge '2020-01-01T00:00:00.000Z'"}
+#   query.download('out.jsonl')
+#
+#   Values are written as OData literals by type: strings are quoted (with any ' doubled), numbers and booleans
+#   are written as they are, dates and datetimes become quoted ISO timestamps. Predicates combine with & (and),
+#   | (or) and ~ (not). The parameters are left for requests to percent-encode, so nothing is encoded twice.
+#
+#   plan() sends one cheap probe ($inlinecount with $top=1 and only the id column) to learn how many records
+#   match and picks a strategy for download():
+#     file   - the whole dataset without $filter or $select: the published bulk file (.parquet, .csv, ...) is
+#              downloaded as-is, which needs no work from the API at all
+#     paging - up to PAGING_LIMIT records: pages of $top records requested in parallel (paging.py)
+#     stream - anything else, including very large filtered pulls where $skip gets slow deep into a dataset:
+#              one $allrecords stream that resumes after the last complete record when interrupted (download.py)
+#   A filtered or $select-ed query saved as parquet is always streamed straight into row groups (parquetconvert.py).
+#   Pages and resumed streams both rely on $skip landing on the same records every time, so a query without
+#   orderBy() is downloaded ordered by id.
+
+from datetime import date, datetime, timezone
+
+from .download import streamDownload
+from .metrics import getMetrics
+from .paging import MAX_TOP, PAGE_FORMATS, downloadPages, getRecordCount
+from .records import iterRecords
+
+BASE_URL = 'https://www.fema.gov/api/open/'
+
+# the most records downloaded with parallel paging, beyond this a single $allrecords stream is used
+PAGING_LIMIT = 1000000
+
+# formats the published bulk dataset files come in
+FILE_FORMATS = ('parquet', 'csv', 'json', 'jsona', 'jsonl')
+
+
+# Write a Python value as an OData literal
+def formatLiteral(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return "'" + value.isoformat(timespec='milliseconds') + "Z'"
+    if isinstance(value, date):
+        return "'" + value.isoformat() + "'"
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    raise TypeError(f'{type(value).__name__} values cannot be used in a filter')
+
+
+class Predicate:
+    def __and__(self, other):
+        return Combined('and', [self, asPredicate(other)])
+
+    def __or__(self, other):
+        return Combined('or', [self, asPredicate(other)])
+
+    def __invert__(self):
+        return Not(self)
+
+    def __str__(self):
+        return self.compile()
+
+
+# A filter written out by hand, used as it is
+class RawPredicate(Predicate):
+    def __init__(self, text):
+        self.text = text
+
+    def compile(self):
+        return self.text
+
+
+class Comparison(Predicate):
+    def __init__(self, name, operator, value):
+        self.name = name
+        self.operator = operator
+        self.value = value
+
+    def compile(self):
+        return f'{self.name} {self.operator} {formatLiteral(self.value)}'
+
+
+# startswith(name,'x'), endswith(name,'x') and substringof('x',name)
+class FunctionCall(Predicate):
+    def __init__(self, function, name, value):
+        self.function = function
+        self.name = name
+        self.value = value
+
+    def compile(self):
+        if self.function == 'substringof':
+            return f'substringof({formatLiteral(self.value)},{self.name})'
+        return f'{self.function}({self.name},{formatLiteral(self.value)})'
+
+
+class Combined(Predicate):
+    def __init__(self, operator, predicates):
+        self.operator = operator
+        self.predicates = predicates
+
+    def compile(self):
+        if len(self.predicates) == 1:
+            return self.predicates[0].compile()
+        parts = []
+        for predicate in self.predicates:
+            text = predicate.compile()
+            # nested groups (and hand written filters) keep their own parentheses so and/or precedence never matters
+            grouped = isinstance(predicate, RawPredicate) or \
+                      (isinstance(predicate, Combined) and len(predicate.predicates) > 1)
+            parts.append(f'({text})' if grouped else text)
+        return f' {self.operator} '.join(parts)
+
+
+class Not(Predicate):
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def compile(self):
+        return f'not ({self.predicate.compile()})'
+
+
+def asPredicate(value):
+    if isinstance(value, Predicate):
+        return value
+    if isinstance(value, str):
+        return RawPredicate(value)
+    raise TypeError(f'{value!r} is not a filter')
+
+
+# A column of a dataset, compared with Python values to build predicates: field('state') == 'TX'
+class Field:
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, value):
+        return Comparison(self.name, 'eq', value)
+
+    def __ne__(self, value):
+        return Comparison(self.name, 'ne', value)
+
+    def __gt__(self, value):
+        return Comparison(self.name, 'gt', value)
+
+    def __ge__(self, value):
+        return Comparison(self.name, 'ge', value)
+
+    def __lt__(self, value):
+        return Comparison(self.name, 'lt', value)
+
+    def __le__(self, value):
+        return Comparison(self.name, 'le', value)
+
+    __hash__ = None
+
+    # any of several values, written as (name eq a or name eq b ...)
+    def isIn(self, values):
+        values = list(values)
+        if not values:
+            raise ValueError(f'isIn() on {self.name} needs at least one value')
+        return Combined('or', [Comparison(self.name, 'eq', value) for value in values])
+
+    def startswith(self, text):
+        return FunctionCall('startswith', self.name, text)
+
+    def endswith(self, text):
+        return FunctionCall('endswith', self.name, text)
+
+    def contains(self, text):
+        return FunctionCall('substringof', self.name, text)
+
+
+def field(name):
+    return Field(name)
+
+
+# All of the predicates, or any of them
+def allOf(*predicates):
+    return Combined('and', [asPredicate(predicate) for predicate in predicates])
+
+
+def anyOf(*predicates):
+    return Combined('or', [asPredicate(predicate) for predicate in predicates])
+
+
+class Query:
+    def __init__(self, datasetName, version, baseUrl=BASE_URL):
+        self.datasetName = datasetName
+        self.version = int(version)
+        self.baseUrl = baseUrl
+        self.columns = []
+        self.predicates = []
+        self.ordering = []
+        self.top = None
+
+    @property
+    def endpointUrl(self):
+        return f'{self.baseUrl.rstrip("/")}/v{self.version}/{self.datasetName}'
+
+    # The url of the published bulk file of the whole dataset
+    def fileUrl(self, format):
+        return f'{self.endpointUrl}.{format}'
+
+    # Only download these columns ($select). Called again, the columns are added to the earlier ones.
+    def select(self, *columns):
+        self.columns.extend(column for column in columns if column not in self.columns)
+        return self
+
+    # Keep the records matching all of the predicates (which may also be plain OData filter strings)
+    def where(self, *predicates):
+        self.predicates.extend(asPredicate(predicate) for predicate in predicates)
+        return self
+
+    # Sort by these columns, prefix a column with - to sort it descending
+    def orderBy(self, *columns):
+        self.ordering.extend(f'{column[1:]} desc' if column.startswith('-') else column for column in columns)
+        return self
+
+    # Return at most this many records
+    def limit(self, count):
+        self.top = int(count)
+        return self
+
+    def filterText(self):
+        return allOf(*self.predicates).compile() if self.predicates else None
+
+    # The query parameters, unencoded, ready to pass as params= to requests or to the helpers in this package
+    def parameters(self):
+        parameters = {}
+        if self.columns:
+            parameters['$select'] = ','.join(self.columns)
+        filterText = self.filterText()
+        if filterText:
+            parameters['$filter'] = filterText
+        if self.ordering:
+            parameters['$orderby'] = ','.join(self.ordering)
+        return parameters
+
+    # How many records match, from a single record probe
+    def count(self):
+        recordCount = getRecordCount(self.endpointUrl, self.parameters())
+        return recordCount if self.top is None else min(recordCount, self.top)
+
+    # The whole dataset, exactly as published, is wanted
+    def isWholeDataset(self):
+        return not self.columns and not self.predicates and not self.ordering and self.top is None
+
+    # Decide how download() will fetch the query. Returns a dict with the strategy, the record count (None when
+    #   the bulk file is used, no probe is needed for it) and the url and parameters that will be requested.
+    #   allowPaging=False leaves paging out, for when many queries already run side by side.
+    def plan(self, format='jsonl', allowPaging=True):
+        if format in FILE_FORMATS and self.isWholeDataset():
+            return {'strategy': 'file', 'recordCount': None, 'url': self.fileUrl(format), 'parameters': {}}
+
+        recordCount = self.count()
+        parameters = self.parameters()
+        if not self.ordering:
+            parameters['$orderby'] = 'id'
+        if format == 'parquet':
+            strategy = 'stream'
+        elif allowPaging and format in PAGE_FORMATS and MAX_TOP < recordCount <= PAGING_LIMIT and not self.top:
+            strategy = 'paging'
+        else:
+            strategy = 'stream'
+        if strategy == 'stream':
+            parameters.update({'$allrecords': 'true', '$metadata': 'off'})
+            if self.top is not None:
+                # $allrecords returns everything, a limit is a single page instead
+                del parameters['$allrecords']
+                parameters['$top'] = str(self.top)
+        return {'strategy': strategy, 'recordCount': recordCount, 'url': self.endpointUrl, 'parameters': parameters}
+
+    # Download the query to saveLocation as jsonl, csv, jsona, json or parquet using the strategy plan() picks.
+    #   Returns the plan that was used. onPage is passed to the parallel paging, onChunk to the stream and schema
+    #   (a pyarrow schema) to the parquet conversion. maxWorkers=1 never uses paging.
+    def download(self, saveLocation, format='jsonl', maxWorkers=4, onPage=None, onChunk=None, schema=None):
+        if self.top is not None and self.top > MAX_TOP:
+            raise ValueError(f'limit() can be at most {MAX_TOP}, leave it out to download every record')
+        plan = self.plan(format, allowPaging=maxWorkers > 1)
+        getMetrics().expect('records', plan['recordCount'])
+        if plan['strategy'] == 'file':
+            streamDownload(plan['url'], saveLocation, format='file', onChunk=onChunk)
+        elif plan['strategy'] == 'paging':
+            downloadPages(plan['url'], plan['parameters'], saveLocation, rootName=self.datasetName,
+                          recordCount=plan['recordCount'], maxWorkers=maxWorkers, onPage=onPage, format=format)
+        elif format == 'parquet':
+            # pyarrow is only needed for parquet output
+            from .parquetconvert import downloadToParquet
+            downloadToParquet(plan['url'], plan['parameters'], saveLocation, schema=schema)
+        else:
+            streamDownload(plan['url'], saveLocation, {**plan['parameters'], '$format': format}, onChunk=onChunk)
+        return plan
+
+    # Yield the matching records one at a time (see records.py)
+    def records(self):
+        parameters = {**self.parameters(), '$format': 'jsonl', '$metadata': 'off'}
+        if self.top is None:
+            parameters['$allrecords'] = 'true'
+        else:
+            parameters['$top'] = str(self.top)
+        return iterRecords(self.endpointUrl, parameters)
+
+    def __repr__(self):
+        return f'Query({self.endpointUrl!r}, {self.parameters()!r})'
@@ -0,0 +1,207 @@
+# Stream records one at a time. Instead of loading a whole response with response.json() or json.load(),
+#   iterRecords() parses the data as it arrives and yields one record (a dict) at a time, so memory use
+#   stays flat no matter how large the dataset is.
+#
+#   for record in iterRecords(baseUrl, {'$format': 'jsonl', '$allrecords': 'true'}):
+#       print(record['disasterNumber'])
+#
+#   All four $format values used by the samples are supported:
+#     jsonl - one JSON object per line
+#     csv   - a header row followed by one record per row, values are returned as strings
+#     jsona - a JSON array of records, parsed element by element
+#     json  - the default {"metadata": {...}, "DatasetName": [...]} wrapper, the records in the dataset
+#             array are parsed element by element and the metadata is skipped
+
+import codecs
+import csv
+import json
+
+from .client import getClient
+from .metrics import getMetrics
+
+READ_SIZE = 128 * 1024
+# OpenFEMA records are a few KB at most, a value that still does not decode once this much text is buffered
+#   is malformed rather than incomplete
+MAX_RECORD_SIZE = 8 * 1024 * 1024
+
+decoder = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+
+
+class RecordParseError(ValueError):
+    pass
+
+
+# Incrementally walks a JSON document that arrives in pieces. Text is decoded from the byte stream as
+#   needed and everything before the current position is dropped from time to time, so only about one
+#   read's worth of text (plus the record being parsed) is ever held in memory.
+class IncrementalJsonReader:
+    def __init__(self, stream, readSize=READ_SIZE, maxRecordSize=MAX_RECORD_SIZE):
+        self.stream = stream
+        self.readSize = readSize
+        self.maxRecordSize = maxRecordSize
+        self.textDecoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.position = 0
+        # number of characters dropped from the front of text so far, for error offsets
+        self.dropped = 0
+        self.finished = False
+
+    # Pull the next block of bytes from the stream, returns False once the stream is exhausted
+    def fill(self):
+        if self.finished:
+            return False
+        data = self.stream.read(self.readSize)
+        self.dropped += self.position
+        if not data:
+            self.finished = True
+            self.text = self.text[self.position:] + self.textDecoder.decode(b'', final=True)
+            self.position = 0
+            return False
+        self.text = self.text[self.position:] + self.textDecoder.decode(data)
+        self.position = 0
+        return True
+
+    # Returns the next non-whitespace character without consuming it, or '' at the end of the stream
+    def peek(self):
+        while True:
+            while self.position < len(self.text) and self.text[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.text):
+                return self.text[self.position]
+            if not self.fill():
+                return ''
+
+    # Character offset of the current position from the start of the stream
+    def offset(self):
+        return self.dropped + self.position
+
+    def expect(self, characters):
+        character = self.peek()
+        if character == '' or character not in characters:
+            raise RecordParseError(f'expected one of {characters!r} but found {character or "end of data"!r} '
+                                   f'at offset {self.offset()}')
+        self.position += 1
+        return character
+
+    # Decode one complete JSON value. If the value runs past the end of the text read so far, read more and
+    #   try again. Records are small so this rarely needs more than one retry. A decode that still fails with
+    #   more than maxRecordSize characters buffered is an error, otherwise one bad byte early in a large
+    #   response would have the rest of it read into memory before giving up.
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                result, end = decoder.raw_decode(self.text, self.position)
+            except json.JSONDecodeError as error:
+                if len(self.text) - self.position <= self.maxRecordSize and self.fill():
+                    continue
+                raise RecordParseError(f'invalid JSON at offset {self.offset()}: {error}') from error
+            # a number at the very end of the text read so far may continue in the next block
+            if end == len(self.text) and not self.finished and isinstance(result, (int, float)):
+                if self.fill():
+                    continue
+            self.position = end
+            return result
+
+    # Yield the elements of the array starting at the current position one at a time
+    def arrayItems(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.position += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def parseJsona(stream):
+    reader = IncrementalJsonReader(stream)
+    yield from reader.arrayItems()
+
+
+# The default json format wraps the records in an object, skip over the metadata and any other values
+#   and yield the members of the first array found
+def parseJson(stream):
+    reader = IncrementalJsonReader(stream)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise RecordParseError('expected an object key')
+        reader.expect(':')
+        if key != 'metadata' and reader.peek() == '[':
+            yield from reader.arrayItems()
+        else:
+            reader.value()
+        if reader.expect(',}') == '}':
+            return
+
+
+# Split a binary stream into lines (each ending in a newline, except possibly the last) while reading it in
+#   large blocks. Reading a raw HTTP response with readline() would otherwise read it one byte at a time.
+def iterLines(stream, readSize=READ_SIZE):
+    pending = b''
+    while True:
+        data = stream.read(readSize)
+        if not data:
+            break
+        lines = (pending + data).splitlines(keepends=True)
+        pending = lines.pop() if not lines[-1].endswith(b'\n') else b''
+        yield from lines
+    if pending:
+        yield pending
+
+
+def parseJsonl(stream):
+    for lineNumber, line in enumerate(iterLines(stream)):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            raise RecordParseError(f'invalid JSON on line {lineNumber + 1}: {error}') from error
+
+
+# csv.DictReader takes care of quoted values that span several lines, it just needs to be handed text lines
+def parseCsv(stream):
+    yield from csv.DictReader(line.decode('utf-8') for line in iterLines(stream))
+
+
+PARSERS = {'jsonl': parseJsonl, 'csv': parseCsv, 'jsona': parseJsona, 'json': parseJson}
+
+
+# Yield the records in a binary file-like object (an open file, a response.raw, ...) of the given format
+def parseRecords(stream, format='json'):
+    if format not in PARSERS:
+        raise ValueError(f'unsupported format {format!r}, expected one of {", ".join(PARSERS)}')
+    return PARSERS[format](stream)
+
+
+# Yield the records of a downloaded file
+def iterFileRecords(path, format):
+    with open(path, 'rb') as f:
+        yield from parseRecords(f, format)
+
+
+# Issue a query and yield its records as they arrive. The format comes from $format in queryParameters
+#   unless given explicitly, OpenFEMA returns json when no $format is specified.
+def iterRecords(baseUrl, queryParameters=None, format=None, timeout=(30, 300)):
+    parameters = dict(queryParameters or {})
+    if format:
+        parameters['$format'] = format
+    format = parameters.get('$format', 'json')
+
+    metrics = getMetrics()
+    with getClient().get(baseUrl, params=parameters, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        if not metrics.enabled:
+            yield from parseRecords(response.raw, format)
+            return
+        stream = metrics.timedStream(response.raw)
+        yield from metrics.timedRecords(parseRecords(stream, format), stream)
@@ -0,0 +1,681 @@
+# Keep a whole dataset in memory as columns instead of a list of dicts. Every record parsed into a dict carries
+#   its own copy of every key and of every repeated value ('TX', 'Major Disaster', '2024-01-01T00:00:00.000Z'),
+#   hundreds of bytes a row, so json.load() of DisasterDeclarationsSummaries or the NFIP datasets runs out of
+#   memory long before the data itself would. A RecordStore is filled a record at a time, straight from the
+#   streaming readers, into one typed column per field:
+#     int, float - 8 bytes a value in a flat array
+#     bool       - 1 byte a value
+#     timestamp  - ISO dates are parsed once, as they arrive, into 8 byte milliseconds since 1970 (UTC)
+#     category   - text is dictionary encoded: each distinct value is kept once and a row holds a 4 byte code.
+#                  A column where most values are distinct (ids) switches to plain text below.
+#     string     - the UTF-8 bytes of every value back to back plus an 8 byte offset a row
+#   Nulls cost one byte a row, and only in columns that have them.
+#
+#   store = loadRecords(baseUrl, {'$format': 'jsonl', '$allrecords': 'true'})
+#   store[0]['state'], store[0].declarationDate         # a row view, the date as a datetime
+#   store.toNumpy('declarationDate')                    # datetime64[ms] over the column's own memory
+#   store.toArrow().to_pandas()                         # categories become pandas Categoricals
+#
+#   Rows are RecordView objects with __slots__, a view onto the columns rather than a copy. toNumpy() and
+#   toArrow() wrap the column memory without copying it (only Arrow's 1 bit null and bool bitmaps and the
+#   distinct values of category columns are built), and the arrays stay valid if more records are appended
+#   later: the store then moves on to copies of its columns.
+#
+#   The column types are worked out from the first value that is not null: an int column that meets a float
+#   becomes a float column, and one that meets anything else keeps Python objects. An object column that Arrow
+#   cannot hold as one type (an id sent as a number and later as text) is exported as text, values that are
+#   not strings written as JSON. With csv every value is text, so pass types={'disasterNumber': 'int', ...} to
+#   parse numbers and booleans as they arrive.
+#
+#   Requires numpy (pip install numpy), toArrow() pyarrow.
+
+import json
+import re
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from .records import iterRecords
+
+# rows of a category column after which it is checked for being mostly distinct values
+CATEGORY_CHECK_ROWS = 10000
+
+# parsed timestamps remembered per column, dates repeat a lot
+TIMESTAMP_CACHE = 100000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+ISO_TIMESTAMP = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?(Z|[+-]\d{2}:\d{2})?$')
+
+KINDS = ('int', 'float', 'bool', 'timestamp', 'category', 'string', 'object')
+
+NUMPY_TYPES = {'int': np.int64, 'float': np.float64, 'bool': np.bool_}
+
+
+def parseTimestamp(text):
+    value = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // timedelta(milliseconds=1)
+
+
+def formatTimestamp(milliseconds):
+    return (EPOCH + timedelta(milliseconds=milliseconds)).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+# A number or boolean written as text, as csv has it. Empty text is null.
+def parseText(text, kind):
+    if text == '':
+        return None
+    if kind == 'int':
+        return int(text)
+    if kind == 'float':
+        return float(text)
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    raise ValueError(f'{text!r} is not a boolean')
+
+
+# Nulls are tracked in a bytearray of 1 (value) and 0 (null) that only exists once a column has a null.
+#   markNull() is called once the null's place in the column has been added.
+class Column:
+    kind = None
+
+    def __init__(self, declared=False):
+        self.declared = declared
+        self.validity = None
+        self.nullCount = 0
+
+    def markNull(self):
+        if self.validity is None:
+            self.validity = bytearray(b'\x01') * (len(self) - 1)
+        self.validity.append(0)
+        self.nullCount += 1
+
+    def isValid(self, index):
+        return self.validity is None or self.validity[index]
+
+    # Drop the values after the first `length`, to undo a record that could not be stored whole
+    def truncate(self, length):
+        if self.validity is not None:
+            del self.validity[length:]
+            self.nullCount = self.validity.count(0)
+
+    # Copy the buffers, leaving the old ones to arrays already handed out
+    def detach(self):
+        if self.validity is not None:
+            self.validity = bytearray(self.validity)
+
+    def memoryUsage(self):
+        return len(self.validity) if self.validity is not None else 0
+
+    def nullBitmap(self):
+        import pyarrow as pa
+        if self.validity is None:
+            return None
+        return pa.py_buffer(np.packbits(np.frombuffer(self.validity, np.uint8), bitorder='little'))
+
+
+# int and float values in an array('q') or array('d'), bool values in an array('B'). Nulls are stored as 0
+#   (NaN for floats) and marked in the validity bytes.
+class NumberColumn(Column):
+    TYPECODES = {'int': 'q', 'float': 'd', 'bool': 'B'}
+
+    # the classes a kind takes as they are. The arrays would also take a bool as an int or an int as a bool, so
+    #   the class is checked, like the other columns do, and anything else goes through RecordStore.changeType
+    ACCEPTS = {'int': (int,), 'float': (float, int), 'bool': (bool,)}
+
+    def __init__(self, kind, declared=False, values=None):
+        super().__init__(declared)
+        self.kind = kind
+        self.values = array(self.TYPECODES[kind]) if values is None else values
+        self.filler = float('nan') if kind == 'float' else 0
+        self.accepts = self.ACCEPTS[kind]
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        if value.__class__ not in self.accepts:
+            # None, or text for a declared column
+            if value is None:
+                self.values.append(self.filler)
+                self.markNull()
+                return
+            if value.__class__ is str and self.declared:
+                return self.append(parseText(value, self.kind))
+            raise TypeError(f'{value!r} is not {self.kind}')
+        self.values.append(value)
+        if self.validity is not None:
+            self.validity.append(1)
+
+    def get(self, index):
+        if not self.isValid(index):
+            return None
+        value = self.values[index]
+        return bool(value) if self.kind == 'bool' else value
+
+    def toList(self):
+        return [self.get(index) for index in range(len(self))]
+
+    def truncate(self, length):
+        super().truncate(length)
+        del self.values[length:]
+
+    def detach(self):
+        super().detach()
+        self.values = array(self.values.typecode, self.values)
+
+    def memoryUsage(self):
+        return super().memoryUsage() + len(self.values) * self.values.itemsize
+
+    def toNumpy(self):
+        return np.frombuffer(self.values, NUMPY_TYPES[self.kind])
+
+    def toArrow(self):
+        import pyarrow as pa
+        if self.kind == 'bool':
+            # Arrow keeps booleans as bits
+            mask = None if self.validity is None else np.frombuffer(self.validity, np.uint8) == 0
+            return pa.array(self.toNumpy(), pa.bool_(), mask=mask)
+        arrowType = pa.int64() if self.kind == 'int' else pa.float64()
+        return pa.Array.from_buffers(arrowType, len(self), [self.nullBitmap(), pa.py_buffer(self.values)],
+                                     self.nullCount)
+
+
+# ISO date text parsed once into milliseconds since 1970, UTC
+class TimestampColumn(NumberColumn):
+    def __init__(self, declared=False):
+        super().__init__('int', declared)
+        self.kind = 'timestamp'
+        self.parsed = {}
+
+    def append(self, value):
+        milliseconds = self.parsed.get(value)
+        if milliseconds is None:
+            if value is None or (value == '' and self.declared):
+                # csv has no value as empty text
+                self.values.append(0)
+                self.markNull()
+                return
+            if value.__class__ is not str:
+                raise TypeError(f'{value!r} is not a date')
+            milliseconds = parseTimestamp(value)
+            if len(self.parsed) >= TIMESTAMP_CACHE:
+                self.parsed.clear()
+            self.parsed[value] = milliseconds
+        self.values.append(milliseconds)
+        if self.validity is not None:
+            self.validity.append(1)
+
+    def get(self, index):
+        if not self.isValid(index):
+            return None
+        return EPOCH + timedelta(milliseconds=self.values[index])
+
+    # as the ISO text it came as, for a column that has to fall back to Python objects
+    def toList(self):
+        return [formatTimestamp(self.values[index]) if self.isValid(index) else None for index in range(len(self))]
+
+    def toNumpy(self):
+        return np.frombuffer(self.values, np.int64).view('datetime64[ms]')
+
+    def toArrow(self):
+        import pyarrow as pa
+        return pa.Array.from_buffers(pa.timestamp('ms', tz='UTC'), len(self),
+                                     [self.nullBitmap(), pa.py_buffer(self.values)], self.nullCount)
+
+
+class MostlyDistinct(ValueError):
+    pass
+
+
+# Dictionary encoded text: every distinct value once in `values`, a 4 byte code per row (-1 for null, as
+#   pandas Categoricals use)
+class CategoryColumn(Column):
+    kind = 'category'
+
+    def __init__(self, declared=False):
+        super().__init__(declared)
+        self.codes = array('i')
+        self.values = []
+        self.lookup = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, value):
+        code = self.lookup.get(value)
+        if code is None:
+            if value is None:
+                self.codes.append(-1)
+                self.markNull()
+                return
+            if value.__class__ is not str:
+                raise TypeError(f'{value!r} is not text')
+            if not self.declared and len(self.values) >= CATEGORY_CHECK_ROWS and 2 * len(self.values) > len(self):
+                raise MostlyDistinct(value)
+            code = self.lookup[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+        if self.validity is not None:
+            self.validity.append(1)
+
+    def get(self, index):
+        code = self.codes[index]
+        return None if code < 0 else self.values[code]
+
+    def toList(self):
+        values = self.values + [None]
+        return [values[code] for code in self.codes]
+
+    # values are added in the order they are first used, so the ones still used are those up to the highest code
+    def truncate(self, length):
+        super().truncate(length)
+        del self.codes[length:]
+        used = max(self.codes, default=-1) + 1
+        for value in self.values[used:]:
+            del self.lookup[value]
+        del self.values[used:]
+
+    def detach(self):
+        super().detach()
+        self.codes = array('i', self.codes)
+
+    def memoryUsage(self):
+        return (super().memoryUsage() + len(self.codes) * self.codes.itemsize + sys.getsizeof(self.lookup) +
+                sum(sys.getsizeof(value) for value in self.values))
+
+    # the codes, -1 for null. The values are in .values, pandas.Categorical.from_codes(codes, values) works.
+    def toNumpy(self):
+        return np.frombuffer(self.codes, np.int32)
+
+    def toArrow(self):
+        import pyarrow as pa
+        indices = pa.Array.from_buffers(pa.int32(), len(self), [self.nullBitmap(), pa.py_buffer(self.codes)],
+                                        self.nullCount)
+        return pa.DictionaryArray.from_arrays(indices, pa.array(self.values, pa.string()))
+
+
+# Plain text: the UTF-8 bytes back to back and the offset each value ends at, Arrow's large_string layout
+class StringColumn(Column):
+    kind = 'string'
+
+    def __init__(self, declared=False, values=()):
+        super().__init__(declared)
+        self.data = bytearray()
+        self.offsets = array('q', [0])
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def append(self, value):
+        if value.__class__ is not str:
+            if value is not None:
+                raise TypeError(f'{value!r} is not text')
+            self.offsets.append(len(self.data))
+            self.markNull()
+            return
+        self.data += value.encode('utf-8')
+        self.offsets.append(len(self.data))
+        if self.validity is not None:
+            self.validity.append(1)
+
+    def get(self, index):
+        if not self.isValid(index):
+            return None
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode('utf-8')
+
+    def toList(self):
+        return [self.get(index) for index in range(len(self))]
+
+    def truncate(self, length):
+        super().truncate(length)
+        del self.offsets[length + 1:]
+        del self.data[self.offsets[-1]:]
+
+    def detach(self):
+        super().detach()
+        self.data = bytearray(self.data)
+        self.offsets = array('q', self.offsets)
+
+    def memoryUsage(self):
+        return super().memoryUsage() + len(self.data) + len(self.offsets) * self.offsets.itemsize
+
+    def toNumpy(self):
+        return np.array(self.toList(), dtype=object)
+
+    def toArrow(self):
+        import pyarrow as pa
+        return pa.Array.from_buffers(pa.large_string(), len(self),
+                                     [self.nullBitmap(), pa.py_buffer(self.offsets), pa.py_buffer(self.data)],
+                                     self.nullCount)
+
+
+# Anything else, such as nested objects or a column holding both numbers and text, as Python objects
+class ObjectColumn(Column):
+    kind = 'object'
+
+    def __init__(self, declared=False, values=None):
+        super().__init__(declared)
+        self.values = [] if values is None else values
+        self.nullCount = sum(value is None for value in self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value):
+        self.values.append(value)
+        if value is None:
+            self.nullCount += 1
+
+    def get(self, index):
+        return self.values[index]
+
+    def toList(self):
+        return list(self.values)
+
+    def truncate(self, length):
+        del self.values[length:]
+        self.nullCount = sum(value is None for value in self.values)
+
+    def detach(self):
+        self.values = list(self.values)
+
+    def memoryUsage(self):
+        return sys.getsizeof(self.values) + sum(sys.getsizeof(value) for value in self.values)
+
+    def toNumpy(self):
+        return np.array(self.values, dtype=object)
+
+    # Values that do not convert to one Arrow type become text, e.g. [5, '05', True] -> ['5', '05', 'true'], as do
+    #   ints beyond 64 bits
+    def toArrow(self):
+        import pyarrow as pa
+        try:
+            return pa.array(self.values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            return pa.array([value if value is None or isinstance(value, str) else json.dumps(value, default=str)
+                             for value in self.values], pa.large_string())
+
+
+# A column whose values have all been null so far, its type is decided by the first value that is not
+class NullColumn(Column):
+    kind = 'null'
+
+    def __init__(self):
+        super().__init__()
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, value):
+        if value is not None:
+            raise TypeError('the first value decides the type')
+        self.length += 1
+        self.nullCount += 1
+
+    def get(self, index):
+        return None
+
+    def toList(self):
+        return [None] * self.length
+
+    def truncate(self, length):
+        self.length = self.nullCount = min(self.length, length)
+
+    def toNumpy(self):
+        return np.array(self.toList(), dtype=object)
+
+    def toArrow(self):
+        import pyarrow as pa
+        return pa.nulls(self.length)
+
+
+def newColumn(kind, declared=False):
+    if kind in ('int', 'float', 'bool'):
+        return NumberColumn(kind, declared)
+    if kind == 'timestamp':
+        return TimestampColumn(declared)
+    if kind == 'category':
+        return CategoryColumn(declared)
+    if kind == 'string':
+        return StringColumn(declared)
+    if kind == 'object':
+        return ObjectColumn(declared)
+    raise ValueError(f'unknown column type {kind!r}, use one of {", ".join(KINDS)}')
+
+
+# The column type for a first value
+def kindOf(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, str):
+        return 'timestamp' if ISO_TIMESTAMP.match(value) else 'category'
+    return 'object'
+
+
+# A row of a RecordStore: a view onto the columns, not a copy. Reads like a dict (row['state'],
+#   row.get('state'), row.keys()) and by attribute (row.state).
+class RecordView:
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.store.columns[name].get(self.index)
+
+    def __getattr__(self, name):
+        try:
+            return self.store.columns[name].get(self.index)
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def get(self, name, default=None):
+        column = self.store.columns.get(name)
+        if column is None:
+            return default
+        value = column.get(self.index)
+        return default if value is None else value
+
+    def __contains__(self, name):
+        return name in self.store.columns
+
+    def __iter__(self):
+        return iter(self.store.columns)
+
+    def __len__(self):
+        return len(self.store.columns)
+
+    def keys(self):
+        return self.store.columns.keys()
+
+    def values(self):
+        return [column.get(self.index) for column in self.store.columns.values()]
+
+    def items(self):
+        return [(name, column.get(self.index)) for name, column in self.store.columns.items()]
+
+    def asDict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, RecordView):
+            other = other.asDict()
+        return self.asDict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'RecordView({self.asDict()!r})'
+
+
+class RecordStore:
+    # types optionally sets the type of some columns by name: 'int', 'float', 'bool', 'timestamp', 'category'
+    #   (dictionary encoded text), 'string' or 'object'. A declared column parses text into its type and never
+    #   changes type, the others are worked out from their first value.
+    def __init__(self, types=None):
+        self.types = dict(types or {})
+        for kind in self.types.values():
+            if kind not in KINDS:
+                raise ValueError(f'unknown column type {kind!r}, use one of {", ".join(KINDS)}')
+        self.columns = {}
+        self.appenders = {}             # name -> the column's append method, looked up once
+        self.rowCount = 0
+        self.exported = False
+
+    @classmethod
+    def fromRecords(cls, records, types=None):
+        store = cls(types)
+        store.extend(records)
+        return store
+
+    def __len__(self):
+        return self.rowCount
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.rowCount
+        if not 0 <= index < self.rowCount:
+            raise IndexError('record index out of range')
+        return RecordView(self, index)
+
+    def __iter__(self):
+        for index in range(self.rowCount):
+            yield RecordView(self, index)
+
+    def append(self, record):
+        if self.exported:
+            self.detach()
+        columns, appenders = self.columns, self.appenders
+        try:
+            for name, value in record.items():
+                appendValue = appenders.get(name)
+                if appendValue is None:
+                    appendValue = self.addColumn(name).append
+                try:
+                    appendValue(value)
+                except (TypeError, ValueError, OverflowError) as error:
+                    self.changeType(name, value, error)
+        except BaseException:
+            # some columns may already hold values of the record, take them out again so the columns line up
+            for column in columns.values():
+                if len(column) > self.rowCount:
+                    column.truncate(self.rowCount)
+            raise
+        self.rowCount += 1
+        if len(record) != len(columns):
+            # a field this record does not have is null
+            for name, column in columns.items():
+                if len(column) < self.rowCount:
+                    column.append(None)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+        return self
+
+    # A column that appears after the first record is null in the earlier ones
+    def addColumn(self, name):
+        kind = self.types.get(name)
+        column = newColumn(kind, declared=True) if kind else NullColumn()
+        for _ in range(self.rowCount):
+            column.append(None)
+        self.columns[name] = column
+        self.appenders[name] = column.append
+        return column
+
+    # The value does not fit its column: the first value of a column that was all null so far, an int column
+    #   meeting a float, a category column with mostly distinct values, or mixed values
+    def changeType(self, name, value, error):
+        column = self.columns[name]
+        if column.declared:
+            raise ValueError(f'{value!r} does not fit the {column.kind} column {name!r}') from error
+        if isinstance(column, NullColumn):
+            replacement = newColumn(kindOf(value))
+            for _ in range(len(column)):
+                replacement.append(None)
+        elif column.kind == 'int' and isinstance(value, float):
+            values = array('d', column.values)
+            if column.validity is not None:
+                # nulls were stored as 0 in the int column, a float column has NaN for them
+                for index, valid in enumerate(column.validity):
+                    if not valid:
+                        values[index] = float('nan')
+            replacement = NumberColumn('float', values=values)
+            replacement.validity, replacement.nullCount = column.validity, column.nullCount
+        elif isinstance(error, MostlyDistinct):
+            replacement = StringColumn(values=column.toList())
+        else:
+            replacement = ObjectColumn(values=column.toList())
+        try:
+            replacement.append(value)
+        except (TypeError, ValueError, OverflowError):
+            # e.g. an int beyond 64 bits
+            replacement = ObjectColumn(values=column.toList())
+            replacement.append(value)
+        self.columns[name] = replacement
+        self.appenders[name] = replacement.append
+
+    # Move on to copies of the column buffers, leaving the arrays handed out by toNumpy() and toArrow() intact
+    def detach(self):
+        for column in self.columns.values():
+            column.detach()
+        self.exported = False
+
+    @property
+    def columnTypes(self):
+        return {name: column.kind for name, column in self.columns.items()}
+
+    # Bytes held by each column, including the distinct values of category columns
+    def memoryUsage(self):
+        return {name: column.memoryUsage() for name, column in self.columns.items()}
+
+    # The column as a NumPy array over the store's own memory: int64, float64 (NaN for null), bool and
+    #   datetime64[ms] columns as they are, category columns as their int32 codes (-1 for null, the values are
+    #   in categories(name)). Text and object columns are copied into an object array.
+    def toNumpy(self, name):
+        self.exported = True
+        return self.columns[name].toNumpy()
+
+    def categories(self, name):
+        return list(self.columns[name].values)
+
+    # True where a column is null
+    def isNull(self, name):
+        column = self.columns[name]
+        if isinstance(column, (ObjectColumn, NullColumn)):
+            return np.array([value is None for value in column.toList()], dtype=bool)
+        if column.validity is None:
+            return np.zeros(len(column), dtype=bool)
+        return np.frombuffer(column.validity, np.uint8) == 0
+
+    # A pyarrow Table over the store's own memory, category columns as dictionary arrays
+    def toArrow(self, columns=None):
+        import pyarrow as pa
+        self.exported = True
+        names = list(self.columns) if columns is None else list(columns)
+        return pa.table([self.columns[name].toArrow() for name in names], names=names)
+
+    def toPandas(self, columns=None):
+        return self.toArrow(columns).to_pandas()
+
+    def __repr__(self):
+        return f'RecordStore({self.rowCount} records, {self.columnTypes!r})'
+
+
+# Stream a query into a RecordStore (see records.py for the formats). With csv every value is text, pass
+#   types to have numbers, booleans and dates parsed as they arrive.
+def loadRecords(baseUrl, queryParameters=None, format=None, types=None, timeout=(30, 300)):
+    return RecordStore.fromRecords(iterRecords(baseUrl, queryParameters, format, timeout), types)
@@ -0,0 +1,172 @@
+# Keep a local copy of a dataset up to date by only pulling the records that changed. Every OpenFEMA record
+#   carries a lastRefresh timestamp, so after the first full pull each sync only asks for the records refreshed
+#   since the newest lastRefresh already held locally (the "high-water mark") and upserts them by id into a
+#   SQLite database. A daily refresh then costs time in proportion to the number of changed records rather
+#   than the size of the dataset.
+#
+#   with SyncStore('openfema.sqlite') as store:
+#       syncDataset(store, 'DisasterDeclarationsSummaries', 2)
+#
+#   Each dataset/version gets its own table with the id as primary key, the record's lastRefresh and the full
+#   record as JSON. The high-water marks live in a sync_state table in the same database and are committed in
+#   the same transaction as the records, so an interrupted sync never skips data. Next to them is the
+#   lastDataSetRefresh the DataSets endpoint reported just before the sync started, which freshness.py compares
+#   with to tell whether the dataset has been refreshed since (server time on both sides).
+
+import json
+import re
+import sqlite3
+from datetime import datetime, timezone
+
+from .freshness import FreshnessChecker, parseTimestamp
+from .records import iterRecords
+
+BASE_URL = 'https://www.fema.gov/api/open/'
+
+# records are written to the database in batches of this size
+BATCH_SIZE = 5000
+
+
+class SyncStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                                       dataset TEXT NOT NULL,
+                                       version INTEGER NOT NULL,
+                                       high_water_mark TEXT,
+                                       last_sync TEXT,
+                                       dataset_refresh TEXT,
+                                       PRIMARY KEY (dataset, version))''')
+        # databases created before dataset_refresh was kept get the column added
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(sync_state)')]
+        if 'dataset_refresh' not in columns:
+            self.connection.execute('ALTER TABLE sync_state ADD COLUMN dataset_refresh TEXT')
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    # Table name for a dataset version, e.g. DisasterDeclarationsSummaries_v2
+    @staticmethod
+    def tableName(datasetName, version):
+        if not re.fullmatch(r'\w+', datasetName):
+            raise ValueError(f'invalid dataset name {datasetName!r}')
+        return f'{datasetName}_v{int(version)}'
+
+    def ensureTable(self, datasetName, version):
+        table = self.tableName(datasetName, version)
+        self.connection.execute(f'''CREATE TABLE IF NOT EXISTS "{table}" (
+                                        id TEXT PRIMARY KEY,
+                                        lastRefresh TEXT,
+                                        record TEXT NOT NULL)''')
+        return table
+
+    # Returns the newest lastRefresh synced for the dataset, or None if it has never been synced
+    def getHighWaterMark(self, datasetName, version):
+        row = self.connection.execute('SELECT high_water_mark FROM sync_state WHERE dataset = ? AND version = ?',
+                                      (datasetName, int(version))).fetchone()
+        return row[0] if row else None
+
+    # Returns when the dataset was last synced as an ISO timestamp string, or None if it never has been
+    def getLastSync(self, datasetName, version):
+        row = self.connection.execute('SELECT last_sync FROM sync_state WHERE dataset = ? AND version = ?',
+                                      (datasetName, int(version))).fetchone()
+        return row[0] if row else None
+
+    # Returns the lastDataSetRefresh the server reported when the dataset was last synced, or None if it is not known
+    def getDatasetRefresh(self, datasetName, version):
+        row = self.connection.execute('SELECT dataset_refresh FROM sync_state WHERE dataset = ? AND version = ?',
+                                      (datasetName, int(version))).fetchone()
+        return row[0] if row else None
+
+    def setHighWaterMark(self, datasetName, version, highWaterMark, datasetRefresh=None):
+        if isinstance(datasetRefresh, datetime):
+            datasetRefresh = datasetRefresh.isoformat()
+        self.connection.execute('''INSERT INTO sync_state (dataset, version, high_water_mark, last_sync,
+                                                          dataset_refresh)
+                                   VALUES (?, ?, ?, ?, ?)
+                                   ON CONFLICT (dataset, version) DO UPDATE SET
+                                       high_water_mark = excluded.high_water_mark,
+                                       last_sync = excluded.last_sync,
+                                       dataset_refresh = excluded.dataset_refresh''',
+                                (datasetName, int(version), highWaterMark, datetime.now(timezone.utc).isoformat(),
+                                 datasetRefresh))
+
+    # Insert new records and replace existing ones with the same id. Nothing is committed here, see syncDataset.
+    def upsert(self, datasetName, version, records):
+        table = self.ensureTable(datasetName, version)
+        self.connection.executemany(f'''INSERT INTO "{table}" (id, lastRefresh, record) VALUES (?, ?, ?)
+                                        ON CONFLICT (id) DO UPDATE SET
+                                            lastRefresh = excluded.lastRefresh,
+                                            record = excluded.record''',
+                                    ((record['id'], record.get('lastRefresh'), json.dumps(record)) for record in records))
+
+    def getRecord(self, datasetName, version, id):
+        row = self.connection.execute(f'SELECT record FROM "{self.tableName(datasetName, version)}" WHERE id = ?',
+                                      (id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def recordCount(self, datasetName, version):
+        table = self.ensureTable(datasetName, version)
+        return self.connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+
+    def iterRecords(self, datasetName, version):
+        table = self.ensureTable(datasetName, version)
+        for (record,) in self.connection.execute(f'SELECT record FROM "{table}"'):
+            yield json.loads(record)
+
+
+# Pull everything refreshed since the last sync and upsert it into the store. Returns the number of records
+#   received. The high-water mark is the newest lastRefresh the API itself returned rather than our own clock,
+#   so differences between our clock and the server's cannot cause records to be missed. The filter is `ge`
+#   rather than `gt`: records stamped with the high-water mark that were published after the last sync would
+#   otherwise never be pulled, and the few records received again are simply upserted once more.
+#
+#   The dataset's lastDataSetRefresh is looked up before any record is pulled, so a refresh published while the
+#   sync runs still shows up as newer next time. Pass the FreshnessChecker that found the dataset stale as
+#   `checker` to reuse its answer instead of asking the DataSets endpoint again.
+def syncDataset(store, datasetName, version, baseUrl=BASE_URL, select=None, batchSize=BATCH_SIZE, checker=None):
+    checker = checker or FreshnessChecker(baseUrl)
+    datasetRefresh = checker.refreshTimes([(datasetName, version)])[(datasetName, int(version))]
+    highWaterMark = store.getHighWaterMark(datasetName, version)
+    endpointUrl = f'{baseUrl.rstrip("/")}/v{int(version)}/{datasetName}'
+    queryParameters = {'$format': 'jsonl', '$allrecords': 'true', '$metadata': 'off'}
+    if highWaterMark:
+        queryParameters['$filter'] = f"lastRefresh ge '{highWaterMark}'"
+    if select:
+        # id and lastRefresh are needed to upsert and to move the high-water mark forward
+        queryParameters['$select'] = ','.join(dict.fromkeys(['id', 'lastRefresh', *select]))
+
+    store.ensureTable(datasetName, version)
+    received = 0
+    # timestamps are compared as datetimes, the newest one is kept in the form the server sent it
+    newestRefresh = highWaterMark
+    newestTime = parseTimestamp(highWaterMark) if highWaterMark else None
+    batch = []
+    try:
+        for record in iterRecords(endpointUrl, queryParameters):
+            batch.append(record)
+            refreshed = record.get('lastRefresh')
+            if refreshed:
+                refreshedTime = parseTimestamp(refreshed)
+                if newestTime is None or refreshedTime > newestTime:
+                    newestRefresh, newestTime = refreshed, refreshedTime
+            if len(batch) >= batchSize:
+                store.upsert(datasetName, version, batch)
+                received += len(batch)
+                batch = []
+        store.upsert(datasetName, version, batch)
+        received += len(batch)
+        store.setHighWaterMark(datasetName, version, newestRefresh, datasetRefresh)
+        store.connection.commit()
+    except BaseException:
+        store.connection.rollback()
+        raise
+    return received
@@ -0,0 +1,282 @@
+# Count and check the records in a downloaded jsonl, csv, jsona or json file quickly and with little memory.
+#   The file is memory mapped and scanned as raw bytes, a block at a time, with NumPy doing the per byte work:
+#     jsonl       - every newline ends a record
+#     csv         - a newline ends a record unless it is inside a quoted value, the header row is not counted
+#     jsona, json - a structural scan that skips over strings and tracks the nesting depth, every object that
+#                   opens directly inside the records array is a record. For json that is a top-level array,
+#                   as in records.parseJson, so objects in the metadata block (e.g. "orderby":{}) do not count.
+#   Nothing is decoded or parsed, so counting a multi GB file takes seconds rather than minutes.
+#
+#   validateFile('out.jsonl', 'jsonl')                  # {'recordCount': 51234, 'valid': True, ...}
+#   validateFile('out.csv', 'csv', parse=True)          # also check every record parses, using all cores
+#
+#   With parse=True the file is split into chunks on record boundaries and every record is parsed (json) or
+#   checked for the right number of fields (csv) in parallel worker processes. The byte offset of the first
+#   bad record is reported.
+#
+#   Requires numpy (pip install numpy).
+
+import csv
+import json
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+QUOTE, BACKSLASH, NEWLINE = ord('"'), ord('\\'), ord('\n')
+OPENERS, CLOSERS = (ord('{'), ord('[')), (ord('}'), ord(']'))
+
+# the nesting depth just before a record's opening brace, the records array opens one level up
+RECORD_DEPTH = {'jsona': 1, 'json': 2}
+
+
+class InvalidFile(Exception):
+    def __init__(self, offset, message):
+        super().__init__(f'{message} at byte {offset}')
+        self.offset = offset
+        self.message = message
+
+
+# Scans blocks of a file one after another, carrying the state (inside a string or not, nesting depth, ...)
+#   from one block to the next. scan() returns the file offsets where records start (json formats) or where
+#   the byte after a record's terminating newline is (jsonl, csv). For the json formats recordsEnd is the
+#   offset just after the last records array seen.
+class StructureScanner:
+    # depth is the nesting depth the scan starts at, 0 for a whole file. It defaults to the depth at the start
+    #   of a record, for scanning a chunk of a file that begins on a record.
+    def __init__(self, format, depth=None):
+        self.format = format
+        self.inString = False
+        self.backslashRun = 0
+        self.depth = RECORD_DEPTH.get(format, 0) if depth is None else depth
+        # whether the container the records would be in (opened one level above them) is an array
+        self.inArray = depth is None
+        self.recordsEnd = None
+        self.lastByte = NEWLINE
+
+    # Positions of the quotes in a block of json that are escaped, i.e. preceded by an odd number of
+    #   backslashes. csv has no escapes, a doubled quote simply toggles twice.
+    def escapedQuotes(self, data, quotes):
+        isBackslash = data == BACKSLASH
+        if not isBackslash.any():
+            escaped = quotes[:1] if quotes.size and quotes[0] == 0 and self.backslashRun % 2 else quotes[:0]
+            self.backslashRun = 0
+            return escaped
+
+        # lastOther[i] is the position of the last byte at or before i that is not a backslash (-1 if none), so
+        #   the run of backslashes just before a quote at q is (q - 1) - lastOther[q - 1]
+        positions = np.arange(len(data))
+        lastOther = np.maximum.accumulate(np.where(isBackslash, -1, positions))
+        escaped = quotes[:0]
+        if quotes.size:
+            before = quotes - 1
+            lastBefore = lastOther[np.maximum(before, 0)]
+            run = np.where(before >= 0, before - lastBefore, 0)
+            # runs reaching back to the start of the block continue the run the previous block ended with
+            run += np.where((before < 0) | (lastBefore < 0), self.backslashRun, 0)
+            escaped = quotes[run % 2 == 1]
+        tail = len(data) - 1 - lastOther[-1]
+        self.backslashRun = int(tail) + (self.backslashRun if lastOther[-1] < 0 else 0)
+        return escaped
+
+    def scan(self, block, offset):
+        data = np.frombuffer(block, np.uint8)
+        if not len(data):
+            return np.empty(0, np.int64)
+
+        if self.format == 'jsonl':
+            ends = np.flatnonzero(data == NEWLINE)
+            # blank lines are not records
+            previous = np.where(ends > 0, data[np.maximum(ends - 1, 0)], self.lastByte)
+            ends = ends[previous != NEWLINE]
+            self.lastByte = data[-1]
+            return ends + offset + 1
+
+        # Only the bytes that matter are looked at further: quotes plus newlines (csv) or brackets (json).
+        #   These are a small fraction of the data, so the running counts below work on much smaller arrays.
+        isQuote = data == QUOTE
+        if self.format == 'csv':
+            interesting = isQuote | (data == NEWLINE)
+        else:
+            interesting = isQuote | (data == OPENERS[0]) | (data == OPENERS[1]) | \
+                          (data == CLOSERS[0]) | (data == CLOSERS[1])
+            escaped = self.escapedQuotes(data, np.flatnonzero(isQuote))
+            interesting[escaped] = False
+        self.lastByte = data[-1]
+        positions = np.flatnonzero(interesting)
+        if not positions.size:
+            return positions
+
+        values = data[positions]
+        quoteFlags = values == QUOTE
+        # a running count of quotes mod 2 tells whether each position is inside a string (uint8 overflow keeps
+        #   the parity intact). Brackets and newlines have the same parity before and after themselves.
+        parity = np.cumsum(quoteFlags, dtype=np.uint8) & 1
+        if self.inString:
+            parity ^= 1
+        self.inString = bool(parity[-1])
+        outside = (parity == 0) & ~quoteFlags
+        positions = positions[outside]
+
+        if self.format == 'csv':
+            return positions + offset + 1
+
+        values = values[outside]
+        if not values.size:
+            return positions
+        change = np.where(np.isin(values, OPENERS), 1, -1).astype(np.int32)
+        depthAfter = np.cumsum(change) + self.depth
+        if depthAfter.min() < 0:
+            raise InvalidFile(offset + int(positions[np.argmax(depthAfter < 0)]), 'unbalanced closing bracket')
+        depthBefore = depthAfter - change
+
+        # for every position, whether the innermost container opened at the records array's depth is an array
+        #   rather than an object such as the json metadata block
+        containerDepth = RECORD_DEPTH[self.format] - 1
+        containerOpens = (change == 1) & (depthBefore == containerDepth)
+        lastOpen = np.maximum.accumulate(np.where(containerOpens, np.arange(values.size), -1))
+        inArray = np.where(lastOpen >= 0, values[np.maximum(lastOpen, 0)] == OPENERS[1], self.inArray)
+        starts = positions[(values == OPENERS[0]) & (depthBefore == RECORD_DEPTH[self.format]) & inArray]
+        arrayEnds = positions[(values == CLOSERS[1]) & (depthAfter == containerDepth) & inArray]
+        if arrayEnds.size:
+            self.recordsEnd = offset + int(arrayEnds[-1]) + 1
+        if lastOpen[-1] >= 0:
+            self.inArray = bool(values[lastOpen[-1]] == OPENERS[1])
+        self.depth = int(depthAfter[-1])
+        return starts + offset
+
+
+# Open a file as a memory map, returns None for an empty file (which cannot be mapped)
+def mapFile(f):
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Scan a whole file. Returns the record count, the offset where the data starts (after the csv header), the
+#   offset where it ends (after the json records array), and a list of record boundaries roughly splitEvery
+#   bytes apart for splitting the file between workers.
+def scanFile(path, format, blockSize=BLOCK_SIZE, splitEvery=None):
+    with open(path, 'rb') as f:
+        mapped = mapFile(f)
+        if mapped is None:
+            return 0, 0, 0, []
+        with mapped:
+            size = len(mapped)
+            scanner = StructureScanner(format, depth=0)
+            recordCount = 0
+            dataStart = None
+            splits = []
+            nextSplit = splitEvery
+            for offset in range(0, size, blockSize):
+                boundaries = scanner.scan(mapped[offset:offset + blockSize], offset)
+                if format == 'csv' and dataStart is None and boundaries.size:
+                    # the first line is the header
+                    dataStart = int(boundaries[0])
+                    boundaries = boundaries[1:]
+                recordCount += boundaries.size
+                while splitEvery and boundaries.size and nextSplit <= boundaries[-1]:
+                    split = int(boundaries[np.searchsorted(boundaries, nextSplit)])
+                    splits.append(split)
+                    nextSplit = split + splitEvery
+
+            if scanner.inString:
+                raise InvalidFile(size, 'unterminated string or quoted value')
+            if format in RECORD_DEPTH and scanner.depth != 0:
+                raise InvalidFile(size, 'the file ends before all brackets are closed')
+            # a last record without a terminating newline
+            if scanner.lastByte != NEWLINE and (format == 'jsonl' or (format == 'csv' and dataStart is not None)):
+                recordCount += 1
+            dataEnd = scanner.recordsEnd or size if format in RECORD_DEPTH else size
+            return recordCount, dataStart or 0, dataEnd, [split for split in splits if split < dataEnd]
+
+
+# Parse every record between two record boundaries. Returns (records checked, offset of the first bad
+#   record or None, error message). Runs in a worker process.
+def checkChunk(path, format, start, end, fieldCount):
+    with open(path, 'rb') as f, mapFile(f) as mapped:
+        scanner = StructureScanner(format)
+        boundaries = [start]
+        for offset in range(start, end, BLOCK_SIZE):
+            boundaries.extend(int(boundary) for boundary in
+                              scanner.scan(mapped[offset:min(end, offset + BLOCK_SIZE)], offset))
+        if boundaries[-1] != end:
+            boundaries.append(end)
+        if format in RECORD_DEPTH:
+            # for json formats the boundaries are record starts, the first one is `start` itself
+            boundaries = sorted(set(boundaries))
+
+        checked = 0
+        for recordStart, recordEnd in zip(boundaries, boundaries[1:]):
+            text = mapped[recordStart:recordEnd]
+            try:
+                if format == 'jsonl':
+                    if not text.strip():
+                        continue
+                    json.loads(text)
+                elif format == 'csv':
+                    rows = list(csv.reader(text.decode('utf-8').splitlines(keepends=True)))
+                    if len(rows) != 1 or len(rows[0]) != fieldCount:
+                        raise ValueError(f'expected {fieldCount} fields')
+                else:
+                    decoded = text.decode('utf-8')
+                    record, position = json.JSONDecoder().raw_decode(decoded)
+                    if not isinstance(record, dict) or decoded[position:].strip(' \t\r\n,]}'):
+                        raise ValueError('unexpected data after the record')
+            except ValueError as error:
+                # point at the record itself rather than any blank space before it
+                return checked, recordStart + len(text) - len(text.lstrip()), str(error)
+            checked += 1
+        return checked, None, None
+
+
+# Count the records in a downloaded file and check its structure, optionally parsing every record in
+#   parallel. Returns a dictionary with recordCount, valid, firstBadOffset and error.
+def validateFile(path, format, parse=False, workers=None, blockSize=BLOCK_SIZE):
+    if format not in ('jsonl', 'csv', 'jsona', 'json'):
+        raise ValueError(f'unsupported format {format!r}')
+    result = {'recordCount': 0, 'valid': True, 'firstBadOffset': None, 'error': None}
+    workers = workers or os.cpu_count() or 1
+    size = os.path.getsize(path)
+    splitEvery = max(blockSize, size // (workers * 4)) if parse else None
+    try:
+        recordCount, dataStart, dataEnd, splits = scanFile(path, format, blockSize, splitEvery)
+    except InvalidFile as error:
+        result.update(valid=False, firstBadOffset=error.offset, error=error.message)
+        return result
+    result['recordCount'] = recordCount
+    if not parse or recordCount == 0:
+        return result
+
+    fieldCount = 0
+    if format == 'csv':
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            fieldCount = len(next(csv.reader(f)))
+    if format in RECORD_DEPTH:
+        # json chunks must start on a record, not on the opening bracket(s) of the file
+        with open(path, 'rb') as f, mapFile(f) as mapped:
+            scanner = StructureScanner(format, depth=0)
+            for offset in range(0, size, blockSize):
+                starts = scanner.scan(mapped[offset:offset + blockSize], offset)
+                if starts.size:
+                    dataStart = int(starts[0])
+                    break
+
+    edges = [dataStart] + [split for split in splits if split > dataStart] + [dataEnd]
+    chunks = [(path, format, start, end, fieldCount) for start, end in zip(edges, edges[1:]) if end > start]
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        outcomes = list(executor.map(checkChunk, *zip(*chunks)))
+
+    for checked, badOffset, error in outcomes:
+        if badOffset is not None:
+            result.update(valid=False, firstBadOffset=badOffset, error=error)
+            break
+    return result
+
+
+# Just the number of records in a file
+def countFileRecords(path, format, blockSize=BLOCK_SIZE):
+    return scanFile(path, format, blockSize)[0]
@@ -3,38 +3,31 @@
 
 # define URL for the Disaster Declarations Summaries endpoint
 baseUrl = "https://www.fema.gov/api/open/v2/DisasterDeclarationsSummaries.parquet"
-import requests
-import pandas as pd
+import os
+import sys
+
+# make the openfema helper package in the parent code-samples folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import openfema.download
+from openfema.parquetsummary import countRecords
 
 # location for where the query results are saved
 saveLocation = 'python_output.parquet'
 
+# The download itself is handled by the shared openfema helper package in the code-samples folder (see
+#   openfema/download.py). It streams the file into a temporary file and, if the connection drops, retries
+#   with exponential backoff using an HTTP Range request to continue where it left off. The file at 
+#   saveLocation is only replaced once the download has finished.
 def saveLargeQuery(baseUrl, saveLocation):
-    try:
-        # issue the api call as a stream
-        with requests.get(baseUrl, stream=True) as response:
-            # raises an exception when there is a server or network error
-            response.raise_for_status() 
-
-            # creates a file with if none exists, otherwise overwrites it
-            #   we use the 'wb' mode to specify that we are writing as a binary so windows 
-            #   does not add unneeded carriage returns
-            with open(saveLocation, 'wb') as f:
-                print('Saving file')
-                for chunk in response.iter_content(): 
-                    # we iterate through the chunks and write them to the, you can apply 
-                    #   additional processing as well
-                    f.write(chunk)
-                print('File finished')
-    except:
-        # any additional logic to do when a request fails, such as trying again goes here
-        print(f'file could not be downloaded, server returned ${response.status_code}')    
+    print('Saving file')
+    return openfema.download.saveLargeQuery(baseUrl, None, saveLocation, format='file')
 
-# Now we can use pandas to verify the record count or further analyze the data
+# Now we can verify the record count. The parquet file footer already holds the number of rows and the number of
+#   null values in each column, so there is no need to load the whole file into a DataFrame just to count it (see 
+#   openfema/parquetsummary.py, which can also aggregate large files one row group at a time).
 def verifyFileDownload(saveLocation):
     print('Counting Records')
-    df = pd.read_parquet(saveLocation)  # We create a dataframe with the file we just saved
-    count = df[df.columns[0]].count()   # Here we are counting the number of non null records in the id column
+    count = countRecords(saveLocation, 'id')    # Here we are counting the number of non null records in the id column
     print('Record Count:', count)
 
 # Run the save method
@@ -0,0 +1,36 @@
+# Data retrieval example using Python 3 that saves a filtered query as a parquet file. Only the full datasets are
+#   published as .parquet files, a query using $select or $filter comes back as jsonl or csv. Here the records are
+#   converted to parquet as they arrive, a fixed number of rows (a "row group") at a time, so memory use stays 
+#   bounded and the analysis can read the columnar file directly without a separate conversion step.
+#
+#   The query is built with the openfema helper package in the code-samples folder (see openfema/query.py), which
+#   writes the $select and $filter parameters from Python values, and the conversion is handled by
+#   openfema/parquetconvert.py. Requires pyarrow.
+
+import os
+import sys
+
+import pyarrow.parquet as pq
+
+# make the openfema helper package in the parent code-samples folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from openfema.parquetconvert import schemaFromMetadata
+from openfema.query import Query, field
+
+columns = ['disasterNumber', 'declarationDate', 'declarationTitle', 'state', 'incidentType']
+
+# Only the columns we need are requested, and for purposes of example Florida is excluded
+query = Query('DisasterDeclarationsSummaries', 2).select(*columns).where(field('state') != 'FL')
+
+# location for where the query results are saved
+saveLocation = 'python_query_output.parquet'
+
+# Use the data dictionary of the dataset for the column types, so dates are stored as timestamps
+schema = schemaFromMetadata('DisasterDeclarationsSummaries', 2, columns)
+
+# A one record probe tells how many records match, the records are then streamed into the parquet file
+plan = query.download(saveLocation, format='parquet', schema=schema)
+print(f"{plan['recordCount']} records matched, downloaded using the {plan['strategy']} strategy")
+
+# The record count is in the parquet footer, there is no need to read the data to check it
+print('Record Count:', pq.ParquetFile(saveLocation).metadata.num_rows)
@@ -0,0 +1,36 @@
+# Local analysis example using Python 3 that downloads a dataset once, split into partitions by state and
+#   year, and then answers questions from the partitions without loading the whole dataset. Instead of
+#   pd.read_parquet() on the full file followed by a filter, only the partitions and Parquet row groups that
+#   can hold matching rows are read, and only the columns asked for (see openfema/dataset.py).
+#
+#   The filters are written the same way as API queries (see openfema/query.py). Requires pyarrow.
+
+import os
+import sys
+
+# make the openfema helper package in the parent code-samples folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from openfema.dataset import LocalDataset, YearOf, downloadPartitioned
+from openfema.query import Query, field
+
+# folder the partitioned dataset is kept in, it is only downloaded when missing
+datasetLocation = 'DisasterDeclarationsSummaries'
+
+if os.path.exists(datasetLocation):
+    declarations = LocalDataset(datasetLocation)
+else:
+    # the whole dataset comes from its published parquet file and is split into state=XX/year=YYYY folders
+    declarations = downloadPartitioned(Query('DisasterDeclarationsSummaries', 2), datasetLocation,
+                                       partitionBy=['state', 'year'], computed={'year': YearOf('declarationDate')},
+                                       sortBy=['disasterNumber'])
+
+# county level Individual Assistance declarations in Texas since 2017. The state and the declaration date rule
+#   out every partition but the Texas ones from 2017 on, fipsCountyCode is filtered as the rows are read.
+texas = (declarations
+         .where(field('state') == 'TX', field('declarationDate') >= '2017-01-01T00:00:00.000Z',
+                field('fipsCountyCode') != '000', field('ihProgramDeclared') == True)
+         .select('disasterNumber', 'declarationDate', 'designatedArea', 'incidentType'))
+print(texas.explain())
+
+df = texas.toPandas()
+print(df.groupby(['disasterNumber', 'incidentType']).size().sort_values(ascending=False).head(10))
@@ -0,0 +1,37 @@
+# Summarizing example using Python 3 that totals NFIP claim payments by state and by Special Flood Hazard Area
+#   (SFHA) without loading the 2M+ claims into a DataFrame. The whole FimaNfipClaims dataset is downloaded once as
+#   its published parquet file, then read a batch of rows at a time and only the columns used, each batch reduced
+#   to per group counts and sums that are merged at the end, spread over all of the CPUs.
+#
+#   The same aggregateFiles() call works on a jsonl or csv download of the dataset. The aggregation is handled by
+#   the openfema helper package in the code-samples folder (see openfema/aggregate.py). Requires pyarrow.
+
+import os
+import sys
+
+# make the openfema helper package in the parent code-samples folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from openfema.aggregate import SfhaOf, TotalOf, aggregateFiles
+from openfema.query import Query
+
+# location for where the dataset is saved
+saveLocation = 'FimaNfipClaims.parquet'
+
+# the total paid on a claim is the building, contents and increased cost of compliance payments added together
+computed = {'totalPaid': TotalOf('amountPaidOnBuildingClaim', 'amountPaidOnContentsClaim',
+                                 'amountPaidOnIncreasedCostOfComplianceClaim'),
+            'sfha': SfhaOf('ratedFloodZone')}
+
+# worker processes import this script, so the work is only started when it is run directly
+if __name__ == '__main__':
+    if not os.path.exists(saveLocation):
+        # the whole dataset without $filter or $select comes from the published bulk file
+        Query('FimaNfipClaims', 2).download(saveLocation, format='parquet')
+
+    byState = aggregateFiles(saveLocation, ['state'], sums=['totalPaid'], means=['totalPaid'], maxs=['totalPaid'],
+                             computed=computed, processes=os.cpu_count())
+    print(byState.to_pandas().sort_values('totalPaid_sum', ascending=False).head(10).to_string(index=False))
+
+    bySfha = aggregateFiles(saveLocation, ['sfha', 'yearOfLoss'], sums=['totalPaid'], computed=computed,
+                            processes=os.cpu_count())
+    print(bySfha.to_pandas().tail(10).to_string(index=False))
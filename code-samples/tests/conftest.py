@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# make the openfema helper package in the parent code-samples folder importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from openfema.mockserver import MockOpenFemaServer
+
+
+@pytest.fixture
+def server():
+    with MockOpenFemaServer(recordCount=2500) as server:
+        yield server
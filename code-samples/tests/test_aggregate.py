@@ -0,0 +1,69 @@
+import csv
+import json
+import random
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pytest.importorskip('numpy')
+import pyarrow.parquet as pq
+
+from openfema.aggregate import SfhaOf, TotalOf, aggregateFiles
+
+ZONES = ['A', 'AE', 'V', 'X', 'B', '', None]
+
+
+@pytest.fixture(scope='module')
+def files(tmp_path_factory):
+    generator = random.Random(1)
+    records = [{'id': i, 'state': generator.choice(['TX', 'FL', 'LA', 'NY, "x"']),
+                'countyCode': generator.choice(['01001', '48201']),
+                'building': generator.choice([None, round(generator.random() * 100, 2)]),
+                'contents': round(generator.random() * 10, 2), 'ratedFloodZone': generator.choice(ZONES)}
+               for i in range(6000)]
+    directory = tmp_path_factory.mktemp('aggregate')
+    with open(directory / 'claims.jsonl', 'w') as f:
+        f.writelines(json.dumps(record) + '\n' for record in records)
+    with open(directory / 'claims.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, list(records[0]))
+        writer.writeheader()
+        writer.writerows(records)
+    table = pa.Table.from_pylist(records)
+    pq.write_table(table, directory / 'claims.parquet', row_group_size=500)
+    return directory, table
+
+
+# The same aggregation in one pass over the whole table
+def singlePass(table):
+    table = table.append_column('total', TotalOf('building', 'contents')(table))
+    table = table.append_column('sfha', SfhaOf('ratedFloodZone')(table))
+    expected = table.group_by(['state', 'sfha']).aggregate(
+        [([], 'count_all'), ('total', 'sum'), ('building', 'mean'), ('contents', 'min'), ('contents', 'max')])
+    return {(row['state'], row['sfha']): row for row in expected.to_pylist()}
+
+
+@pytest.mark.parametrize('name', ['claims.jsonl', 'claims.csv', 'claims.parquet'])
+@pytest.mark.parametrize('processes', [None, 3])
+def test_merged_partials_match_a_single_pass(files, name, processes):
+    directory, table = files
+    result = aggregateFiles(str(directory / name), ['state', 'sfha'], sums=['total'], means=['building'],
+                            mins=['contents'], maxs=['contents'], processes=processes, chunkRows=700,
+                            chunkBytes=16 * 1024,
+                            computed={'total': TotalOf('building', 'contents'), 'sfha': SfhaOf('ratedFloodZone')})
+    expected = singlePass(table)
+    got = {(row['state'], row['sfha']): row for row in result.to_pylist()}
+    assert set(got) == set(expected)
+    for key, row in expected.items():
+        assert got[key]['count'] == row['count_all']
+        assert got[key]['total_sum'] == pytest.approx(row['total_sum'])
+        assert got[key]['building_mean'] == pytest.approx(row['building_mean'])
+        assert got[key]['contents_min'] == row['contents_min']
+        assert got[key]['contents_max'] == row['contents_max']
+
+
+def test_csv_group_columns_keep_leading_zeros(files):
+    directory, table = files
+    result = aggregateFiles(str(directory / 'claims.csv'), ['countyCode'], sums=['contents'], processes=2,
+                            chunkBytes=16 * 1024)
+    assert sorted(result.column('countyCode').to_pylist()) == ['01001', '48201']
+    assert sum(result.column('count').to_pylist()) == table.num_rows
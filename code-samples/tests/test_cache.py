@@ -0,0 +1,72 @@
+from openfema.cache import ResponseCache, normalizeRequest
+from openfema.mockserver import MockOpenFemaServer
+
+QUERY = {'$top': '100', '$format': 'jsonl'}
+
+
+def test_equivalent_queries_share_a_key():
+    assert normalizeRequest('HTTP://Host/api/open/v2/X/?$top=5', {'$skip': '0', '$filter': " a eq 'b' "})[0] == \
+        normalizeRequest('http://host/api/open/v2/X', {'$filter': "a eq 'b'", '$top': 5, '$skip': 0})[0]
+
+
+def test_entries_younger_than_max_age_are_used_without_a_request(server, tmp_path):
+    with ResponseCache(str(tmp_path), maxAge=60, checkDatasetRefresh=False) as cache:
+        body = cache.get(server.datasetUrl, QUERY)
+        assert cache.get(server.datasetUrl, dict(reversed(list(QUERY.items())))) == body
+        assert cache.stats == {'hits': 1, 'revalidated': 0, 'downloads': 1, 'evicted': 0}
+        assert server.requestCounts[server.datasetName] == 1
+
+
+def test_etag_revalidation(server, tmp_path):
+    with ResponseCache(str(tmp_path), checkDatasetRefresh=False) as cache:
+        body = cache.get(server.datasetUrl, QUERY)
+        assert cache.get(server.datasetUrl, QUERY) == body
+        assert cache.stats['revalidated'] == 1
+        assert server.requestCounts[server.datasetName] == 2
+
+        server.refreshRecords([0], '2024-02-01T00:00:00.000Z')
+        assert b'2024-02-01' in cache.get(server.datasetUrl, QUERY)
+        assert cache.stats['downloads'] == 2
+
+
+def test_if_modified_since_revalidation(server, tmp_path):
+    server.lastModified = 'Mon, 01 Jan 2024 00:00:00 GMT'
+    with ResponseCache(str(tmp_path), checkDatasetRefresh=False) as cache:
+        body = cache.get(server.datasetUrl, QUERY)
+        assert cache.get(server.datasetUrl, QUERY) == body
+        assert cache.stats['revalidated'] == 1
+
+        server.refreshRecords([0], '2024-02-01T00:00:00.000Z')
+        server.lastModified = 'Thu, 01 Feb 2024 00:00:00 GMT'
+        assert b'2024-02-01' in cache.get(server.datasetUrl, QUERY)
+        assert cache.stats['downloads'] == 2
+
+
+def test_unchanged_dataset_refresh_needs_no_dataset_request(server, tmp_path):
+    server.addDataSet(server.datasetName, 1, '2024-01-01T00:00:00.000Z')
+    with ResponseCache(str(tmp_path)) as cache:
+        cache.get(server.datasetUrl, QUERY)
+    # a later run: one DataSets call tells the entry is current
+    with ResponseCache(str(tmp_path)) as cache:
+        cache.get(server.datasetUrl, QUERY)
+        assert cache.stats['hits'] == 1
+    assert server.requestCounts[server.datasetName] == 1
+
+
+def test_least_recently_used_entries_are_evicted(server, tmp_path):
+    queries = [{'$top': str(top), '$format': 'jsonl'} for top in (100, 101, 102)]
+    with ResponseCache(str(tmp_path), maxAge=60, checkDatasetRefresh=False) as cache:
+        cache.get(server.datasetUrl, queries[0])
+        cache.maxBytes = cache.totalBytes() * 5 // 2
+        cache.get(server.datasetUrl, queries[1])
+        # using the first entry again makes the second the least recently used
+        cache.get(server.datasetUrl, queries[0])
+        cache.get(server.datasetUrl, queries[2])
+        assert cache.stats['evicted'] == 1
+        assert cache.totalBytes() <= cache.maxBytes
+
+        cache.get(server.datasetUrl, queries[0])
+        assert cache.stats['hits'] == 2
+        downloads = cache.stats['downloads']
+        cache.get(server.datasetUrl, queries[1])
+        assert cache.stats['downloads'] == downloads + 1
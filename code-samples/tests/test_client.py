@@ -0,0 +1,15 @@
+from openfema.client import OpenFemaClient
+
+
+def test_connections_are_reused_and_compressed_bytes_counted(server):
+    server.compress = True
+    with OpenFemaClient() as client:
+        for skip in range(0, 2500, 500):
+            with client.get(server.datasetUrl, params={'$skip': skip, '$top': 500, '$format': 'jsonl'}) as response:
+                body = response.content
+        stats = client.stats()
+    assert stats['requests'] == 5
+    assert stats['connectionsOpened'] == 1
+    assert stats['connectionsReused'] == 4
+    # the counted bytes are the gzip compressed bodies, far fewer than the decompressed ones
+    assert 0 < stats['bytesReceived'] < len(body)
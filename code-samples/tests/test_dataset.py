@@ -0,0 +1,85 @@
+from datetime import datetime
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pytest.importorskip('numpy')
+import pyarrow.parquet as pq
+
+from openfema.dataset import LocalDataset, YearOf, partitionFile
+from openfema.mockserver import makeRecord
+from openfema.query import field
+
+# (filter, the same test on a record) - comparisons with a null are false, as in the API
+FILTERS = [
+    (field('state') == 'TX', lambda r: r['state'] == 'TX'),
+    (field('state') == None, lambda r: r['state'] is None),
+    (~(field('state') == 'TX'), lambda r: r['state'] is not None and r['state'] != 'TX'),
+    (field('state').isIn(['TX', 'FL']) & (field('year') >= 2015),
+     lambda r: r['state'] in ('TX', 'FL') and r['year'] >= 2015),
+    (field('declarationDate') >= datetime(2020, 1, 1), lambda r: r['declarationDate'] >= '2020-01-01'),
+    ((field('disasterNumber') == 1004) | (field('disasterNumber') == 1050),
+     lambda r: r['disasterNumber'] in (1004, 1050)),
+    (field('amount') > 12000, lambda r: r['amount'] is not None and r['amount'] > 12000),
+    (~(field('amount') > 12000), lambda r: r['amount'] is not None and r['amount'] <= 12000),
+    (field('incidentType').startswith('Hur') & (field('state') == 'LA'),
+     lambda r: r['incidentType'].startswith('Hur') and r['state'] == 'LA'),
+]
+
+
+@pytest.fixture(scope='module')
+def source(tmp_path_factory):
+    records = [makeRecord(i) for i in range(6000)]
+    for i in range(0, len(records), 97):
+        records[i]['state'] = None
+    for i in range(0, len(records), 89):
+        records[i]['amount'] = None
+    directory = tmp_path_factory.mktemp('dataset')
+    path = str(directory / 'source.parquet')
+    pq.write_table(pa.Table.from_pylist(records), path, row_group_size=500)
+    partitioned = partitionFile(path, str(directory / 'partitioned'), ['state', 'year'],
+                                computed={'year': YearOf('declarationDate')}, sortBy=['disasterNumber'],
+                                rowGroupSize=100)
+    return path, partitioned
+
+
+def sortedRows(table):
+    return sorted(table.to_pylist(), key=lambda row: row['id'])
+
+
+@pytest.mark.parametrize('predicate, test', FILTERS)
+def test_pruned_reads_match_an_unfiltered_read(source, predicate, test):
+    path, partitioned = source
+    datasets = [partitioned]
+    # the single file has no year column
+    if 'year' not in predicate.compile():
+        datasets.append(LocalDataset(path))
+    for dataset in datasets:
+        everything = [dict(row, year=int(row['declarationDate'][:4])) for row in sortedRows(dataset.toTable())]
+        view = dataset.where(predicate)
+        rows = sortedRows(view.toTable())
+        expected = [row for row in everything if test(row)]
+        assert rows == [{column: row[column] for column in dataset.schema.names} for row in expected]
+        assert view.count() == len(expected)
+
+
+def test_partitions_and_row_groups_are_skipped(source, tmp_path):
+    path, partitioned = source
+    assert partitioned.count() == 6000
+    byState = partitioned.where(field('state') == 'TX').explain()
+    assert 0 < byState['filesRead'] < byState['files']
+    assert byState['rowGroupsSkipped'] == 0
+
+    # sorted by disasterNumber, most row groups of each file are ruled out by their statistics
+    dataset = partitionFile(path, str(tmp_path / 'byState'), ['state'], sortBy=['disasterNumber'], rowGroupSize=100)
+    byDisaster = dataset.where(field('disasterNumber') == 1004).explain()
+    assert byDisaster['rowGroupsSkipped'] > 3 * byDisaster['rowGroupsRead']
+    assert byDisaster['rowsRead'] < byDisaster['rows'] / 4
+    assert dataset.where(field('disasterNumber') == 1004).count() == 50
+
+
+def test_select_reads_only_the_columns_asked_for(source):
+    _, partitioned = source
+    table = partitioned.where(field('amount') > 12000).select('id', 'state').toTable()
+    assert table.column_names == ['id', 'state']
+    assert table.num_rows == partitioned.where(field('amount') > 12000).count()
@@ -0,0 +1,43 @@
+import os
+
+from openfema.download import Checkpoint, streamDownload
+from openfema.mockserver import MockOpenFemaServer
+
+
+def test_file_download_resumes_after_dropped_connections(tmp_path):
+    source = tmp_path / 'source.bin'
+    data = os.urandom(3 * 1024 * 1024)
+    source.write_bytes(data)
+    with MockOpenFemaServer(dropConnectionAfter=512 * 1024, dropCount=3) as server:
+        saveLocation = str(tmp_path / 'saved.bin')
+        assert streamDownload(server.addFile('source.bin', str(source)), saveLocation, format='file',
+                              backoff=0.01) == len(data)
+    with open(saveLocation, 'rb') as f:
+        assert f.read() == data
+    assert not os.path.exists(saveLocation + '.part')
+    assert not os.path.exists(saveLocation + '.checkpoint')
+
+
+def test_file_download_picks_up_from_the_part_file_of_the_same_request(tmp_path):
+    source = tmp_path / 'source.bin'
+    data = os.urandom(1024 * 1024)
+    source.write_bytes(data)
+    with MockOpenFemaServer() as server:
+        url = server.addFile('source.bin', str(source))
+        saveLocation = str(tmp_path / 'saved.bin')
+
+        # as left behind by a process that was killed part way: the checkpoint only names the request
+        with open(saveLocation + '.part', 'wb') as f:
+            f.write(data[:300000])
+        Checkpoint(saveLocation + '.checkpoint', {'url': url, 'parameters': {}, 'format': 'file'}).save(0, 0)
+        streamDownload(url, saveLocation, format='file')
+        with open(saveLocation, 'rb') as f:
+            assert f.read() == data
+
+        # a part file of another request is not continued
+        with open(saveLocation + '.part', 'wb') as f:
+            f.write(b'x' * 1000)
+        Checkpoint(saveLocation + '.checkpoint', {'url': url + '?other', 'parameters': {}, 'format': 'file'}).save(0, 0)
+        streamDownload(url, saveLocation, format='file')
+        with open(saveLocation, 'rb') as f:
+            assert f.read() == data
@@ -0,0 +1,88 @@
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from openfema.geometry import GeometryLayer, pointsInPolygon, segmentDistances, simplifyRing
+
+
+# A closed, wobbly ring around (cx, cy), dense enough that simplification removes most of its points
+def wobblyRing(cx=0.0, cy=0.0, radius=1.0, count=2000):
+    angles = np.linspace(0, 2 * math.pi, count, endpoint=False)
+    radii = radius * (1 + 0.05 * np.sin(angles * 7) + 0.01 * np.sin(angles * 53))
+    ring = np.column_stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)])
+    return np.vstack([ring, ring[:1]])
+
+
+def signedArea(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.sum(x[:-1] * y[1:] - x[1:] * y[:-1]))
+
+
+# Even-odd ray casting one point at a time, to check the vectorized version against
+def slowInside(px, py, rings):
+    inside = False
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+            if (y1 > py) != (y2 > py) and px < (x2 - x1) * (py - y1) / (y2 - y1) + x1:
+                inside = not inside
+    return inside
+
+
+@pytest.mark.parametrize('tolerance', [1e-4, 1e-3, 1e-2])
+def test_simplified_ring_is_valid_and_within_tolerance(tolerance):
+    ring = wobblyRing()
+    simplified = simplifyRing(ring, tolerance)
+    assert 4 <= len(simplified) < len(ring)
+    assert np.array_equal(simplified[0], simplified[-1])
+    assert signedArea(simplified) == pytest.approx(signedArea(ring), rel=0.05)
+    # every point removed lies within the tolerance of the simplified outline
+    distances = np.min([segmentDistances(ring, np.broadcast_to(a, ring.shape), np.broadcast_to(b, ring.shape))
+                        for a, b in zip(simplified[:-1], simplified[1:])], axis=0)
+    assert distances.max() <= tolerance * (1 + 1e-9)
+
+
+def test_ring_smaller_than_the_tolerance_collapses():
+    assert simplifyRing(wobblyRing(radius=1e-6), 1e-3) is None
+
+
+def test_layer_tiers_keep_closed_rings_and_every_feature():
+    island = wobblyRing(5, 5, radius=1e-4, count=50).tolist()
+    features = [('big', {'type': 'MultiPolygon', 'coordinates': [[wobblyRing().tolist()], [island]]}, None),
+                ('tiny', {'type': 'Polygon', 'coordinates': [island]}, None)]
+    layer = GeometryLayer(features)
+    for zoom in (2, 6, 10):
+        for geometry in layer.simplified(zoom):
+            polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+            assert polygons
+            for polygon in polygons:
+                for ring in polygon:
+                    assert len(ring) >= 4 and ring[0] == ring[-1]
+    # the island is dropped from the big feature at a low zoom, the tiny feature keeps it as its only polygon
+    assert layer.simplified(2)[0]['type'] == 'Polygon'
+    assert layer.simplified(2)[1]['type'] == 'Polygon'
+
+
+def test_points_in_a_polygon_with_a_hole():
+    outer = np.array([[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]], dtype=float)
+    hole = np.array([[3, 3], [3, 7], [7, 7], [7, 3], [3, 3]], dtype=float)
+    x = np.array([1.0, 5.0, 11.0, 6.9, 3.1, -1.0])
+    y = np.array([1.0, 5.0, 5.0, 8.0, 5.0, 5.0])
+    assert pointsInPolygon(x, y, [outer, hole]).tolist() == [True, False, False, True, False, False]
+
+
+def test_points_in_polygon_match_ray_casting():
+    generator = np.random.default_rng(3)
+    rings = [wobblyRing(count=300), wobblyRing(0.2, -0.1, radius=0.4, count=200)[::-1]]
+    x, y = generator.uniform(-1.2, 1.2, 1000), generator.uniform(-1.2, 1.2, 1000)
+    expected = [slowInside(px, py, rings) for px, py in zip(x, y)]
+    assert pointsInPolygon(x, y, rings).tolist() == expected
+
+
+def test_assign_finds_the_feature_inside_a_hole():
+    donut = {'type': 'Polygon', 'coordinates': [[[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]],
+                                                [[3, 3], [3, 7], [7, 7], [7, 3], [3, 3]]]}
+    center = {'type': 'Polygon', 'coordinates': [[[4, 4], [6, 4], [6, 6], [4, 6], [4, 4]]]}
+    layer = GeometryLayer([('donut', donut, None), ('center', center, None)])
+    assert layer.assign([1, 5, 3.5, 20], [1, 5, 5, 20]) == ['donut', 'center', None, None]
@@ -0,0 +1,81 @@
+import json
+import re
+
+from openfema.metrics import Metrics, getMetrics
+from openfema.records import iterRecords
+
+NAME = r'[a-zA-Z_:][a-zA-Z0-9_:]*'
+LABEL = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\["\\n])*"'
+SAMPLE = re.compile(rf'({NAME})(\{{{LABEL}(?:,{LABEL})*\}})? (-?[0-9.e+-]+)')
+
+
+# Check a file against the Prometheus text format and return {(name, labels): value}
+def readPrometheus(path):
+    with open(path) as f:
+        text = f.read()
+    assert text.endswith('\n')
+    samples, types, helps = {}, {}, set()
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            name = line.split(' ')[2]
+            assert name not in helps
+            helps.add(name)
+        elif line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            assert kind in ('counter', 'gauge') and name in helps and name not in types
+            types[name] = kind
+        else:
+            match = SAMPLE.fullmatch(line)
+            assert match, line
+            name, labels, value = match.groups()
+            # every sample follows the HELP and TYPE lines of its metric
+            assert name in types
+            samples[(name, labels or '')] = float(value)
+    return samples, types
+
+
+def test_prometheus_text_format(tmp_path):
+    metrics = Metrics()
+    metrics.addTime('transfer', 1.5)
+    metrics.addTime('transfer', 0.5)
+    metrics.addTime('write', 0.25)
+    metrics.count('bytesReceived', 1000)
+    metrics.count('records', 10)
+    metrics.expect('records', 40)
+    path = str(tmp_path / 'openfema.prom')
+    metrics.writePrometheus(path, labels={'dataset': 'Fima"Nfip"\\Claims\n'})
+
+    samples, types = readPrometheus(path)
+    dataset = r'dataset="Fima\"Nfip\"\\Claims\n"'
+    assert samples[('openfema_phase_seconds_total', f'{{{dataset},phase="transfer"}}')] == 2.0
+    assert samples[('openfema_phase_calls_total', f'{{{dataset},phase="transfer"}}')] == 2
+    assert samples[('openfema_phase_seconds_total', f'{{{dataset},phase="write"}}')] == 0.25
+    assert samples[('openfema_bytes_received_total', f'{{{dataset}}}')] == 1000
+    assert samples[('openfema_records_total', f'{{{dataset}}}')] == 10
+    assert samples[('openfema_records_expected', f'{{{dataset}}}')] == 40
+    assert ('openfema_eta_seconds', f'{{counter="records",{dataset}}}') in samples
+    assert types['openfema_records_total'] == 'counter' and types['openfema_elapsed_seconds'] == 'gauge'
+
+
+def test_metrics_of_a_streamed_query(server, tmp_path):
+    with Metrics() as metrics:
+        assert getMetrics() is metrics
+        records = list(iterRecords(server.datasetUrl, {'$format': 'jsonl', '$allrecords': 'true'}))
+    assert not getMetrics().enabled
+    snapshot = metrics.snapshot()
+    assert snapshot['counters']['records'] == len(records) == 2500
+    assert snapshot['counters']['requests'] == 1
+    assert {'ttfb', 'transfer', 'parse'} <= set(snapshot['phases'])
+
+    metrics.writeJson(str(tmp_path / 'metrics.json'))
+    with open(tmp_path / 'metrics.json') as f:
+        assert json.load(f)['counters'] == snapshot['counters']
+    metrics.writePrometheus(str(tmp_path / 'openfema.prom'))
+    samples, _ = readPrometheus(str(tmp_path / 'openfema.prom'))
+    assert samples[('openfema_records_total', '')] == 2500
+
+
+def test_disabled_metrics_record_nothing(server):
+    list(iterRecords(server.datasetUrl, {'$format': 'jsonl', '$top': '10'}))
+    snapshot = getMetrics().snapshot()
+    assert snapshot['phases'] == {} and snapshot['counters'] == {}
@@ -0,0 +1,26 @@
+from openfema.client import getClient, useClient
+from openfema.orchestrator import fetchAll
+
+
+def test_jobs_leave_the_shared_client_alone(server, tmp_path):
+    sharedClient = getClient()
+    requestsBefore = sharedClient.stats()['requests']
+    baseUrl = server.baseUrl + '/api/open/'
+    manifest = [{'name': 'tx', 'dataset': server.datasetName, 'version': 1, 'filter': "state eq 'TX'"},
+                {'name': 'ids', 'dataset': server.datasetName, 'version': 1, 'select': 'id', 'format': 'csv'},
+                {'name': 'missing', 'dataset': 'Missing', 'version': 1}]
+    jobs = fetchAll(manifest, str(tmp_path), concurrency=2, baseUrl=baseUrl, progressInterval=0)
+
+    assert [job.status for job in jobs] == ['done', 'done', 'failed']
+    assert getClient() is sharedClient
+    assert sharedClient.stats()['requests'] == requestsBefore
+    # the shared client still works after the run's own client has been closed
+    with sharedClient.get(server.datasetUrl, params={'$top': 1}) as response:
+        assert response.status_code == 200
+
+
+def test_use_client_only_applies_within_the_block(server):
+    sharedClient = getClient()
+    with useClient('stand-in') as client:
+        assert getClient() == client == 'stand-in'
+    assert getClient() is sharedClient
@@ -0,0 +1,74 @@
+import csv
+import json
+import os
+
+import pytest
+import requests
+
+from openfema.mockserver import makeRecord
+from openfema.paging import downloadPages, fetchPagesInOrder, planPages
+
+
+def test_plan_pages_covers_every_record_once():
+    assert planPages(2500, 1000) == [(0, 0, 1000), (1, 1000, 1000), (2, 2000, 500)]
+    assert planPages(0, 1000) == []
+    with pytest.raises(ValueError):
+        planPages(100, 0)
+    with pytest.raises(ValueError):
+        planPages(100, 10001)
+
+
+def test_pages_are_written_in_order(server):
+    pages = []
+    fetchPagesInOrder(server.datasetUrl, None, lambda pageNumber, data: pages.append((pageNumber, data)),
+                      top=300, maxWorkers=4, format='jsonl')
+    assert [pageNumber for pageNumber, _ in pages] == list(range(9))
+    ids = [json.loads(line)['id'] for _, data in pages for line in data.splitlines()]
+    assert ids == [makeRecord(i)['id'] for i in range(2500)]
+
+
+def test_pages_are_ordered_by_id_unless_ordered_otherwise(server):
+    fetchPagesInOrder(server.datasetUrl, None, lambda pageNumber, data: None, recordCount=100, top=50)
+    fetchPagesInOrder(server.datasetUrl, {'$orderby': 'state'}, lambda pageNumber, data: None, recordCount=100, top=50)
+    orderings = [query.get('$orderby') for _, query in server.queries]
+    assert orderings == ['id', 'id', 'state', 'state']
+
+
+@pytest.mark.parametrize('format', ['json', 'jsona', 'jsonl'])
+def test_json_outputs(server, tmp_path, format):
+    saveLocation = str(tmp_path / f'declarations.{format}')
+    assert downloadPages(server.datasetUrl, None, saveLocation, 'MockDeclarations', top=1000, format=format) == 2500
+    with open(saveLocation) as f:
+        if format == 'jsonl':
+            records = [json.loads(line) for line in f]
+        else:
+            records = json.load(f)
+    if format == 'json':
+        records = records['MockDeclarations']
+    assert [record['id'] for record in records] == [makeRecord(i)['id'] for i in range(2500)]
+
+
+def test_csv_keeps_only_the_first_header(server, tmp_path):
+    saveLocation = str(tmp_path / 'declarations.csv')
+    assert downloadPages(server.datasetUrl, {'$select': 'id,state'}, saveLocation, top=400, format='csv') == 2500
+    with open(saveLocation, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['id', 'state']
+    assert ['id', 'state'] not in rows[1:]
+    assert rows[1:] == [[makeRecord(i)['id'], makeRecord(i)['state']] for i in range(2500)]
+
+
+def test_output_is_only_moved_into_place_when_complete(server, tmp_path):
+    saveLocation = str(tmp_path / 'declarations.jsonl')
+    downloadPages(server.datasetUrl, None, saveLocation, top=1000, format='jsonl')
+    assert os.path.exists(saveLocation)
+    assert not os.path.exists(saveLocation + '.part')
+
+    # a failed download leaves the earlier file alone and removes its partial output
+    with open(saveLocation, 'rb') as f:
+        earlier = f.read()
+    with pytest.raises(requests.HTTPError):
+        downloadPages(server.baseUrl + '/api/open/v1/Missing', None, saveLocation, recordCount=2500, format='jsonl')
+    with open(saveLocation, 'rb') as f:
+        assert f.read() == earlier
+    assert not os.path.exists(saveLocation + '.part')
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+
+from openfema.parquetconvert import batchToTable, inferSchema, writeParquet
+
+
+def test_blank_csv_values_do_not_turn_columns_into_strings():
+    batch = [{'n': '1', 'x': '2.5', 'd': '2024-07-16T17:34:52.519Z', 's': 'TX', 'e': ''},
+             {'n': '', 'x': '', 'd': '', 's': '', 'e': ''}]
+    schema = inferSchema(batch, textOnly=True)
+    assert schema.field('n').type == pa.int64()
+    assert schema.field('x').type == pa.float64()
+    assert schema.field('d').type == pa.timestamp('ms', tz='UTC')
+    assert schema.field('s').type == pa.string()
+    assert schema.field('e').type == pa.string()
+    assert batchToTable(batch, schema, textOnly=True).column('n').to_pylist() == [1, None]
+
+
+def test_zero_padded_csv_codes_stay_strings():
+    batch = [{'fipsStateCode': '01', 'fipsCountyCode': '001', 'zipCode': '02134', 'disasterNumber': '4001'},
+             {'fipsStateCode': '48', 'fipsCountyCode': '201', 'zipCode': '77002', 'disasterNumber': '4002'}]
+    schema = inferSchema(batch, textOnly=True)
+    assert schema.field('fipsStateCode').type == pa.string()
+    assert schema.field('fipsCountyCode').type == pa.string()
+    assert schema.field('zipCode').type == pa.string()
+    assert schema.field('disasterNumber').type == pa.int64()
+    table = batchToTable(batch, schema, textOnly=True, inferred=True)
+    assert table.column('fipsCountyCode').to_pylist() == ['001', '201']
+
+
+def test_zero_padded_value_after_the_first_row_group_is_an_error(tmp_path):
+    records = [{'zipCode': '77002'}, {'zipCode': '75201'}, {'zipCode': '02134'}]
+    with pytest.raises(ValueError, match="'zipCode'.*zero-padded"):
+        writeParquet(records, str(tmp_path / 'out.parquet'), rowGroupSize=2, textOnly=True)
+    assert not os.path.exists(tmp_path / 'out.parquet.part')
+
+    # with an explicit schema the caller has decided the type
+    schema = pa.schema([('zipCode', pa.string())])
+    assert writeParquet(records, str(tmp_path / 'out.parquet'), schema, rowGroupSize=2, textOnly=True) == 3
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from openfema.mockserver import MockOpenFemaServer, makeRecord
+from openfema.query import Query, field
+
+
+def mockQuery(server):
+    return Query(server.datasetName, 1, baseUrl=server.baseUrl + '/api/open/')
+
+
+def test_plan_orders_by_id_unless_ordered(server):
+    assert mockQuery(server).select('id').plan()['parameters']['$orderby'] == 'id'
+    assert mockQuery(server).limit(10).plan()['parameters']['$orderby'] == 'id'
+    assert mockQuery(server).orderBy('-state').plan()['parameters']['$orderby'] == 'state desc'
+    assert mockQuery(server).plan('parquet') == {'strategy': 'file', 'recordCount': None,
+                                                 'url': server.datasetUrl + '.parquet', 'parameters': {}}
+
+
+def test_paged_download_is_ordered_by_id(tmp_path):
+    with MockOpenFemaServer(recordCount=25000) as server:
+        plan = mockQuery(server).select('id').download(str(tmp_path / 'ids.jsonl'))
+        assert plan['strategy'] == 'paging'
+        pages = [parameters for name, parameters in server.queries if '$skip' in parameters]
+        assert len(pages) == 3
+        assert all(parameters['$orderby'] == 'id' for parameters in pages)
+
+
+@pytest.mark.parametrize('format', ['jsonl', 'csv'])
+@pytest.mark.parametrize('limit', [None, 9000])
+def test_interrupted_stream_resumes_without_gaps_or_repeats(tmp_path, format, limit):
+    with MockOpenFemaServer(recordCount=20000, dropConnectionAfter=1000000, dropCount=2) as server:
+        # a filter that keeps every record, so the query is streamed rather than served from the bulk file
+        query = mockQuery(server).where(field('amount') >= 0)
+        if limit is not None:
+            query.limit(limit)
+        saveLocation = str(tmp_path / f'declarations.{format}')
+        plan = query.download(saveLocation, format=format, maxWorkers=1)
+        assert plan['strategy'] == 'stream'
+
+        downloads = [parameters for name, parameters in server.queries if '$inlinecount' not in parameters]
+        assert len(downloads) > 1
+        assert all(parameters['$orderby'] == 'id' for parameters in downloads)
+        assert int(downloads[-1]['$skip']) > 0
+        if limit is not None:
+            assert int(downloads[-1]['$skip']) + int(downloads[-1]['$top']) == limit
+
+    with open(saveLocation) as f:
+        if format == 'csv':
+            lines = f.read().splitlines()
+            assert lines[0].startswith('id,')
+            assert lines.count(lines[0]) == 1
+            ids = [line.split(',')[0] for line in lines[1:]]
+        else:
+            ids = [json.loads(line)['id'] for line in f]
+    assert ids == [makeRecord(i)['id'] for i in range(limit or 20000)]
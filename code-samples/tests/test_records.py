@@ -0,0 +1,57 @@
+import io
+import json
+
+import pytest
+
+from openfema.records import IncrementalJsonReader, RecordParseError, parseRecords
+
+RECORDS = [{'id': i, 'state': 'Añasco', 'amount': i * 1.5, 'flags': [True, None]} for i in range(50)]
+METADATA = {'skip': 0, 'filter': '', 'orderby': {}, 'select': None, 'rundate': '2024-01-01T00:00:00.000Z',
+            'top': 1000, 'format': 'json', 'metadata': True, 'entityname': 'MockDeclarations', 'version': 'v1',
+            'url': '/api/open/v1/MockDeclarations', 'count': len(RECORDS)}
+
+
+# A stream that hands out at most a few bytes per read, so values, numbers and multi-byte characters get
+#   split across reads
+class TrickleStream(io.BytesIO):
+    def __init__(self, data, pieceSize):
+        super().__init__(data)
+        self.pieceSize = pieceSize
+
+    def read(self, size=-1):
+        return super().read(self.pieceSize)
+
+
+@pytest.mark.parametrize('pieceSize', [1, 3, 7, 64])
+def test_jsona_split_across_reads(pieceSize):
+    data = json.dumps(RECORDS, ensure_ascii=False).encode('utf-8')
+    assert list(parseRecords(TrickleStream(data, pieceSize), 'jsona')) == RECORDS
+
+
+@pytest.mark.parametrize('pieceSize', [1, 5, 4096])
+def test_json_skips_the_metadata_block(pieceSize):
+    document = {'metadata': METADATA, 'MockDeclarations': RECORDS}
+    data = json.dumps(document, ensure_ascii=False).encode('utf-8')
+    assert list(parseRecords(TrickleStream(data, pieceSize), 'json')) == RECORDS
+
+
+def test_numbers_at_the_end_of_a_read_are_not_cut():
+    reader = IncrementalJsonReader(TrickleStream(b'[12345, 6.75e2]', 3), readSize=3)
+    assert list(reader.arrayItems()) == [12345, 675.0]
+
+
+def test_malformed_json_fails_without_reading_the_whole_stream():
+    body = b'[{"id": 1}, {"id": x}, ' + b', '.join([b'{"id": 2}'] * 100000) + b']'
+    stream = io.BytesIO(body)
+    reader = IncrementalJsonReader(stream, readSize=1024, maxRecordSize=4096)
+    items = reader.arrayItems()
+    assert next(items) == {'id': 1}
+    with pytest.raises(RecordParseError, match='offset 12'):
+        next(items)
+    assert stream.tell() < 8192
+
+
+def test_truncated_json_is_an_error():
+    data = json.dumps({'metadata': METADATA, 'MockDeclarations': RECORDS}).encode('utf-8')[:-40]
+    with pytest.raises(RecordParseError):
+        list(parseRecords(io.BytesIO(data), 'json'))
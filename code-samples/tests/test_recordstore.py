@@ -0,0 +1,60 @@
+import math
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from openfema.recordstore import RecordStore
+
+
+def test_bools_and_ints_do_not_mix_silently():
+    store = RecordStore.fromRecords([{'f': True, 'n': 1}, {'f': 5, 'n': True}])
+    assert store.columnTypes == {'f': 'object', 'n': 'object'}
+    assert [row.asDict() for row in store] == [{'f': True, 'n': 1}, {'f': 5, 'n': True}]
+
+    store = RecordStore.fromRecords([{'x': 1.5}, {'x': 2}])
+    assert store.columnTypes == {'x': 'float'}
+    with pytest.raises(ValueError):
+        RecordStore.fromRecords([{'f': True}, {'f': 1}], types={'f': 'bool'})
+
+
+def test_nulls_stay_nan_when_an_int_column_becomes_float():
+    store = RecordStore.fromRecords([{'a': 1}, {'a': None}, {'a': 2.5}])
+    assert store.columnTypes == {'a': 'float'}
+    values = store.toNumpy('a')
+    assert values[0] == 1.0 and math.isnan(values[1]) and values[2] == 2.5
+    assert store.columns['a'].toList() == [1.0, None, 2.5]
+
+
+def test_a_record_that_does_not_fit_leaves_the_store_as_it_was():
+    store = RecordStore(types={'n': 'int'})
+    store.append({'x': 'a', 's': 'first', 'n': 1})
+    with pytest.raises(ValueError):
+        store.append({'x': 'b', 's': 'second', 'new': 1.5, 'n': 1.5})
+    assert len(store) == 1
+    assert all(len(column) == 1 for column in store.columns.values())
+    assert store.categories('x') == ['a']
+
+    store.append({'x': 'c', 's': 'third', 'n': 2})
+    assert [row.asDict() for row in store] == [{'x': 'a', 's': 'first', 'n': 1, 'new': None},
+                                               {'x': 'c', 's': 'third', 'n': 2, 'new': None}]
+
+
+def test_mixed_object_columns_export_as_text():
+    pytest.importorskip('pyarrow')
+    pytest.importorskip('pandas')
+    records = [{'code': 5, 'detail': {'a': 1}}, {'code': '05', 'detail': [1, 2]}, {'code': None, 'detail': None},
+               {'code': True, 'detail': 'none'}]
+    store = RecordStore.fromRecords(records)
+    assert store.columnTypes == {'code': 'object', 'detail': 'object'}
+    table = store.toArrow()
+    assert table.column('code').to_pylist() == ['5', '05', None, 'true']
+    assert table.column('detail').to_pylist() == ['{"a": 1}', '[1, 2]', None, 'none']
+    assert store.toPandas()['code'].tolist()[:2] == ['5', '05']
+    # rows keep the values as they arrived
+    assert store[0]['code'] == 5
+
+    table = RecordStore.fromRecords([{'x': 1, 'y': [1]}, {'x': 2 ** 70, 'y': [2, 3]}]).toArrow()
+    assert table.column('x').to_pylist() == ['1', str(2 ** 70)]
+    # a column that fits one type is left as it is
+    assert table.column('y').to_pylist() == [[1], [2, 3]]
@@ -0,0 +1,45 @@
+from openfema.freshness import FreshnessChecker, staleSyncedDatasets
+from openfema.mockserver import MockOpenFemaServer
+from openfema.sync import SyncStore, syncDataset
+
+DATASET = ('MockDeclarations', 1)
+
+
+def test_freshness_uses_the_server_refresh_time_seen_at_sync(tmp_path):
+    with MockOpenFemaServer(recordCount=200) as server, SyncStore(str(tmp_path / 'sync.sqlite')) as store:
+        # a refresh time ahead of the local clock must not keep the dataset stale after it has been synced
+        server.addDataSet(*DATASET, '2999-01-01T00:00:00.000Z')
+        baseUrl = server.baseUrl + '/api/open/'
+        checker = FreshnessChecker(baseUrl)
+        assert staleSyncedDatasets(store, [DATASET], checker) == [DATASET]
+
+        assert syncDataset(store, *DATASET, baseUrl, checker=checker) == 200
+        assert server.requestCounts['DataSets'] == 1
+        assert staleSyncedDatasets(store, [DATASET], FreshnessChecker(baseUrl)) == []
+
+        server.dataSets[0]['lastDataSetRefresh'] = '2999-01-02T00:00:00.000Z'
+        assert staleSyncedDatasets(store, [DATASET], FreshnessChecker(baseUrl)) == [DATASET]
+
+
+def test_records_stamped_with_the_high_water_mark_after_a_sync_are_pulled(tmp_path):
+    with MockOpenFemaServer(recordCount=200) as server, SyncStore(str(tmp_path / 'sync.sqlite')) as store:
+        server.addDataSet(*DATASET, '2024-01-01T00:00:00.000Z')
+        baseUrl = server.baseUrl + '/api/open/'
+        assert syncDataset(store, *DATASET, baseUrl) == 200
+        highWaterMark = store.getHighWaterMark(*DATASET)
+
+        # published after the first sync but with the same lastRefresh as the newest record already held
+        server.refreshRecords([7], highWaterMark, state='ZZ')
+        syncDataset(store, *DATASET, baseUrl)
+        assert store.getRecord(*DATASET, server.record(7)['id'])['state'] == 'ZZ'
+        assert store.recordCount(*DATASET) == 200
+
+
+def test_high_water_mark_compares_times_not_strings(tmp_path):
+    with MockOpenFemaServer(recordCount=200) as server, SyncStore(str(tmp_path / 'sync.sqlite')) as store:
+        server.addDataSet(*DATASET, '2024-01-03T00:00:00.000Z')
+        # sorts first as a string but is the later time
+        server.refreshRecords([1], '2024-01-02T00:00:00Z')
+        server.refreshRecords([2], '2024-01-01T23:00:00.000-05:00')
+        syncDataset(store, *DATASET, server.baseUrl + '/api/open/')
+        assert store.getHighWaterMark(*DATASET) == '2024-01-01T23:00:00.000-05:00'
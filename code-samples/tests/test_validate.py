@@ -0,0 +1,102 @@
+import csv
+import json
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from openfema.mockserver import makeRecord
+from openfema.validate import countFileRecords, validateFile
+
+RECORDS = [dict(makeRecord(i), title='say "hi", {not a bracket} \\ [x]') for i in range(300)]
+# the metadata block OpenFEMA sends ahead of the records, with an object inside it
+METADATA = {'skip': 0, 'filter': '', 'orderby': {}, 'select': None, 'rundate': '2024-07-16T17:34:52.519Z',
+            'top': 1000, 'format': 'json', 'metadata': True, 'entityname': 'DisasterDeclarationsSummaries',
+            'version': 'v2', 'url': '/api/open/v2/DisasterDeclarationsSummaries', 'count': len(RECORDS)}
+
+
+def writeFile(path, format, records=RECORDS):
+    if format == 'jsonl':
+        path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    elif format == 'csv':
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(records[0]))
+            writer.writeheader()
+            writer.writerows(records)
+    elif format == 'jsona':
+        path.write_text(json.dumps(records))
+    else:
+        path.write_text(json.dumps({'metadata': METADATA, 'DisasterDeclarationsSummaries': records}))
+    return str(path)
+
+
+# a small block size makes strings, escapes and brackets fall across block boundaries
+@pytest.mark.parametrize('format', ['jsonl', 'csv', 'jsona', 'json'])
+@pytest.mark.parametrize('blockSize', [7, 4096])
+def test_counts_match_the_records_written(tmp_path, format, blockSize):
+    path = writeFile(tmp_path / f'out.{format}', format)
+    assert countFileRecords(path, format, blockSize) == len(RECORDS)
+
+
+@pytest.mark.parametrize('format', ['jsonl', 'csv', 'jsona', 'json'])
+def test_parse_accepts_a_valid_file(tmp_path, format):
+    path = writeFile(tmp_path / f'out.{format}', format)
+    result = validateFile(path, format, parse=True, workers=3, blockSize=4096)
+    assert result == {'recordCount': len(RECORDS), 'valid': True, 'firstBadOffset': None, 'error': None}
+
+
+def test_json_metadata_objects_are_not_records(tmp_path):
+    path = tmp_path / 'out.json'
+    path.write_text('{"metadata":{"skip":0,"orderby":{},"select":null,"count":2},'
+                    '"DisasterDeclarationsSummaries":[{"id":1},{"id":2}]}')
+    assert validateFile(str(path), 'json', parse=True) == {'recordCount': 2, 'valid': True, 'firstBadOffset': None,
+                                                           'error': None}
+    # metadata after the records array
+    path.write_text('{"DisasterDeclarationsSummaries":[{"id":1},{"id":2}],"metadata":{"orderby":{"id":{}}}}')
+    assert validateFile(str(path), 'json', parse=True)['recordCount'] == 2
+
+
+def test_jsonl_bad_record_offset(tmp_path):
+    lines = [json.dumps(record) + '\n' for record in RECORDS[:50]]
+    lines[30] = lines[30][:-5] + '\n'
+    path = tmp_path / 'out.jsonl'
+    path.write_text(''.join(lines))
+    result = validateFile(str(path), 'jsonl', parse=True, workers=2, blockSize=1024)
+    assert not result['valid']
+    assert result['firstBadOffset'] == len(''.join(lines[:30]))
+    assert result['recordCount'] == 50
+
+
+def test_csv_wrong_field_count_offset(tmp_path):
+    path = writeFile(tmp_path / 'out.csv', 'csv', RECORDS[:20])
+    lines = open(path, newline='').read().splitlines(keepends=True)
+    lines[11] = lines[11].replace(',', ';', 1)
+    open(path, 'w', newline='').write(''.join(lines))
+    result = validateFile(path, 'csv', parse=True, workers=2)
+    assert not result['valid']
+    assert result['firstBadOffset'] == len(''.join(lines[:11]))
+
+
+def test_json_bad_record_offset(tmp_path):
+    path = writeFile(tmp_path / 'out.json', 'json', RECORDS[:20])
+    text = open(path).read()
+    badId = json.dumps(RECORDS[12]['id'])
+    recordStart = text.rindex('{', 0, text.index(badId))
+    # a missing colon in the thirteenth record
+    open(path, 'w').write(text[:recordStart + 1] + '"id" 1, ' + text[recordStart + 1:])
+    result = validateFile(path, 'json', parse=True, workers=2)
+    assert result['recordCount'] == 20
+    assert not result['valid']
+    assert result['firstBadOffset'] == recordStart
+
+
+@pytest.mark.parametrize('text, offset, error', [
+    ('[{"id": 1}, {"id": 2}]]', 22, 'unbalanced closing bracket'),
+    ('[{"id": 1}, {"id": 2}', 21, 'the file ends before all brackets are closed'),
+    ('[{"id": 1}, {"id": "2}]', 23, 'unterminated string or quoted value'),
+])
+def test_structure_errors(tmp_path, text, offset, error):
+    path = tmp_path / 'out.jsona'
+    path.write_text(text)
+    result = validateFile(str(path), 'jsona')
+    assert (result['valid'], result['firstBadOffset'], result['error']) == (False, offset, error)